@@ -0,0 +1,231 @@
+from env import SUMO_PARAMS
+from env.custom_env import RLController, Baselines
+
+import os
+import time
+import random
+import argparse
+import numpy as np
+from csv import DictWriter
+from datetime import datetime
+from colorama import Fore
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.cycles = args.cycles
+        self.seed = args.seed
+        self.backends = args.backends
+        self.benches = args.benches
+        self.baselines = args.baselines
+        self.out = args.out
+        self.rows = []
+
+        print()
+        print("BENCHMARK")
+        print()
+        [print(arg, "=", getattr(args, arg)) for arg in vars(args)]
+
+    def record(self, bench, label, **metrics):
+        """Keeps a measured result for the results file."""
+        self.rows.append({"bench": bench, "label": label, **{k: float(v) for k, v in metrics.items()}})
+
+    def write_results(self):
+        # One CSV per run, so measured numbers can be quoted from the file instead of the console
+        if not self.out or not self.rows:
+            return
+        os.makedirs(self.out, exist_ok=True)
+        path = os.path.join(self.out, "benchmark_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv")
+        fieldnames = sorted({k for row in self.rows for k in row} - {"bench", "label"})
+        with open(path, 'w', newline='') as f:
+            csv_writer = DictWriter(f, delimiter=',', lineterminator='\n', fieldnames=["bench", "label"] + fieldnames)
+            csv_writer.writeheader()
+            csv_writer.writerows(self.rows)
+        print()
+        print("Results written to " + path)
+
+    def run_cycles(self, env, with_info=False):
+        """
+        Runs `cycles` random 40s control cycles (restarting the episode if it ends) and times them.
+        with_info also builds the diagnostic info of every cycle, as evaluation does.
+        """
+        random.seed(self.seed)
+        env.reset()
+
+        sim_steps, cycles = 0, 0
+        start_time = time.perf_counter()
+
+        while cycles < self.cycles:
+            sim_time = env.get_current_time()
+            env.step(random.randrange(env.action_space_n))
+            if with_info:
+                env.info()
+            sim_steps += int(round((env.get_current_time() - sim_time) / env.sim_step_length))
+            cycles += 1
+
+            if env.done():
+                env.reset()
+
+        return cycles, sim_steps, time.perf_counter() - start_time
+
+    def bench_backends(self):
+        results = {}
+
+        for backend in self.backends:
+            SUMO_PARAMS["backend"] = backend
+            env = RLController(gui=False, log=False, rnd=(False, False))
+
+            if env.backend != backend:
+                print(Fore.YELLOW, "Skipping backend " + backend + " (not available)", Fore.RESET)
+                env.close()
+                continue
+
+            cycles, sim_steps, wall_time = self.run_cycles(env)
+            env.close()
+
+            results[backend] = (cycles / wall_time, sim_steps / wall_time)
+            self.record("backends", backend, cycles_per_sec=cycles / wall_time, sim_steps_per_sec=sim_steps / wall_time,
+                        cycles=cycles, wall_sec=wall_time)
+
+        print()
+        print("Backend", "|", "Cycles / s", "|", "Sim Steps / s")
+        for backend, (cycles_per_sec, sim_steps_per_sec) in results.items():
+            print(backend, "|", round(cycles_per_sec, 2), "|", round(sim_steps_per_sec, 2))
+
+        return results
+
+    def bench_info(self):
+        """Training fast path (info never built) against building the info dict every cycle."""
+        results = {}
+
+        for label, with_info in [("info", True), ("lean", False)]:
+            env = RLController(gui=False, log=False, rnd=(False, False))
+            cycles, sim_steps, wall_time = self.run_cycles(env, with_info=with_info)
+            env.close()
+
+            results[label] = wall_time / cycles
+            self.record("info", label, ms_per_cycle=wall_time / cycles * 1000, cycles=cycles, wall_sec=wall_time)
+
+        print()
+        print("Mode", "|", "ms / Cycle")
+        for label, sec_per_cycle in results.items():
+            print(label, "|", round(sec_per_cycle * 1000, 3))
+        print("Speedup", "|", round(results["info"] / results["lean"], 3))
+        self.record("info", "speedup", ratio=results["info"] / results["lean"])
+
+        return results
+
+    def bench_baselines(self):
+        """
+        One full baseline episode, stepping and collecting metrics every second (the cost of the former per-second
+        baselines, minus their per-second phase queries) against every log interval.
+        """
+        results = {}
+        log_interval_sec = SUMO_PARAMS["baseline_log_interval_sec"]
+
+        for baseline in self.baselines:
+            for interval in [1.0, log_interval_sec]:
+                SUMO_PARAMS["baseline_log_interval_sec"] = interval
+                env = getattr(Baselines, baseline)(gui=False, log=False, rnd=(False, False))
+                env.reset()
+
+                start_time = time.perf_counter()
+                while not env.done():
+                    env.step(0)
+                    env.info()
+                results[(baseline, interval)] = (env.get_current_time(), time.perf_counter() - start_time)
+                self.record("baselines", baseline + "@" + str(interval), log_interval_sec=interval,
+                            sim_sec=results[(baseline, interval)][0], wall_sec=results[(baseline, interval)][1])
+                env.close()
+
+        SUMO_PARAMS["baseline_log_interval_sec"] = log_interval_sec
+
+        print()
+        print("Baseline", "|", "Log Interval s", "|", "Sim s", "|", "Wall s", "|", "Speedup")
+        for (baseline, interval), (sim_time, wall_time) in results.items():
+            print(baseline, "|", interval, "|", round(sim_time, 1), "|", round(wall_time, 3), "|",
+                  round(results[(baseline, 1.0)][1] / wall_time, 3))
+
+        return results
+
+    def bench_ramp_queue(self):
+        """
+        Validates the E2 ramp queue integral of step_mode "phase": over random 40s cycles, stepped one second at a
+        time, the E2 vehicle-seconds are compared with the per-step sums of the on-ramp vehicle number (what
+        step_mode "step" integrates) and of the E2 halting number.
+        """
+        step_mode = SUMO_PARAMS["step_mode"]
+        SUMO_PARAMS["step_mode"] = "step"
+        env = RLController(gui=False, log=False, rnd=(False, False))
+        SUMO_PARAMS["step_mode"] = step_mode
+
+        if env.ramp_queue_detector is None:
+            print(Fore.YELLOW, "Skipping ramp queue validation (no " + env.RAMP_QUEUE_DETECTOR + " detector)", Fore.RESET)
+            env.close()
+            return None
+
+        random.seed(self.seed)
+        env.reset()
+
+        e2, vehicles, halting = [], [], []
+        while len(e2) < self.cycles:
+            green_sec = random.choice(env.green_time_actions_sec)
+            num_steps = int(round(env.CYCLE_DURATION_SEC / env.sim_step_length))
+            if env.get_ramp_queue_interval_start(env.get_current_time() + num_steps * env.sim_step_length) != env.get_ramp_queue_interval_start():
+                env.reset()
+                continue
+
+            queue_start = env.get_ramp_queue_vehicle_seconds()
+            cycle_vehicles, cycle_halting = 0.0, 0.0
+            for i in range(num_steps):
+                if i == 0 or i == int(round(green_sec / env.sim_step_length)):
+                    env.set_phase(env.ramp_meter_id, env.green_phase_index if i == 0 else env.red_phase_index)
+                    env.set_phase_duration(env.ramp_meter_id, env.CYCLE_DURATION_SEC)
+                env.simulation_step()
+                cycle_vehicles += env.get_edge_ls_queue_length_vehicles(env.ON_RAMP_EDGE) * env.sim_step_length
+                cycle_halting += env.conn.lanearea.getLastStepHaltingNumber(env.ramp_queue_detector) * env.sim_step_length
+
+            e2.append(env.get_ramp_queue_vehicle_seconds() - queue_start)
+            vehicles.append(cycle_vehicles)
+            halting.append(cycle_halting)
+
+            if env.done():
+                env.reset()
+
+        env.close()
+
+        e2, vehicles, halting = np.array(e2), np.array(vehicles), np.array(halting)
+        for label, values in [("e2", e2), ("vehicle_number", vehicles), ("halting_number", halting)]:
+            self.record("ramp_queue", label, mean_veh_sec_per_cycle=values.mean(), mean_abs_diff_to_e2=np.abs(values - e2).mean(),
+                        total_rel_diff_to_e2=(values.sum() - e2.sum()) / max(e2.sum(), 1e-9), cycles=len(values))
+        print()
+        print("Ramp queue veh*s / cycle", "|", "Mean", "|", "Mean abs diff to E2", "|", "Total rel diff to E2")
+        print("E2 (phase mode)", "|", round(e2.mean(), 2), "|", 0.0, "|", 0.0)
+        for label, values in [("Vehicle number (step mode)", vehicles), ("Halting number", halting)]:
+            print(label, "|", round(values.mean(), 2), "|", round(np.abs(values - e2).mean(), 2), "|",
+                  round((values.sum() - e2.sum()) / max(e2.sum(), 1e-9), 4))
+
+        return e2, vehicles, halting
+
+    def run(self):
+        if "backends" in self.benches:
+            self.bench_backends()
+        if "info" in self.benches:
+            self.bench_info()
+        if "baselines" in self.benches:
+            self.bench_baselines()
+        if "ramp_queue" in self.benches:
+            self.bench_ramp_queue()
+        self.write_results()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BENCHMARK")
+    parser.add_argument('-cycles', type=int, default=90, help='Control cycles (40s agent steps) to time per run')
+    parser.add_argument('-seed', type=int, default=42, help='Seed for the random actions')
+    parser.add_argument('-backends', type=str, nargs='+', default=["traci", "libsumo"], help='SUMO backends to compare')
+    parser.add_argument('-benches', type=str, nargs='+', default=["backends", "info", "baselines"], help='Benchmarks to run: backends, info, baselines, ramp_queue')
+    parser.add_argument('-out', type=str, default="./logs/benchmark/", help='Directory of the results CSV (empty: console only)')
+    parser.add_argument('-baselines', type=str, nargs='+', default=["AlwaysGreenBaseline", "FixedCycleBaseline", "AlineaDsBaseline", "PiAlineaDsBaseline"], help='Baselines to time')
+
+    Benchmark(parser.parse_args()).run()
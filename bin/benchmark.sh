@@ -0,0 +1,17 @@
+#!/usr/bin/bash
+
+function run () {
+
+python3 benchmark.py -backends traci libsumo -cycles 90
+
+}
+
+# cd ..
+
+# source venv/bin/activate
+
+run
+
+# deactivate
+
+# exit
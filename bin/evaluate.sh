@@ -6,7 +6,7 @@ ALGO2="FixedCycleBaseline"
 ALGO3="AlineaDsBaseline"
 ALGO4="PiAlineaDsBaseline"
 ALGO5="DQNAgent"
-MODELPATH="save/1ramp_1x3/DuelingDoubleDQNAgent_lr0.0001_model.pack"
+MODELPATH="save/1ramp_1x3/DuelingDoubleDQNAgent_lr0.0001_model.ckpt"
 EPISODES=50
 
 python evaluate.py -s $ALGO5 -d $MODELPATH -n $EPISODES 
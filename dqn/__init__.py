@@ -1,6 +1,9 @@
 from .env_wrap import CustomEnvWrapper
 from .env_make import make_env
+from .utils import GridObsCodec, TransitionShardWriter, TransitionDataset
+from .replay_memory import ReplayMemoryOffline
+from .actor_learner import ActorPool
 from . import agent as Agents
 from . import network as Networks
 
-__all__ = ['CustomEnvWrapper', 'make_env', 'Agents', 'Networks']
+__all__ = ['CustomEnvWrapper', 'make_env', 'GridObsCodec', 'TransitionShardWriter', 'TransitionDataset', 'ReplayMemoryOffline', 'ActorPool', 'Agents', 'Networks']
@@ -0,0 +1,106 @@
+from .utils.baselines_wrappers import CloudpickleWrapper
+
+import time
+import queue
+import random
+import multiprocessing as mp
+
+import torch as T
+
+
+def actor_worker(actor_id, env_fn_wrapper, network_fn_wrapper, transition_queue, weights_queue, stop_event, max_episode_steps):
+    T.set_num_threads(1)
+
+    env = env_fn_wrapper.x(actor_id)
+    network = network_fn_wrapper.x()
+    epsilon = 1.
+
+    try:
+        obs, _ = env.reset()
+        episode_steps = 0
+
+        while not stop_event.is_set():
+            try:
+                parameters, epsilon = weights_queue.get_nowait()
+                network.load_state_dict({k: T.as_tensor(v) for k, v in parameters.items()})
+            except queue.Empty:
+                pass
+
+            if random.random() <= epsilon:
+                action = env.action_space.sample()
+            else:
+                action = network.action(obs)
+
+            new_obs, rew, terminated, truncated, info = env.step(action)
+            episode_steps += 1
+
+            done = terminated or truncated or (max_episode_steps > 0 and episode_steps >= max_episode_steps)
+
+            transition_queue.put((obs, action, rew, done, new_obs, info if done else None))
+
+            if done:
+                obs, _ = env.reset()
+                episode_steps = 0
+            else:
+                obs = new_obs
+    except KeyboardInterrupt:
+        print('Actor ' + str(actor_id) + ': got KeyboardInterrupt')
+    finally:
+        env.close()
+
+
+class ActorPool:
+    """
+    Actor processes that run episodes with a periodically refreshed copy of the online network and push
+    single transitions (obs, action, rew, done, new_obs, info) to the learner through a bounded queue.
+    """
+    def __init__(self, n_actors, env_fn, network_fn, max_episode_steps=0, queue_size=10000, context='spawn'):
+        self.n_actors = n_actors
+        self.queue_size = queue_size
+
+        ctx = mp.get_context(context)
+        self.stop_event = ctx.Event()
+        self.transition_queue = ctx.Queue(maxsize=queue_size)
+        self.weights_queues = [ctx.Queue(maxsize=1) for _ in range(n_actors)]
+
+        self.ps = [ctx.Process(target=actor_worker, args=(actor_id, CloudpickleWrapper(env_fn), CloudpickleWrapper(network_fn),
+                                                          self.transition_queue, weights_queue, self.stop_event, max_episode_steps))
+                   for actor_id, weights_queue in enumerate(self.weights_queues)]
+        for p in self.ps:
+            p.daemon = True
+            p.start()
+
+    def broadcast(self, network, epsilon):
+        parameters = {k: v.detach().cpu().numpy() for k, v in network.state_dict().items()}
+
+        for weights_queue in self.weights_queues:
+            # Only the latest weights matter: drop the ones an actor has not picked up yet
+            try:
+                weights_queue.get_nowait()
+            except queue.Empty:
+                pass
+            weights_queue.put((parameters, epsilon))
+
+    def drain(self, max_transitions, block=True):
+        transitions = []
+
+        while len(transitions) < max_transitions:
+            try:
+                transitions.append(self.transition_queue.get(block=(block and not transitions), timeout=1.))
+            except queue.Empty:
+                break
+
+        return transitions
+
+    def close(self):
+        self.stop_event.set()
+
+        # Unblock actors waiting on a full queue so they can see the stop event
+        deadline = time.time() + 10.
+        while any(p.is_alive() for p in self.ps) and time.time() < deadline:
+            self.drain(self.queue_size)
+
+        for p in self.ps:
+            p.join(timeout=1.)
+            if p.is_alive():
+                p.terminate()
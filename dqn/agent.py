@@ -1,4 +1,4 @@
-from .utils import ABCMeta, abstract_attribute
+from .utils import ABCMeta, abstract_attribute, save_checkpoint, load_checkpoint, is_checkpoint
 from .replay_memory import ReplayMemoryNaive, ReplayMemoryPrioritized
 from .network import DeepQNetwork, DuelingDeepQNetwork
 
@@ -18,7 +18,8 @@ from torch.utils.tensorboard import SummaryWriter
 class Agent(metaclass=ABCMeta):
     def __init__(self, n_env, lr, gamma, epsilon_start, epsilon_min, epsilon_decay, epsilon_exp_decay, nn_conf_func, input_dim, output_dim,
                  batch_size, min_buffer_size, buffer_size, update_target_frequency, target_soft_update, target_soft_update_tau,
-                 save_frequency, log_frequency, save_dir, log_dir, load, algo, gpu):
+                 save_frequency, log_frequency, save_dir, log_dir, load, algo, gpu, buffer_dedup_obs=False, buffer_obs_codec=None, save_replay=False,
+                 buffer_spill_frequency=0, dataset_writer=None):
         self.n_env = n_env
         self.lr = lr
         self.gamma = gamma
@@ -32,20 +33,30 @@ class Agent(metaclass=ABCMeta):
         self.batch_size = batch_size
         self.min_buffer_size = min_buffer_size
         self.buffer_size = buffer_size
+        self.buffer_dedup_obs = buffer_dedup_obs
+        self.buffer_obs_codec = buffer_obs_codec
+        self.buffer_spill_frequency = buffer_spill_frequency
+        self.dataset_writer = dataset_writer
         self.update_target_frequency = update_target_frequency
         self.target_soft_update = target_soft_update
         self.target_soft_update_tau = target_soft_update_tau
         self.save_frequency = save_frequency
         self.log_frequency = log_frequency
         self.load = load
+        self.save_replay = save_replay
 
         self.step = 0
         self.resume_step = 0
         self.episode_count = 0
         self.ep_info_buffer = deque([], maxlen=50)
 
+        # Preallocated (n_env, obs_dim) inference batch, allocated on the first action selection
+        self.obses_batch = None
+
         path = algo + '_lr' + str(lr)
-        self.save_path = save_dir + path + '_' + 'model.pack'
+        self.save_path = save_dir + path + '_' + 'model.ckpt'
+        self.legacy_save_path = save_dir + path + '_' + 'model.pack' # Read only, resumes runs saved before the checkpoint format
+        self.replay_path = save_dir + path + '_' + 'replay.ckpt'
         self.summary_writer = SummaryWriter(log_dir + path + '/')
 
         self.device = T.device(("cuda:"+gpu) if T.cuda.is_available() else "cpu")
@@ -69,32 +80,45 @@ class Agent(metaclass=ABCMeta):
         raise NotImplementedError
 
     def transitions_to_tensor(self, transitions):
-        obses_t = T.as_tensor(np.asarray([t[0] for t in transitions]), dtype=T.float32).to(self.device)
-        actions_t = T.as_tensor(np.asarray([t[1] for t in transitions]), dtype=T.int64).to(self.device).unsqueeze(-1)
-        rews_t = T.as_tensor(np.asarray([t[2] for t in transitions]), dtype=T.float32).to(self.device).unsqueeze(-1)
-        dones_t = T.as_tensor(np.asarray([t[3] for t in transitions]), dtype=T.float32).to(self.device).unsqueeze(-1)
-        new_obses_t = T.as_tensor(np.asarray([t[4] for t in transitions]), dtype=T.float32).to(self.device)
+        obses, actions, rews, dones, new_obses = transitions
+
+        obses_t = T.from_numpy(obses).to(self.device)
+        actions_t = T.from_numpy(actions).to(self.device).unsqueeze(-1)
+        rews_t = T.from_numpy(rews).to(self.device).unsqueeze(-1)
+        dones_t = T.from_numpy(dones).to(self.device).unsqueeze(-1)
+        new_obses_t = T.from_numpy(new_obses).to(self.device)
 
         return obses_t, actions_t, rews_t, dones_t, new_obses_t
 
     def store_transitions(self, obses, actions, rews, dones, new_obses, infos):
+        if self.dataset_writer is not None:
+            self.dataset_writer.add(obses, actions, rews, dones, new_obses)
+
         for i in self.replay_memory_buffer.store_transitions(obses, actions, rews, dones, new_obses):
             if infos:
                 self.ep_info_buffer.append({'r': infos[i]['r'], 'l': infos[i]['l']})
                 self.episode_count += 1
 
-    def epsilon(self):
+        if self.buffer_spill_frequency and self.replay_memory_buffer.replay_buffer.n_unspilled >= self.buffer_spill_frequency:
+            self.replay_memory_buffer.spill(self.replay_path)
+
+    def epsilon(self, env_step=None):
+        env_step = self.step * self.n_env if env_step is None else env_step
+
         if self.epsilon_exp_decay:
-            return np.exp(np.interp(self.step * self.n_env, [0, self.epsilon_decay], [np.log(self.epsilon_start), np.log(self.epsilon_min)]))
+            return np.exp(np.interp(env_step, [0, self.epsilon_decay], [np.log(self.epsilon_start), np.log(self.epsilon_min)]))
         else:
-            return np.interp(self.step * self.n_env, [0, self.epsilon_decay], [self.epsilon_start, self.epsilon_min])
+            return np.interp(env_step, [0, self.epsilon_decay], [self.epsilon_start, self.epsilon_min])
 
     def choose_actions(self, obses):
-        actions = self.online_network.actions(obses)
+        if self.obses_batch is None:
+            self.obses_batch = np.empty((self.n_env,) + np.shape(obses)[1:], dtype=np.float32)
+        np.copyto(self.obses_batch, obses)
 
-        for i in range(len(actions)):
-            if random.random() <= self.epsilon():
-                actions[i] = random.randint(0, self.output_dim - 1)
+        actions = self.online_network.actions(self.obses_batch)
+
+        explore = np.random.random(self.n_env) <= self.epsilon()
+        actions[explore] = np.random.randint(0, self.output_dim, size=np.count_nonzero(explore))
 
         return actions
 
@@ -110,23 +134,108 @@ class Agent(metaclass=ABCMeta):
                 )
 
     def load_model(self):
-        if self.load and os.path.exists(self.save_path):
+        load_path = self.save_path if os.path.exists(self.save_path) else self.legacy_save_path
+
+        if self.load and os.path.exists(load_path):
             print()
-            print("Resume training from " + self.save_path + "...")
-            self.resume_step, self.episode_count, rew_mean, len_mean = self.online_network.load(self.save_path)
-            [self.ep_info_buffer.append({'r': rew_mean, 'l': len_mean}) for _ in range(np.min([self.episode_count, self.ep_info_buffer.maxlen]))]
+            print("Resume training from " + load_path + "...")
+
+            if is_checkpoint(load_path):
+                rew_means, len_means = self.load_checkpoint(load_path)
+                [self.ep_info_buffer.append({'r': r, 'l': l}) for r, l in zip(rew_means, len_means)]
+                rew_mean, len_mean = self.info_mean('r'), self.info_mean('l')
+            else:
+                # Legacy checkpoint: online weights only
+                self.resume_step, self.episode_count, rew_mean, len_mean = self.online_network.load(load_path)
+                [self.ep_info_buffer.append({'r': rew_mean, 'l': len_mean}) for _ in range(np.min([self.episode_count, self.ep_info_buffer.maxlen]))]
+                self.update_target_network(force=True)
+
             print("Step: ", self.resume_step * self.n_env, ", Episodes: ", self.episode_count, ", Avg Rew: ", rew_mean, ", Avg Ep Len: ", len_mean)
 
-            self.update_target_network(force=True)
             self.step = self.resume_step
 
+            # Only next to a resumed model: a replay file alone may be stale data from an unrelated run
+            if self.buffer_spill_frequency:
+                self.load_replay()
+
+    def load_replay(self):
+        if len(self.replay_memory_buffer.replay_buffer) == 0 and self.replay_memory_buffer.restore(self.replay_path):
+            print()
+            print("Replay memory restored from " + self.replay_path + ": ", len(self.replay_memory_buffer.replay_buffer), " transitions")
+
     def save_model(self):
         if self.step % self.save_frequency == 0 and self.step > self.resume_step:
             print()
             print("Saving model...")
-            self.online_network.save(self.save_path, self.step, self.episode_count, self.info_mean('r'), self.info_mean('l'))
+            self.save_checkpoint(self.save_path)
             print("OK!")
 
+    def save_checkpoint(self, path):
+        """
+        Full training state: both networks, optimizer moments, RNG states, the episode info window and, with
+        save_replay, the replay memory. Networks and the file meta keep the layout Network.load reads.
+        """
+        np_rng_state = np.random.get_state()
+        py_rng_state = random.getstate()
+
+        checkpoint = {
+            'online': self.online_network.numpy_state_dict(),
+            'target': self.target_network.numpy_state_dict(),
+            'optimizer': self.online_network.numpy_optimizer_state_dict(),
+            'rng': {
+                'python': {'version': py_rng_state[0], 'state': np.array(py_rng_state[1], dtype=np.int64), 'gauss_next': py_rng_state[2]},
+                'numpy': {'keys': np_rng_state[1], 'pos': int(np_rng_state[2]), 'has_gauss': int(np_rng_state[3]), 'cached_gaussian': float(np_rng_state[4])},
+                'torch': T.get_rng_state().numpy()
+            },
+            'episodes': {
+                'rew': np.array([e['r'] for e in self.ep_info_buffer], dtype=np.float64),
+                'len': np.array([e['l'] for e in self.ep_info_buffer], dtype=np.float64)
+            },
+            'meta': {
+                'step': self.step, 'episode_count': self.episode_count,
+                'rew_mean': float(self.info_mean('r')), 'len_mean': float(self.info_mean('l'))
+            }
+        }
+        if T.cuda.is_available():
+            checkpoint['rng']['cuda'] = T.stack(T.cuda.get_rng_state_all()).numpy()
+        if self.save_replay:
+            checkpoint['replay'] = self.replay_memory_buffer.state_dict()
+
+        save_checkpoint(path, checkpoint)
+
+    def load_checkpoint(self, path):
+        checkpoint = load_checkpoint(path)
+
+        self.online_network.load_numpy_state_dict(checkpoint['online'])
+        if 'target' in checkpoint:
+            self.target_network.load_numpy_state_dict(checkpoint['target'])
+        else:
+            self.update_target_network(force=True)
+
+        if 'optimizer' in checkpoint:
+            self.online_network.load_numpy_optimizer_state_dict(checkpoint['optimizer'])
+
+        if 'rng' in checkpoint:
+            rng = checkpoint['rng']
+            random.setstate((rng['python']['version'], tuple(rng['python']['state'].tolist()), rng['python']['gauss_next']))
+            np.random.set_state(('MT19937', rng['numpy']['keys'], rng['numpy']['pos'], rng['numpy']['has_gauss'], rng['numpy']['cached_gaussian']))
+            T.set_rng_state(T.from_numpy(np.array(rng['torch'])))
+            if 'cuda' in rng and T.cuda.is_available() and len(rng['cuda']) == T.cuda.device_count():
+                T.cuda.set_rng_state_all(list(T.from_numpy(np.array(rng['cuda']))))
+
+        if 'replay' in checkpoint:
+            self.replay_memory_buffer.load_state_dict(checkpoint['replay'])
+            print("Replay memory restored: ", len(self.replay_memory_buffer.replay_buffer), " transitions")
+
+        meta = checkpoint['meta']
+        self.resume_step, self.episode_count = meta['step'], meta['episode_count']
+
+        if 'episodes' in checkpoint:
+            return checkpoint['episodes']['rew'].tolist(), checkpoint['episodes']['len'].tolist()
+        # Written by Network.save: only the means are known
+        n = int(np.min([self.episode_count, self.ep_info_buffer.maxlen]))
+        return [meta['rew_mean']] * n, [meta['len_mean']] * n
+
     def log(self):
         if self.step % self.log_frequency == 0 and self.step > self.resume_step:
             rew_mean, len_mean = self.info_mean('r'), self.info_mean('l')
@@ -245,7 +354,7 @@ class PerDoubleAgent(Agent):
     def learn(self):
         # Compute loss
         is_weights, tree_indices, transitions = self.replay_memory_buffer.sample_transitions(self.step * self.n_env)
-        is_weights_t = T.as_tensor(np.asarray(is_weights), dtype=T.float32).to(self.device).unsqueeze(-1)
+        is_weights_t = T.from_numpy(is_weights).to(self.device).unsqueeze(-1)
         obses_t, actions_t, rews_t, dones_t, new_obses_t = self.transitions_to_tensor(transitions)
 
         with T.no_grad():
@@ -276,7 +385,7 @@ class DQNAgent(SimpleAgent):
     def __init__(self, *args, **kwargs):
         super(DQNAgent, self).__init__(*args, **kwargs)
 
-        self.replay_memory_buffer = ReplayMemoryNaive(self.buffer_size, self.batch_size)
+        self.replay_memory_buffer = ReplayMemoryNaive(self.buffer_size, self.batch_size, self.buffer_dedup_obs, self.buffer_obs_codec)
 
         self.online_network = DeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim)
         self.target_network = DeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim)
@@ -288,7 +397,7 @@ class DoubleDQNAgent(DoubleAgent):
     def __init__(self, *args, **kwargs):
         super(DoubleDQNAgent, self).__init__(*args, **kwargs)
 
-        self.replay_memory_buffer = ReplayMemoryNaive(self.buffer_size, self.batch_size)
+        self.replay_memory_buffer = ReplayMemoryNaive(self.buffer_size, self.batch_size, self.buffer_dedup_obs, self.buffer_obs_codec)
 
         self.online_network = DeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim)
         self.target_network = DeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim)
@@ -300,7 +409,7 @@ class DuelingDoubleDQNAgent(DoubleAgent):
     def __init__(self, *args, **kwargs):
         super(DuelingDoubleDQNAgent, self).__init__(*args, **kwargs)
 
-        self.replay_memory_buffer = ReplayMemoryNaive(self.buffer_size, self.batch_size)
+        self.replay_memory_buffer = ReplayMemoryNaive(self.buffer_size, self.batch_size, self.buffer_dedup_obs, self.buffer_obs_codec)
 
         self.online_network = DuelingDeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim)
         self.target_network = DuelingDeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim)
@@ -312,7 +421,7 @@ class PerDuelingDoubleDQNAgent(PerDoubleAgent):
     def __init__(self, *args, **kwargs):
         super(PerDuelingDoubleDQNAgent, self).__init__(*args, **kwargs)
 
-        self.replay_memory_buffer = ReplayMemoryPrioritized(self.buffer_size, self.batch_size, self.epsilon_decay)
+        self.replay_memory_buffer = ReplayMemoryPrioritized(self.buffer_size, self.batch_size, self.epsilon_decay, self.buffer_dedup_obs, self.buffer_obs_codec)
 
         self.online_network = DuelingDeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim, reduction='none')
         self.target_network = DuelingDeepQNetwork(self.device, self.lr, self.nn_conf_func, self.input_dim, self.output_dim, reduction='none')
@@ -9,21 +9,32 @@ def wrap_max_episode_steps(env, max_episode_steps):
     return MaxEpisodeStepsWrapper(env, max_episode_steps=max_episode_steps)
 
 
-def make_vec_env(env, n_env):
+def make_vec_env(env_fn, n_env):
+    # env_fn(worker_id) builds the environment inside its own process, one independent simulation per worker
     if n_env > 1:
-        return SubprocVecEnv([lambda: Monitor(env, allow_early_resets=True) for _ in range(n_env)])
+        return SubprocVecEnv([(lambda worker_id=worker_id: Monitor(env_fn(worker_id), allow_early_resets=True)) for worker_id in range(n_env)])
     else:
-        return DummyVecEnv([lambda: Monitor(env, allow_early_resets=True) for _ in range(n_env)])
+        return DummyVecEnv([(lambda worker_id=worker_id: Monitor(env_fn(worker_id), allow_early_resets=True)) for worker_id in range(n_env)])
 
 
-def make_env(env, repeat=0, max_episode_steps=0, n_env=0):
+def wrap_env(env, repeat=0, max_episode_steps=0):
     if repeat > 0:
         env = wrap_repeat_action(env, repeat)
 
     if max_episode_steps > 0:
         env = wrap_max_episode_steps(env, max_episode_steps)
 
+    return env
+
+
+def make_env(env, repeat=0, max_episode_steps=0, n_env=0):
+    # env is either an environment instance or a factory env(worker_id), required when n_env > 1
+    if not callable(env):
+        assert n_env <= 1, "n_env > 1 requires an environment factory env(worker_id)"
+        env_instance = env
+        env = (lambda worker_id: env_instance)
+
     if n_env == 0:
-        return env
+        return wrap_env(env(None), repeat, max_episode_steps)
 
-    return make_vec_env(env, n_env)
+    return make_vec_env(lambda worker_id: wrap_env(env(worker_id), repeat, max_episode_steps), n_env)
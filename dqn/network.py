@@ -1,10 +1,11 @@
 import os
+import numpy as np
 
 import torch as T
 import torch.nn as nn
 
 import msgpack
-from .utils import msgpack_numpy_patch
+from .utils import msgpack_numpy_patch, save_checkpoint, load_checkpoint, is_checkpoint
 msgpack_numpy_patch()
 
 
@@ -24,20 +25,55 @@ class Network(nn.Module):
     def actions(self, obses):
         raise NotImplementedError
 
-    def save(self, save_path, step, episode_count, rew_mean, len_mean):
-        params_dict = {
-            'parameters': {k: v.detach().cpu().numpy() for k, v in self.state_dict().items()},
-            'step': step, 'episode_count': episode_count, 'rew_mean': rew_mean, 'len_mean': len_mean
+    def action(self, obs):
+        # Single observation: a (1, obs_dim) view through the batched path
+        return int(self.actions(np.asarray(obs, dtype=np.float32)[np.newaxis])[0])
+
+    def numpy_state_dict(self):
+        return {k: v.detach().cpu().numpy() for k, v in self.state_dict().items()}
+
+    def load_numpy_state_dict(self, parameters):
+        # from_numpy shares the (memory-mapped) buffers, load_state_dict then copies once into the parameters
+        self.load_state_dict({k: T.from_numpy(v) for k, v in parameters.items()})
+
+    def numpy_optimizer_state_dict(self):
+        # Checkpoint keys are strings; 0-d tensors (Adam's step) stay 0-d arrays
+        optimizer_state = self.optimizer.state_dict()
+        return {
+            'state': {
+                str(i): {k: v.detach().cpu().numpy() if T.is_tensor(v) else v for k, v in param_state.items()}
+                for i, param_state in optimizer_state['state'].items()
+            },
+            'param_groups': optimizer_state['param_groups']
         }
 
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, 'wb') as f:
-            f.write(msgpack.dumps(params_dict))
+    def load_numpy_optimizer_state_dict(self, optimizer_state):
+        self.optimizer.load_state_dict({
+            'state': {
+                int(i): {k: T.from_numpy(v) if isinstance(v, np.ndarray) else v for k, v in param_state.items()}
+                for i, param_state in optimizer_state['state'].items()
+            },
+            'param_groups': optimizer_state['param_groups']
+        })
+
+    def save(self, save_path, step, episode_count, rew_mean, len_mean):
+        save_checkpoint(save_path, {
+            'online': self.numpy_state_dict(),
+            'meta': {'step': step, 'episode_count': episode_count, 'rew_mean': float(rew_mean), 'len_mean': float(len_mean)}
+        })
 
     def load(self, load_path):
         if not os.path.exists(load_path):
             raise FileNotFoundError(load_path)
 
+        if is_checkpoint(load_path):
+            checkpoint = load_checkpoint(load_path)
+            self.load_numpy_state_dict(checkpoint['online'])
+
+            meta = checkpoint['meta']
+            return meta['step'], meta['episode_count'], meta['rew_mean'], meta['len_mean']
+
+        # Legacy msgpack checkpoint
         with open(load_path, 'rb') as f:
             params_dict = msgpack.loads(f.read())
 
@@ -64,12 +100,13 @@ class DeepQNetwork(Network):
 
         return a
 
+    @T.inference_mode()
     def actions(self, obses):
-        obses_t = T.as_tensor(obses, dtype=T.float32).to(self.device)
+        obses_t = T.from_numpy(np.asarray(obses, dtype=np.float32)).to(self.device)
         q_values = self(obses_t)
 
         max_q_indices = T.argmax(q_values, dim=1)
-        actions = max_q_indices.detach().tolist()
+        actions = max_q_indices.cpu().numpy()
 
         return actions
 
@@ -107,11 +144,12 @@ class DuelingDeepQNetwork(Network):
 
         return adv
 
+    @T.inference_mode()
     def actions(self, obses):
-        obses_t = T.as_tensor(obses, dtype=T.float32).to(self.device)
+        obses_t = T.from_numpy(np.asarray(obses, dtype=np.float32)).to(self.device)
         adv_q_values = self.advantages(obses_t)
 
         max_adv_q_indices = T.argmax(adv_q_values, dim=1)
-        actions = max_adv_q_indices.detach().tolist()
+        actions = max_adv_q_indices.cpu().numpy()
 
         return actions
@@ -1,14 +1,14 @@
-from .utils import ABCMeta, abstract_attribute, SumTree
+from .utils import ABCMeta, abstract_attribute, SumTree, RingBuffer
 
-import random
 import numpy as np
-from collections import deque
 
 
 class ReplayMemory(metaclass=ABCMeta):
-    def __init__(self, buffer_size, batch_size):
+    def __init__(self, buffer_size, batch_size, dedup_obs=False, obs_codec=None):
         self.batch_size = batch_size
         self.buffer_size = buffer_size
+        self.dedup_obs = dedup_obs
+        self.obs_codec = obs_codec
 
     @abstract_attribute
     def replay_buffer(self):
@@ -20,31 +20,43 @@ class ReplayMemory(metaclass=ABCMeta):
     def sample_transitions(self, step):
         raise NotImplementedError
 
+    def state_dict(self):
+        return {'replay_buffer': self.replay_buffer.state_dict()}
+
+    def load_state_dict(self, state):
+        self.replay_buffer.load_state_dict(state['replay_buffer'])
+
+    def spill(self, path):
+        self.replay_buffer.spill(path)
+
+    def restore(self, path):
+        return self.replay_buffer.restore(path) is not None
+
 
 class ReplayMemoryNaive(ReplayMemory):
     def __init__(self, *args, **kwargs):
         super(ReplayMemoryNaive, self).__init__(*args, **kwargs)
 
-        self.replay_buffer = deque(maxlen=self.buffer_size)
+        self.replay_buffer = RingBuffer(self.buffer_size, dedup_obs=self.dedup_obs, obs_codec=self.obs_codec)
 
     def store_transitions(self, obses, actions, rews, dones, new_obses):
-        for e, (obs, action, rew, done, new_obs) in enumerate(zip(obses, actions, rews, dones, new_obses)):
-            transition = (obs, action, rew, done, new_obs)
-            self.replay_buffer.append(transition)
+        self.replay_buffer.add(obses, actions, rews, dones, new_obses)
 
-            if done:
-                yield e
+        for e in np.flatnonzero(dones):
+            yield int(e)
 
     def sample_transitions(self, step=None):
-        return random.sample(self.replay_buffer, self.batch_size)
+        data_indices = np.random.randint(0, len(self.replay_buffer), size=self.batch_size)
+        return self.replay_buffer.get(data_indices)
 
 
 # https://danieltakeshi.github.io/2019/07/14/per/
 class ReplayMemoryPrioritized(ReplayMemory):
-    def __init__(self, buffer_size, batch_size, eps_dec):
-        super(ReplayMemoryPrioritized, self).__init__(buffer_size, batch_size)
+    def __init__(self, buffer_size, batch_size, eps_dec, dedup_obs=False, obs_codec=None):
+        super(ReplayMemoryPrioritized, self).__init__(buffer_size, batch_size, dedup_obs, obs_codec)
 
-        self.replay_buffer = SumTree(self.buffer_size)
+        self.replay_buffer = RingBuffer(self.buffer_size, dedup_obs=self.dedup_obs, obs_codec=self.obs_codec)
+        self.sum_tree = SumTree(self.buffer_size)
 
         self.epsilon = 0.0001
         self.alpha = 0.6
@@ -54,45 +66,81 @@ class ReplayMemoryPrioritized(ReplayMemory):
         self.max_priority_high = 1.
 
     def store_transitions(self, obses, actions, rews, dones, new_obses):
-        max_priority = self.replay_buffer.max_priority
+        max_priority = self.sum_tree.max_priority
 
         if max_priority == 0:
             max_priority = self.max_priority_high
 
-        for e, (obs, action, rew, done, new_obs) in enumerate(zip(obses, actions, rews, dones, new_obses)):
-            transition = (obs, action, rew, done, new_obs)
-            self.replay_buffer.add(max_priority, transition)
+        data_indices = self.replay_buffer.add(obses, actions, rews, dones, new_obses)
+        self.sum_tree.update(data_indices, max_priority)
 
-            if done:
-                yield e
+        for e in np.flatnonzero(dones):
+            yield int(e)
 
     def sample_transitions(self, step):
-        is_weights, tree_indices, transitions = [], [], []
+        size = len(self.replay_buffer)
+        total_priority = self.sum_tree.total_priority
 
-        priority_segment = self.replay_buffer.total_priority / self.batch_size
+        priority_segment = total_priority / self.batch_size
 
         beta = np.interp(step, [0, self.beta_inc], [self.beta_start, self.beta_end])
 
-        prob_min = self.replay_buffer.min_priority / self.replay_buffer.total_priority
-        max_is_weight = pow(self.replay_buffer.size * prob_min, -beta)
-
-        for i in range(self.batch_size):
-            v = np.random.uniform(priority_segment * i, priority_segment * (i + 1))
+        prob_min = self.sum_tree.min_priority / total_priority
+        max_is_weight = np.power(size * prob_min, -beta)
 
-            tree_index, priority, transition = self.replay_buffer.get_leaf(v)
+        v = (np.arange(self.batch_size) + np.random.uniform(size=self.batch_size)) * priority_segment
 
-            prob_i = priority / self.replay_buffer.total_priority
+        tree_indices, priorities = self.sum_tree.get_leaves(v)
 
-            is_weight_i = pow(self.replay_buffer.size * prob_i, -beta) / max_is_weight
+        probs = priorities / total_priority
 
-            is_weights.append(is_weight_i)
-            tree_indices.append(tree_index)
-            transitions.append(transition)
+        is_weights = (np.power(size * probs, -beta) / max_is_weight).astype(np.float32)
 
-        return is_weights, tree_indices, transitions
+        return is_weights, tree_indices, self.replay_buffer.get(tree_indices)
 
     def update_batch_priorities(self, tree_indices, abs_td_errors_np):
-        priorities = list(np.power(np.minimum(abs_td_errors_np + self.epsilon, self.max_priority_high), self.alpha))
+        priorities = np.power(np.minimum(abs_td_errors_np.ravel() + self.epsilon, self.max_priority_high), self.alpha)
+
+        self.sum_tree.update(tree_indices, priorities)
+
+    def state_dict(self):
+        state = super(ReplayMemoryPrioritized, self).state_dict()
+        state['sum_tree'] = self.sum_tree.state_dict()
+        return state
+
+    def load_state_dict(self, state):
+        super(ReplayMemoryPrioritized, self).load_state_dict(state)
+        self.sum_tree.load_state_dict(state['sum_tree'])
+
+    def spill(self, path):
+        # Priorities change all over the buffer, the leaves are written whole and the tree is rebuilt on restore
+        leaves = self.sum_tree.tree[self.sum_tree.tree_capacity:self.sum_tree.tree_capacity + self.buffer_size]
+        self.replay_buffer.spill(path, {'priorities': leaves})
+
+    def restore(self, path):
+        state = self.replay_buffer.restore(path)
+        if state is None:
+            return False
 
-        for i, p in zip(tree_indices, priorities):
-            self.replay_buffer.update(i, p)
+        size = len(self.replay_buffer)
+        priorities = state['priorities'][:size] if 'priorities' in state else self.max_priority_high
+        self.sum_tree.update(np.arange(size), priorities)
+        return True
+
+
+class ReplayMemoryOffline(ReplayMemory):
+    """Read-only replay memory over a recorded TransitionDataset (offline training, no simulation)."""
+
+    def __init__(self, dataset, batch_size):
+        super(ReplayMemoryOffline, self).__init__(len(dataset), batch_size)
+
+        self.replay_buffer = dataset
+
+    def store_transitions(self, obses, actions, rews, dones, new_obses):
+        raise RuntimeError("Offline replay memory is read-only, transitions cannot be stored")
+
+    def spill(self, path):
+        raise RuntimeError("Offline replay memory is read-only, it cannot be spilled")
+
+    def sample_transitions(self, step=None):
+        return self.replay_buffer.sample()
@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+import pytest
+
+T = pytest.importorskip("torch")
+pytest.importorskip("cloudpickle")
+
+from dqn.actor_learner import ActorPool
+
+
+class CountingEnv:
+    """Observation is the step count of the episode, actions 0 and 1 only."""
+
+    class ActionSpace:
+        def sample(self):
+            return np.random.randint(2)
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.action_space = self.ActionSpace()
+        self.t = 0
+
+    def reset(self):
+        self.t = 0
+        return np.array([0.], dtype=np.float32), {}
+
+    def step(self, action):
+        self.t += 1
+        return np.array([self.t], dtype=np.float32), 1., False, False, {'worker_id': self.worker_id}
+
+    def close(self):
+        pass
+
+
+class ConstantNetwork:
+    """Greedy action is the broadcast 'action' parameter."""
+
+    def __init__(self, action=0):
+        self.parameters = {'action': T.tensor(action)}
+
+    def state_dict(self):
+        return self.parameters
+
+    def load_state_dict(self, parameters):
+        self.parameters = parameters
+
+    def action(self, obs):
+        return int(self.parameters['action'])
+
+
+def drain_at_least(pool, n, timeout=60.):
+    transitions = []
+    deadline = time.time() + timeout
+    while len(transitions) < n and time.time() < deadline:
+        transitions += pool.drain(n - len(transitions))
+    return transitions
+
+
+def test_actors_push_transitions_and_end_episodes():
+    pool = ActorPool(2, CountingEnv, ConstantNetwork, max_episode_steps=3, queue_size=100)
+    try:
+        transitions = drain_at_least(pool, 30)
+    finally:
+        pool.close()
+
+    assert len(transitions) == 30
+    for obs, action, rew, done, new_obs, info in transitions:
+        assert new_obs[0] == obs[0] + 1
+        assert action in (0, 1) and rew == 1.
+        # Episodes are cut after max_episode_steps, only the last transition carries the info
+        assert done == (new_obs[0] == 3)
+        assert (info is not None) == done
+
+
+def test_broadcast_reaches_every_actor():
+    pool = ActorPool(2, CountingEnv, ConstantNetwork, queue_size=100)
+    try:
+        pool.broadcast(ConstantNetwork(action=2), epsilon=0.)
+        # Keep the queue moving until the actors have picked up the new weights and act greedily
+        deadline = time.time() + 60.
+        recent = []
+        while time.time() < deadline:
+            recent = (recent + pool.drain(100))[-20:]
+            if len(recent) == 20 and all(action == 2 for _, action, *_ in recent):
+                break
+    finally:
+        pool.close()
+
+    assert [action for _, action, *_ in recent] == [2] * 20
+
+
+def test_close_stops_actors_blocked_on_a_full_queue():
+    pool = ActorPool(2, CountingEnv, ConstantNetwork, queue_size=4)
+    drain_at_least(pool, 1)
+    time.sleep(1.)
+
+    pool.close()
+
+    assert not any(p.is_alive() for p in pool.ps)
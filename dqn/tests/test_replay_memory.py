@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from dqn.replay_memory import ReplayMemoryNaive, ReplayMemoryPrioritized, ReplayMemoryOffline
+
+
+def add_transitions(memory, n, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        obses = rng.random((2, 4), dtype=np.float32)
+        list(memory.store_transitions(obses, [0, 1], [0., 1.], [0., 0.], rng.random((2, 4), dtype=np.float32)))
+
+
+def test_naive_spill_and_restore(tmp_path):
+    path = str(tmp_path / "replay.ckpt")
+    memory = ReplayMemoryNaive(16, 4)
+    add_transitions(memory, 5)
+    memory.spill(path)
+
+    restored = ReplayMemoryNaive(16, 4)
+
+    assert restored.restore(path)
+    assert len(restored.replay_buffer) == 10
+    for got, expected in zip(restored.replay_buffer.get(np.arange(10)), memory.replay_buffer.get(np.arange(10))):
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_prioritized_restore_rebuilds_the_sum_tree(tmp_path):
+    path = str(tmp_path / "replay.ckpt")
+    memory = ReplayMemoryPrioritized(16, 4, eps_dec=1000)
+    add_transitions(memory, 5)
+    memory.update_batch_priorities(np.array([1, 3, 8]), np.array([0.5, 0.01, 0.2]))
+    memory.spill(path)
+
+    restored = ReplayMemoryPrioritized(16, 4, eps_dec=1000)
+
+    assert restored.restore(path)
+    np.testing.assert_allclose(restored.sum_tree.tree, memory.sum_tree.tree)
+    assert restored.sum_tree.min_priority == memory.sum_tree.min_priority
+
+
+def test_restore_without_spill(tmp_path):
+    assert not ReplayMemoryNaive(16, 4).restore(str(tmp_path / "replay.ckpt"))
+
+
+def test_offline_memory_refuses_writes(tmp_path):
+    memory = ReplayMemoryOffline([], 4)
+    obses = np.zeros((2, 4), dtype=np.float32)
+
+    with pytest.raises(RuntimeError):
+        memory.store_transitions(obses, [0, 1], [0., 1.], [0., 0.], obses)
+    with pytest.raises(RuntimeError):
+        memory.spill(str(tmp_path / "replay.ckpt"))
@@ -1,5 +1,11 @@
 from .msgpack_numpy import patch as msgpack_numpy_patch
 from .better_abc import ABCMeta, abstract_attribute
 from .sum_tree import SumTree
+from .ring_buffer import RingBuffer
+from .obs_codec import ObsCodec, GridObsCodec
+from .checkpoint import save_checkpoint, load_checkpoint, is_checkpoint
+from .transition_dataset import TransitionShardWriter, TransitionDataset
 
-__all__ = ['msgpack_numpy_patch', 'ABCMeta', 'abstract_attribute', 'SumTree']
+__all__ = ['msgpack_numpy_patch', 'ABCMeta', 'abstract_attribute', 'SumTree', 'RingBuffer', 'ObsCodec', 'GridObsCodec',
+           'save_checkpoint', 'load_checkpoint', 'is_checkpoint',
+           'TransitionShardWriter', 'TransitionDataset']
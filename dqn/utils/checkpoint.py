@@ -0,0 +1,102 @@
+import os
+import json
+import struct
+
+import numpy as np
+
+
+# Layout: MAGIC | uint64 header length | JSON header | padding | tensor section.
+# Every array of the tensor section starts at a multiple of ALIGNMENT bytes from the start of the file, so it
+# can be used in place through a memory map.
+MAGIC = b'DQNCKPT1'
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def flatten(tree, prefix=''):
+    """Nested dicts -> ({'a/b': array}, {'a/c': json value}). Keys are turned into strings."""
+    arrays, values = {}, {}
+    for k, v in tree.items():
+        key = prefix + str(k)
+        if isinstance(v, dict):
+            sub_arrays, sub_values = flatten(v, key + '/')
+            arrays.update(sub_arrays)
+            values.update(sub_values)
+            if not v:
+                values[key] = {}
+        elif isinstance(v, np.ndarray):
+            arrays[key] = v
+        else:
+            values[key] = v
+    return arrays, values
+
+
+def unflatten(*flat_dicts):
+    tree = {}
+    for flat in flat_dicts:
+        for key, v in flat.items():
+            node = tree
+            *parents, leaf = key.split('/')
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = v
+    return tree
+
+
+def is_checkpoint(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_checkpoint(path, tree):
+    """Saves nested dicts of NumPy arrays and JSON values. Written to a temp file first, then renamed."""
+    arrays, values = flatten(tree)
+    # np.ascontiguousarray would turn 0-d arrays into shape (1,)
+    arrays = {k: np.require(v, requirements='C') for k, v in arrays.items()}
+
+    tensors, offset = {}, 0
+    for k, v in arrays.items():
+        tensors[k] = {'dtype': v.dtype.str, 'shape': list(v.shape), 'offset': offset, 'nbytes': v.nbytes}
+        offset = _align(offset + v.nbytes)
+
+    header = json.dumps({'values': values, 'tensors': tensors}).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for k, v in arrays.items():
+            f.seek(data_start + tensors[k]['offset'])
+            f.write(v.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, mode='c'):
+    """
+    Loads a checkpoint as nested dicts. Arrays are views into a copy-on-write memory map of the file: nothing is
+    read or copied until it is used, and writing to them never touches the file. With mode='r+' writes go to the
+    file instead (the layout is fixed, only array contents can be updated in place).
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a checkpoint file")
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+
+    data_start = _align(len(MAGIC) + 8 + header_len)
+    tensors = header['tensors']
+
+    mm = np.memmap(path, dtype=np.uint8, mode=mode) if tensors else None
+    arrays = {
+        k: np.ndarray(tuple(t['shape']), dtype=np.dtype(t['dtype']), buffer=mm, offset=data_start + t['offset'])
+        for k, t in tensors.items()
+    }
+
+    return unflatten(header['values'], arrays)
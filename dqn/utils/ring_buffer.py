@@ -0,0 +1,248 @@
+import threading
+import numpy as np
+
+from .obs_codec import ObsCodec
+from .checkpoint import flatten, save_checkpoint, load_checkpoint
+
+
+class RingBuffer:
+
+    def __init__(self, capacity, dedup_obs=False, obs_codec=None):
+        self.capacity = capacity
+        self.dedup_obs = dedup_obs
+        self.obs_codec = obs_codec if obs_codec is not None else ObsCodec()
+        self.obses = None
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rews = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+        self.new_obses = None
+        self.data_pointer = 0
+        self.size = 0
+
+        # Deduplicated mode: rows are written one block of n_env streams at a time, so the successor of row i
+        # in its own stream is row i + n_streams and new_obs[i] is obs[i + n_streams]. The newest block has no
+        # successor yet and keeps its new_obses aside, and rows whose stream was broken by an external reset
+        # (obs of the next block != new_obs) keep their real new_obs in a side table.
+        self.n_streams = 0
+        self.last_block_start = 0
+        self.last_new_obses = None
+        self.boundaries = np.zeros(capacity, dtype=bool) if dedup_obs else None
+        self.boundary_new_obses = {}
+
+        # Rows added since the last spill to disk (capped at capacity: then every row is new)
+        self.n_unspilled = 0
+
+    def _allocate(self, obs_shape):
+        # Observation storage is allocated on the first add, once the observation shape is known
+        self.obses = self.obs_codec.allocate(self.capacity, obs_shape)
+        if not self.dedup_obs:
+            self.new_obses = self.obs_codec.allocate(self.capacity, obs_shape)
+
+    def add(self, obses, actions, rews, dones, new_obses):
+        obses = np.asarray(obses, dtype=np.float32)
+        n = obses.shape[0]
+
+        if self.obses is None:
+            self._allocate(obses.shape[1:])
+
+        data_indices = (self.data_pointer + np.arange(n)) % self.capacity
+
+        if self.dedup_obs:
+            self._close_last_block(obses)
+            self._clear_boundaries(data_indices)
+
+        self.obs_codec.encode(self.obses, data_indices, obses)
+        self.actions[data_indices] = np.asarray(actions, dtype=np.int64)
+        self.rews[data_indices] = np.asarray(rews, dtype=np.float32)
+        self.dones[data_indices] = np.asarray(dones, dtype=np.float32)
+
+        if self.dedup_obs:
+            self.n_streams = n
+            self.last_block_start = self.data_pointer
+            self.last_new_obses = np.array(new_obses, dtype=np.float32)
+        else:
+            self.obs_codec.encode(self.new_obses, data_indices, np.asarray(new_obses, dtype=np.float32))
+
+        self.data_pointer = (self.data_pointer + n) % self.capacity
+        self.size = min([self.size + n, self.capacity])
+        self.n_unspilled = min([self.n_unspilled + n, self.capacity])
+
+        return data_indices
+
+    def _close_last_block(self, obses):
+        if self.last_new_obses is None:
+            return
+
+        # Successors are found n_streams rows ahead, a different block size would break every stored row
+        assert obses.shape[0] == self.n_streams, "Deduplicated storage needs the same number of streams on every add"
+
+        last_indices = (self.last_block_start + np.arange(self.n_streams)) % self.capacity
+        broken_streams = np.flatnonzero(np.any((obses != self.last_new_obses).reshape(self.n_streams, -1), axis=1))
+
+        for e in broken_streams:
+            self.boundaries[last_indices[e]] = True
+            self.boundary_new_obses[int(last_indices[e])] = self.last_new_obses[e]
+
+    def _clear_boundaries(self, data_indices):
+        if not self.boundary_new_obses:
+            return
+
+        for i in data_indices[self.boundaries[data_indices]]:
+            self.boundary_new_obses.pop(int(i), None)
+        self.boundaries[data_indices] = False
+
+    def _get_new_obses(self, data_indices):
+        new_obses = self.obs_codec.decode(self.obses, (data_indices + self.n_streams) % self.capacity)
+
+        positions_in_last_block = (data_indices - self.last_block_start) % self.capacity
+        in_last_block = positions_in_last_block < self.n_streams
+        if in_last_block.any():
+            new_obses[in_last_block] = self.last_new_obses[positions_in_last_block[in_last_block]]
+
+        on_boundary = self.boundaries[data_indices]
+        if on_boundary.any():
+            for j in np.flatnonzero(on_boundary):
+                new_obses[j] = self.boundary_new_obses[int(data_indices[j])]
+
+        return new_obses
+
+    def get(self, data_indices):
+        return (
+            self.obs_codec.decode(self.obses, data_indices),
+            self.actions[data_indices],
+            self.rews[data_indices],
+            self.dones[data_indices],
+            self._get_new_obses(data_indices) if self.dedup_obs else self.obs_codec.decode(self.new_obses, data_indices)
+        )
+
+    def bytes_per_transition(self):
+        if self.obses is None:
+            return 0
+
+        n_obs_copies = 1 if self.dedup_obs else 2
+        return n_obs_copies * self.obs_codec.bytes_per_obs(self.obses) + \
+            self.actions.itemsize + self.rews.itemsize + self.dones.itemsize
+
+    def _data_arrays(self):
+        # Capacity-sized arrays, row i of each belongs to transition i
+        arrays = {'actions': self.actions, 'rews': self.rews, 'dones': self.dones}
+        if self.obses is not None:
+            arrays['obses'] = self.obses
+        if self.new_obses is not None:
+            arrays['new_obses'] = self.new_obses
+        if self.dedup_obs:
+            arrays['boundaries'] = self.boundaries
+        return arrays
+
+    def _pointer_state(self):
+        state = {'data_pointer': self.data_pointer, 'size': self.size}
+
+        if self.dedup_obs:
+            state.update({'n_streams': self.n_streams, 'last_block_start': self.last_block_start})
+            if self.last_new_obses is not None:
+                state['last_new_obses'] = self.last_new_obses
+            if self.boundary_new_obses:
+                boundary_indices = sorted(self.boundary_new_obses)
+                state['boundary_indices'] = np.array(boundary_indices, dtype=np.int64)
+                state['boundary_new_obses'] = np.stack([self.boundary_new_obses[i] for i in boundary_indices])
+
+        return state
+
+    def state_dict(self):
+        return {**self._data_arrays(), **self._pointer_state()}
+
+    def load_state_dict(self, state, copy=True):
+        assert len(state['actions']) == self.capacity, "Replay snapshot capacity does not match the buffer size"
+
+        # By default arrays are copied: the snapshot may be a read-only or memory-mapped view
+        take = np.array if copy else np.asarray
+
+        self.actions = take(state['actions'])
+        self.rews = take(state['rews'])
+        self.dones = take(state['dones'])
+        self.data_pointer = int(state['data_pointer'])
+        self.size = int(state['size'])
+        self.obses = {k: take(v) for k, v in state['obses'].items()} if 'obses' in state else None
+        self.new_obses = {k: take(v) for k, v in state['new_obses'].items()} if 'new_obses' in state else None
+
+        if self.dedup_obs:
+            self.n_streams = int(state['n_streams'])
+            self.last_block_start = int(state['last_block_start'])
+            self.boundaries = take(state['boundaries'])
+            self.last_new_obses = np.array(state['last_new_obses']) if 'last_new_obses' in state else None
+            self.boundary_new_obses = {
+                int(i): np.array(new_obs) for i, new_obs in zip(state.get('boundary_indices', []), state.get('boundary_new_obses', []))
+            }
+
+        self.n_unspilled = self.size
+
+    def spill(self, path, extra_state=None):
+        """
+        Brings the on-disk copy at path up to date. Only rows added since the last spill are written into the
+        memory-mapped data file, then the small pointer state (plus extra_state) is replaced at path + '.state'.
+        """
+        if self.obses is None:
+            return
+
+        data = self._data_arrays()
+        arrays = flatten(data)[0]
+
+        try:
+            mapped = flatten(load_checkpoint(path, mode='r+'))[0]
+            layout_matches = {k: (v.dtype, v.shape) for k, v in mapped.items()} == {k: (v.dtype, v.shape) for k, v in arrays.items()}
+        except (FileNotFoundError, ValueError):
+            layout_matches = False
+
+        if not layout_matches or self.n_unspilled >= self.capacity:
+            save_checkpoint(path, data)
+        else:
+            rows = (self.data_pointer - self.n_unspilled + np.arange(self.n_unspilled)) % self.capacity
+            for k, v in arrays.items():
+                # Boundary flags are also cleared on rows the new ones overwrote, rewrite them all (1 byte per row)
+                if k == 'boundaries':
+                    mapped[k][:] = v
+                else:
+                    mapped[k][rows] = v[rows]
+            # All arrays are views of the same memory map
+            next(iter(mapped.values())).base.flush()
+
+        save_checkpoint(path + '.state', {**self._pointer_state(), **(extra_state or {})})
+        self.n_unspilled = 0
+
+    def restore(self, path):
+        """
+        Adopts the buffer spilled at path without reading it: the arrays stay copy-on-write views of the file, so
+        sampling can start at once, while a background thread reads the file ahead into the page cache.
+        Returns the spilled state (with any extra_state), or None if there is no usable spill.
+        """
+        try:
+            state = load_checkpoint(path + '.state')
+            data = load_checkpoint(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if len(data['actions']) != self.capacity or ('boundaries' in data) != self.dedup_obs or \
+                ('new_obses' in data) == self.dedup_obs:
+            return None
+        try:
+            self.obs_codec.decode(data['obses'], np.zeros(1, dtype=np.int64))
+        except (KeyError, AssertionError):
+            # Spilled with a different observation codec
+            return None
+
+        self.load_state_dict({**data, **state}, copy=False)
+        self.n_unspilled = 0
+
+        threading.Thread(target=self._read_ahead, args=(path,), daemon=True).start()
+
+        return state
+
+    @staticmethod
+    def _read_ahead(path, chunk_size=1 << 24):
+        chunk = bytearray(chunk_size)
+        with open(path, 'rb', buffering=0) as f:
+            while f.readinto(chunk):
+                pass
+
+    def __len__(self):
+        return self.size
@@ -5,71 +5,67 @@ class SumTree:
 
     def __init__(self, capacity):
         self.capacity = capacity
-        self.tree = np.zeros(2 * capacity - 1)
-        self.data = np.zeros(capacity, dtype=object)
-        self.data_pointer = 0
-        self.size = 0
-        self.max_priority_index = capacity - 1
-        self.min_priority_index = capacity - 1
-
-    def update(self, tree_index, priority):
-        max_p, min_p = self.tree[self.max_priority_index], self.tree[self.min_priority_index]
-
-        change = priority - self.tree[tree_index]
-        self.tree[tree_index] = priority
-
-        if priority >= max_p:
-            self.max_priority_index = tree_index
-        elif tree_index == self.max_priority_index:
-            self.max_priority_index = np.argmax(self.tree[self.capacity-1:self.capacity+self.size-1]) + self.capacity - 1
-        if priority <= min_p:
-            self.min_priority_index = tree_index
-        elif tree_index == self.min_priority_index:
-            self.min_priority_index = np.argmin(self.tree[self.capacity-1:self.capacity+self.size-1]) + self.capacity - 1
-
-        while not tree_index == 0:
-            tree_index = (tree_index - 1) // 2
-            self.tree[tree_index] += change
-
-    def add(self, priority, data):
-        tree_index = self.data_pointer + self.capacity - 1
-        self.data[self.data_pointer] = data
-        self.data_pointer = (self.data_pointer + 1) % self.capacity
-        self.size = min([self.size + 1, self.capacity])
-
-        self.update(tree_index, priority)
-
-    def get_leaf(self, v):
-        parent_index = 0
-
-        while True:
-            left_child_index = 2 * parent_index + 1
-            right_child_index = left_child_index + 1
-
-            if left_child_index >= len(self.tree):
-                leaf_index = parent_index
-                break
-            else:
-                if v <= self.tree[left_child_index]:
-                    parent_index = left_child_index
-                else:
-                    v -= self.tree[left_child_index]
-                    parent_index = right_child_index
-
-        data_index = leaf_index - self.capacity + 1
-
-        return leaf_index, self.tree[leaf_index], self.data[data_index]
+
+        # Leaves are padded to a power of two so every leaf sits at the same depth and a whole batch can be
+        # walked down (or up) the tree one level at a time. Node 1 is the root, leaf i is node tree_capacity + i.
+        self.tree_capacity = 1 << max(0, (capacity - 1).bit_length())
+        self.depth = self.tree_capacity.bit_length() - 1
+
+        self.tree = np.zeros(2 * self.tree_capacity, dtype=np.float64)
+        self.min_tree = np.full(2 * self.tree_capacity, np.inf, dtype=np.float64)
+        self.max_tree = np.zeros(2 * self.tree_capacity, dtype=np.float64)
+
+    def state_dict(self):
+        return {'tree': self.tree, 'min_tree': self.min_tree, 'max_tree': self.max_tree}
+
+    def load_state_dict(self, state):
+        assert len(state['tree']) == len(self.tree), "Sum tree snapshot capacity does not match the buffer size"
+
+        self.tree = np.array(state['tree'])
+        self.min_tree = np.array(state['min_tree'])
+        self.max_tree = np.array(state['max_tree'])
+
+    def update(self, data_indices, priorities):
+        tree_indices = np.asarray(data_indices, dtype=np.int64) + self.tree_capacity
+
+        self.tree[tree_indices] = priorities
+        self.min_tree[tree_indices] = priorities
+        self.max_tree[tree_indices] = priorities
+
+        for _ in range(self.depth):
+            tree_indices = np.unique(tree_indices // 2)
+            left_child_indices = 2 * tree_indices
+            right_child_indices = left_child_indices + 1
+
+            self.tree[tree_indices] = self.tree[left_child_indices] + self.tree[right_child_indices]
+            self.min_tree[tree_indices] = np.minimum(self.min_tree[left_child_indices], self.min_tree[right_child_indices])
+            self.max_tree[tree_indices] = np.maximum(self.max_tree[left_child_indices], self.max_tree[right_child_indices])
+
+    def get_leaves(self, v):
+        v = np.array(v, dtype=np.float64)
+        parent_indices = np.ones(v.shape, dtype=np.int64)
+
+        for _ in range(self.depth):
+            left_child_indices = 2 * parent_indices
+            left_priorities = self.tree[left_child_indices]
+
+            go_right = v > left_priorities
+            v = np.where(go_right, v - left_priorities, v)
+            parent_indices = left_child_indices + go_right
+
+        # Float round-off can push a sample past the last filled leaf into the zero-priority padding
+        data_indices = np.minimum(parent_indices - self.tree_capacity, self.capacity - 1)
+
+        return data_indices, self.tree[data_indices + self.tree_capacity]
 
     @property
     def total_priority(self):
-        return self.tree[0]
+        return self.tree[1]
 
     @property
     def max_priority(self):
-        return self.tree[self.max_priority_index]
+        return self.max_tree[1]
 
     @property
     def min_priority(self):
-        return self.tree[self.min_priority_index]
-
-
+        return self.min_tree[1]
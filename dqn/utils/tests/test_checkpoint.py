@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from dqn.utils.checkpoint import save_checkpoint, load_checkpoint, is_checkpoint, flatten, unflatten, ALIGNMENT
+
+
+def round_trip(tmp_path, tree, mode='c'):
+    path = str(tmp_path / "test.ckpt")
+    save_checkpoint(path, tree)
+    return load_checkpoint(path, mode=mode)
+
+
+@pytest.mark.parametrize("array", [
+    np.array(3.0),
+    np.array(7, dtype=np.int64),
+    np.zeros(0),
+    np.zeros((0, 3), dtype=np.float32),
+    np.arange(12, dtype=np.uint8).reshape(3, 4),
+    np.arange(40, dtype=np.float32).reshape(4, 10)[:, ::3], # Non-contiguous
+    np.asfortranarray(np.arange(12, dtype=np.float64).reshape(3, 4)),
+], ids=["0d_float", "0d_int", "empty", "empty_2d", "uint8", "non_contiguous", "fortran"])
+def test_array_round_trip_keeps_shape_dtype_and_values(tmp_path, array):
+    loaded = round_trip(tmp_path, {'a': array})['a']
+
+    assert loaded.shape == array.shape
+    assert loaded.dtype == array.dtype
+    np.testing.assert_array_equal(loaded, array)
+
+
+def test_nested_values_and_arrays(tmp_path):
+    tree = {
+        'online': {'fc.weight': np.ones((2, 3), dtype=np.float32), 'fc.bias': np.zeros(2, dtype=np.float32)},
+        'meta': {'step': 10, 'episode_count': 2, 'rew_mean': 1.5, 'name': "x", 'none': None},
+        'empty': {},
+    }
+    loaded = round_trip(tmp_path, tree)
+
+    assert loaded['meta'] == tree['meta']
+    assert loaded['empty'] == {}
+    np.testing.assert_array_equal(loaded['online']['fc.weight'], tree['online']['fc.weight'])
+    np.testing.assert_array_equal(loaded['online']['fc.bias'], tree['online']['fc.bias'])
+
+
+def test_tensors_are_aligned(tmp_path):
+    loaded = round_trip(tmp_path, {'a': np.zeros(3, dtype=np.uint8), 'b': np.zeros(5, dtype=np.float64)})
+
+    for array in loaded.values():
+        assert (array.__array_interface__['data'][0] - loaded['a'].base.__array_interface__['data'][0]) % ALIGNMENT == 0
+
+
+def test_copy_on_write_does_not_touch_file(tmp_path):
+    path = str(tmp_path / "test.ckpt")
+    save_checkpoint(path, {'a': np.zeros(4)})
+
+    load_checkpoint(path)['a'][:] = 1
+    np.testing.assert_array_equal(load_checkpoint(path)['a'], np.zeros(4))
+
+    load_checkpoint(path, mode='r+')['a'][:] = 2
+    np.testing.assert_array_equal(load_checkpoint(path)['a'], np.full(4, 2.0))
+
+
+def test_is_checkpoint(tmp_path):
+    path = str(tmp_path / "test.ckpt")
+    save_checkpoint(path, {'a': np.zeros(1)})
+    other = tmp_path / "other.pack"
+    other.write_bytes(b"\x81\xa4step\x01")
+
+    assert is_checkpoint(path)
+    assert not is_checkpoint(str(other))
+    with pytest.raises(ValueError):
+        load_checkpoint(str(other))
+
+
+def test_flatten_unflatten_inverse():
+    tree = {'a': {'b': np.zeros(1), 'c': 1}, 'd': 2}
+    arrays, values = flatten(tree)
+
+    assert set(arrays) == {'a/b'}
+    assert values == {'a/c': 1, 'd': 2}
+    assert unflatten(values, arrays)['a']['c'] == 1
+
+
+def test_optimizer_state_round_trip(tmp_path):
+    T = pytest.importorskip("torch")
+    from dqn.network import DeepQNetwork
+
+    def nn_conf_func(input_dim):
+        return T.nn.Sequential(T.nn.Linear(input_dim[0], 8), T.nn.ReLU()), 8, T.optim.Adam, T.nn.SmoothL1Loss
+
+    def make_network():
+        return DeepQNetwork(T.device('cpu'), 1e-3, nn_conf_func, (4,), 3)
+
+    network = make_network()
+    for _ in range(3):
+        network.optimizer.zero_grad()
+        network(T.randn(5, 4)).sum().backward()
+        network.optimizer.step()
+
+    loaded = round_trip(tmp_path, {'online': network.numpy_state_dict(), 'optimizer': network.numpy_optimizer_state_dict()})
+
+    restored = make_network()
+    restored.load_numpy_state_dict(loaded['online'])
+    restored.load_numpy_optimizer_state_dict(loaded['optimizer'])
+
+    expected, actual = network.optimizer.state_dict(), restored.optimizer.state_dict()
+    assert actual['param_groups'] == expected['param_groups']
+    for i, param_state in expected['state'].items():
+        for k, v in param_state.items():
+            assert actual['state'][i][k].shape == v.shape # Adam's 0-d step stays 0-d
+            assert T.equal(actual['state'][i][k], v)
+
+    # Both optimizers take the same next step
+    x = T.randn(5, 4)
+    for net in (network, restored):
+        net.optimizer.zero_grad()
+        net(x).sum().backward()
+        net.optimizer.step()
+    for p, q in zip(network.parameters(), restored.parameters()):
+        assert T.equal(p, q)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from dqn.utils.obs_codec import ObsCodec, GridObsCodec
+from dqn.utils.ring_buffer import RingBuffer
+
+
+MACRO_LEN, GRID_SHAPE = 14, (27, 5, 2)
+OBS_DIM = MACRO_LEN + GRID_SHAPE[0] * GRID_SHAPE[1] * GRID_SHAPE[2]
+
+
+def observations(rng, n):
+    grid = np.zeros((n,) + GRID_SHAPE, dtype=np.float32)
+    occupied = rng.random((n,) + GRID_SHAPE[:2]) < 0.3
+    grid[..., 0] = np.where(occupied, rng.random((n,) + GRID_SHAPE[:2]), 0.)
+    grid[..., 1] = occupied
+    return np.concatenate([rng.random((n, MACRO_LEN), dtype=np.float32), grid.reshape(n, -1)], axis=1)
+
+
+def round_trip(codec, obses):
+    storage = codec.allocate(len(obses), obses.shape[1:])
+    codec.encode(storage, np.arange(len(obses)), obses)
+    return codec.decode(storage, np.arange(len(obses))), storage
+
+
+def test_plain_codec_is_exact():
+    obses = observations(np.random.default_rng(0), 5)
+
+    decoded, storage = round_trip(ObsCodec(), obses)
+
+    np.testing.assert_array_equal(decoded, obses)
+    assert ObsCodec().bytes_per_obs(storage) == OBS_DIM * 4
+
+
+def test_grid_codec_error_bounds():
+    obses = observations(np.random.default_rng(1), 64)
+
+    decoded, _ = round_trip(GridObsCodec(MACRO_LEN, GRID_SHAPE), obses)
+
+    assert decoded.dtype == np.float32 and decoded.shape == obses.shape
+    grid, decoded_grid = obses[:, MACRO_LEN:].reshape((-1,) + GRID_SHAPE), decoded[:, MACRO_LEN:].reshape((-1,) + GRID_SHAPE)
+    assert np.abs(decoded[:, :MACRO_LEN] - obses[:, :MACRO_LEN]).max() <= 2 ** -12
+    assert np.abs(decoded_grid[..., 0] - grid[..., 0]).max() <= 1 / 510 + 1e-7
+    np.testing.assert_array_equal(decoded_grid[..., 1], grid[..., 1])
+
+
+def test_grid_codec_clips_speed_and_keeps_zero_exact():
+    obses = observations(np.random.default_rng(2), 2)
+    obses[0, MACRO_LEN] = 1.3
+    obses[1, MACRO_LEN] = 0.
+
+    decoded, _ = round_trip(GridObsCodec(MACRO_LEN, GRID_SHAPE), obses)
+
+    assert decoded[0, MACRO_LEN] == 1.
+    assert decoded[1, MACRO_LEN] == 0.
+
+
+def test_grid_codec_storage_size():
+    _, storage = round_trip(GridObsCodec(MACRO_LEN, GRID_SHAPE), observations(np.random.default_rng(3), 1))
+
+    n_cells = GRID_SHAPE[0] * GRID_SHAPE[1]
+    assert GridObsCodec(MACRO_LEN, GRID_SHAPE).bytes_per_obs(storage) == MACRO_LEN * 2 + n_cells + (n_cells + 7) // 8
+
+
+def test_grid_codec_rejects_other_layouts():
+    with pytest.raises(AssertionError):
+        GridObsCodec(MACRO_LEN, GRID_SHAPE).allocate(4, (OBS_DIM + 1,))
+    with pytest.raises(AssertionError):
+        GridObsCodec(MACRO_LEN, (27, 5, 3))
+
+
+@pytest.mark.parametrize("dedup_obs", [False, True])
+def test_ring_buffer_with_grid_codec(dedup_obs):
+    rng = np.random.default_rng(4)
+    codec = GridObsCodec(MACRO_LEN, GRID_SHAPE)
+    buffer = RingBuffer(6, dedup_obs=dedup_obs, obs_codec=codec)
+
+    obses = observations(rng, 2)
+    for _ in range(4):
+        new_obses = observations(rng, 2)
+        buffer.add(obses, [0, 1], [0., 1.], [0., 0.], new_obses)
+        last_obses, obses = obses, new_obses
+
+    # Last block, written at rows 0 and 1 after wrapping around
+    got_obses, _, _, _, got_new_obses = buffer.get(np.array([0, 1]))
+    np.testing.assert_array_equal(got_obses, round_trip(codec, last_obses)[0])
+    # Deduplicated storage keeps the newest new_obses aside in float32 until the next add
+    np.testing.assert_allclose(got_new_obses, obses, rtol=0, atol=1 / 510 + 1e-7)
@@ -0,0 +1,216 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from dqn.utils import ring_buffer
+from dqn.utils.obs_codec import GridObsCodec
+from dqn.utils.ring_buffer import RingBuffer
+
+
+OBS_DIM = 6
+
+
+def transitions(rng, n):
+    return (
+        rng.random((n, OBS_DIM), dtype=np.float32),
+        rng.integers(0, 4, size=n),
+        rng.standard_normal(n).astype(np.float32),
+        (rng.random(n) < 0.2).astype(np.float32),
+        rng.random((n, OBS_DIM), dtype=np.float32),
+    )
+
+
+def assert_same_transitions(buffer, reference):
+    # Ring order: the oldest transition sits at data_pointer once the buffer is full
+    indices = (buffer.data_pointer - len(reference) + np.arange(len(reference))) % buffer.capacity
+    for got, expected in zip(buffer.get(indices), zip(*reference)):
+        np.testing.assert_array_equal(got, np.array(expected))
+
+
+@pytest.mark.parametrize("n_env", [1, 3])
+def test_keeps_the_newest_capacity_transitions(n_env):
+    rng = np.random.default_rng(0)
+    buffer = RingBuffer(10)
+    reference = deque(maxlen=10)
+
+    for _ in range(9):
+        batch = transitions(rng, n_env)
+        buffer.add(*batch)
+        reference.extend(zip(*batch))
+
+        assert len(buffer) == len(reference)
+        assert_same_transitions(buffer, reference)
+
+
+def test_returns_the_written_rows():
+    rng = np.random.default_rng(1)
+    buffer = RingBuffer(5)
+    buffer.add(*transitions(rng, 4))
+
+    data_indices = buffer.add(*transitions(rng, 3))
+
+    np.testing.assert_array_equal(data_indices, [4, 0, 1])
+    assert buffer.data_pointer == 2
+
+
+def test_bytes_per_transition():
+    buffer = RingBuffer(8)
+    assert buffer.bytes_per_transition() == 0
+
+    buffer.add(*transitions(np.random.default_rng(2), 2))
+
+    assert buffer.bytes_per_transition() == 2 * OBS_DIM * 4 + 8 + 4 + 4
+
+
+def stream_transitions(rng, n_env, n_steps, reset_prob=0.3):
+    """Blocks of n_env parallel streams: obs is the previous new_obs unless the stream was reset."""
+    obses = rng.random((n_env, OBS_DIM), dtype=np.float32)
+    for _ in range(n_steps):
+        actions = rng.integers(0, 4, size=n_env)
+        rews = rng.standard_normal(n_env).astype(np.float32)
+        dones = (rng.random(n_env) < 0.2).astype(np.float32)
+        new_obses = rng.random((n_env, OBS_DIM), dtype=np.float32)
+        yield obses, actions, rews, dones, new_obses
+
+        obses = new_obses.copy()
+        resets = rng.random(n_env) < reset_prob
+        obses[resets] = rng.random((resets.sum(), OBS_DIM), dtype=np.float32)
+
+
+@pytest.mark.parametrize("n_env, capacity", [(1, 7), (3, 10), (4, 8)])
+def test_dedup_matches_plain_storage(n_env, capacity):
+    rng = np.random.default_rng(n_env)
+    plain, dedup = RingBuffer(capacity), RingBuffer(capacity, dedup_obs=True)
+
+    for batch in stream_transitions(rng, n_env, 12):
+        plain.add(*batch)
+        dedup.add(*batch)
+
+        indices = np.arange(len(plain))
+        for got, expected in zip(dedup.get(indices), plain.get(indices)):
+            np.testing.assert_array_equal(got, expected)
+
+
+def test_dedup_rejects_a_change_of_stream_count():
+    rng = np.random.default_rng(5)
+    dedup = RingBuffer(9, dedup_obs=True)
+    dedup.add(*next(stream_transitions(rng, 3, 1)))
+
+    with pytest.raises(AssertionError):
+        dedup.add(*next(stream_transitions(rng, 1, 1)))
+
+
+def test_dedup_stores_one_observation_per_transition():
+    rng = np.random.default_rng(6)
+    plain, dedup = RingBuffer(8), RingBuffer(8, dedup_obs=True)
+    batch = next(stream_transitions(rng, 2, 1))
+    plain.add(*batch)
+    dedup.add(*batch)
+
+    assert dedup.new_obses is None
+    assert plain.bytes_per_transition() - dedup.bytes_per_transition() == OBS_DIM * 4
+
+
+def test_state_dict_round_trip():
+    rng = np.random.default_rng(3)
+    buffer = RingBuffer(7)
+    for _ in range(4):
+        buffer.add(*transitions(rng, 2))
+
+    restored = RingBuffer(7)
+    restored.load_state_dict(buffer.state_dict())
+
+    assert (restored.data_pointer, len(restored)) == (buffer.data_pointer, len(buffer))
+    for got, expected in zip(restored.get(np.arange(7)), buffer.get(np.arange(7))):
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_load_state_dict_rejects_other_capacity():
+    buffer = RingBuffer(4)
+    buffer.add(*transitions(np.random.default_rng(4), 1))
+
+    with pytest.raises(AssertionError):
+        RingBuffer(5).load_state_dict(buffer.state_dict())
+
+
+def assert_same_buffers(buffer, expected):
+    assert (buffer.data_pointer, len(buffer)) == (expected.data_pointer, len(expected))
+    indices = np.arange(len(expected))
+    for got, want in zip(buffer.get(indices), expected.get(indices)):
+        np.testing.assert_array_equal(got, want)
+
+
+@pytest.fixture
+def spill_path(tmp_path):
+    return str(tmp_path / "replay.ckpt")
+
+
+@pytest.mark.parametrize("dedup_obs", [False, True])
+def test_spill_and_restore(spill_path, dedup_obs):
+    buffer = RingBuffer(10, dedup_obs=dedup_obs)
+    for batch in stream_transitions(np.random.default_rng(7), 3, 5):
+        buffer.add(*batch)
+
+    buffer.spill(spill_path, {'step': 5})
+    restored = RingBuffer(10, dedup_obs=dedup_obs)
+    state = restored.restore(spill_path)
+
+    assert state['step'] == 5
+    assert restored.n_unspilled == 0
+    assert_same_buffers(restored, buffer)
+
+
+def test_spill_writes_only_new_rows(spill_path, monkeypatch):
+    batches = stream_transitions(np.random.default_rng(8), 2, 10)
+    buffer = RingBuffer(12, dedup_obs=True)
+    for _ in range(4):
+        buffer.add(*next(batches))
+    buffer.spill(spill_path)
+
+    full_writes = []
+    save_checkpoint = ring_buffer.save_checkpoint
+    monkeypatch.setattr(ring_buffer, "save_checkpoint", lambda path, tree: (full_writes.append(path), save_checkpoint(path, tree)))
+    for _ in range(3): # Wraps around
+        buffer.add(*next(batches))
+    assert buffer.n_unspilled == 6
+    buffer.spill(spill_path)
+
+    assert full_writes == [spill_path + '.state']
+    restored = RingBuffer(12, dedup_obs=True)
+    restored.restore(spill_path)
+    assert_same_buffers(restored, buffer)
+
+
+def test_restore_is_copy_on_write(spill_path):
+    rng = np.random.default_rng(9)
+    buffer = RingBuffer(6)
+    buffer.add(*transitions(rng, 4))
+    buffer.spill(spill_path)
+
+    restored = RingBuffer(6)
+    restored.restore(spill_path)
+    restored.add(*transitions(rng, 4))
+
+    again = RingBuffer(6)
+    again.restore(spill_path)
+    assert_same_buffers(again, buffer)
+
+
+@pytest.mark.parametrize("other", [
+    lambda: RingBuffer(11),
+    lambda: RingBuffer(10, dedup_obs=True),
+    lambda: RingBuffer(10, obs_codec=GridObsCodec(2, (2, 1, 2))),
+], ids=["capacity", "dedup", "codec"])
+def test_restore_ignores_an_incompatible_spill(spill_path, other):
+    buffer = RingBuffer(10)
+    buffer.add(*transitions(np.random.default_rng(10), 3))
+    buffer.spill(spill_path)
+
+    restored = other()
+    assert restored.restore(spill_path) is None
+    assert len(restored) == 0
+
+
+def test_restore_without_spill(spill_path):
+    assert RingBuffer(4).restore(spill_path) is None
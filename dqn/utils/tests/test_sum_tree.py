@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from dqn.utils.sum_tree import SumTree
+
+
+def reference_leaves(priorities, v):
+    # Leaf whose cumulative priority range (start, end] holds v
+    return np.searchsorted(np.cumsum(priorities), v, side='left')
+
+
+@pytest.mark.parametrize("capacity", [1, 5, 8, 13])
+def test_totals_follow_updates(capacity):
+    rng = np.random.default_rng(capacity)
+    tree = SumTree(capacity)
+    priorities = np.zeros(capacity)
+
+    for _ in range(20):
+        data_indices = rng.integers(0, capacity, size=3)
+        new_priorities = rng.random(3) + 0.01
+        tree.update(data_indices, new_priorities)
+        priorities[data_indices] = new_priorities # Last write wins on duplicate indices, like NumPy assignment
+
+        filled = priorities[priorities > 0]
+        assert tree.total_priority == pytest.approx(priorities.sum())
+        assert tree.max_priority == pytest.approx(filled.max())
+        assert tree.min_priority == pytest.approx(filled.min())
+
+
+def test_get_leaves_matches_cumulative_search():
+    rng = np.random.default_rng(0)
+    priorities = rng.random(13) + 0.01
+    tree = SumTree(13)
+    tree.update(np.arange(13), priorities)
+
+    v = rng.random(1000) * tree.total_priority
+    data_indices, leaf_priorities = tree.get_leaves(v)
+
+    np.testing.assert_array_equal(data_indices, reference_leaves(priorities, v))
+    np.testing.assert_array_equal(leaf_priorities, priorities[data_indices])
+
+
+def test_get_leaves_skips_zero_priorities():
+    tree = SumTree(6)
+    tree.update(np.arange(6), [0., 1., 0., 2., 0., 0.])
+
+    data_indices, _ = tree.get_leaves([0.5, 1.0, 1.5, 3.0])
+
+    np.testing.assert_array_equal(data_indices, [1, 1, 3, 3])
+
+
+def test_get_leaves_stays_in_capacity_on_round_off():
+    tree = SumTree(5)
+    tree.update(np.arange(5), np.full(5, 0.1))
+
+    data_indices, _ = tree.get_leaves([tree.total_priority * (1 + 1e-12)])
+
+    assert data_indices[0] == 4
+
+
+def test_state_dict_round_trip():
+    tree = SumTree(6)
+    tree.update(np.arange(6), np.arange(1., 7.))
+
+    restored = SumTree(6)
+    restored.load_state_dict(tree.state_dict())
+
+    assert (restored.total_priority, restored.min_priority, restored.max_priority) == (21., 1., 6.)
+    with pytest.raises(AssertionError):
+        SumTree(9).load_state_dict(tree.state_dict())
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from dqn.utils.obs_codec import GridObsCodec
+from dqn.utils.transition_dataset import TransitionShardWriter, TransitionDataset, list_shards
+
+
+OBS_DIM = 5
+
+
+def write_dataset(dataset_dir, n_batches, shard_size=4, n_env=3, seed=0, obs_codec=None):
+    """Transitions whose action is their global index, so any sample can be checked against its source."""
+    rng = np.random.default_rng(seed)
+    writer = TransitionShardWriter(dataset_dir, shard_size, obs_codec, output_dim=8)
+    written = []
+    for _ in range(n_batches):
+        obses = rng.random((n_env, OBS_DIM), dtype=np.float32)
+        new_obses = rng.random((n_env, OBS_DIM), dtype=np.float32)
+        actions = np.arange(len(written), len(written) + n_env)
+        rews = rng.standard_normal(n_env).astype(np.float32)
+        dones = (rng.random(n_env) < 0.5).astype(np.float32)
+        writer.add(obses, actions, rews, dones, new_obses)
+        written += list(zip(obses, actions, rews, dones, new_obses))
+    writer.close()
+    return written
+
+
+def test_shards_are_filled_in_order(tmp_path):
+    write_dataset(str(tmp_path), n_batches=5) # 15 transitions, shards of 4
+
+    shards = list_shards(str(tmp_path))
+
+    assert [os.path.basename(path) for path in shards] == ['shard_000000.ckpt', 'shard_000001.ckpt', 'shard_000002.ckpt', 'shard_000003.ckpt']
+
+
+def test_later_runs_append_shards(tmp_path):
+    write_dataset(str(tmp_path), n_batches=2)
+    write_dataset(str(tmp_path), n_batches=2, seed=1)
+
+    dataset = TransitionDataset(str(tmp_path), batch_size=2, n_threads=1)
+    try:
+        assert len(list_shards(str(tmp_path))) == 4
+        assert len(dataset) == 12
+    finally:
+        dataset.close()
+
+
+def test_samples_match_written_transitions(tmp_path):
+    written = write_dataset(str(tmp_path), n_batches=7)
+
+    dataset = TransitionDataset(str(tmp_path), batch_size=16, n_threads=2)
+    try:
+        assert len(dataset) == len(written)
+        assert (dataset.obs_dim, dataset.output_dim) == (OBS_DIM, 8)
+        for _ in range(10):
+            obses, actions, rews, dones, new_obses = dataset.sample()
+            assert obses.shape == new_obses.shape == (16, OBS_DIM)
+            for i, action in enumerate(actions):
+                obs, _, rew, done, new_obs = written[action]
+                np.testing.assert_array_equal(obses[i], obs)
+                np.testing.assert_array_equal(new_obses[i], new_obs)
+                assert (rews[i], dones[i]) == (rew, done)
+    finally:
+        dataset.close()
+
+
+def test_dataset_with_grid_codec(tmp_path):
+    codec = GridObsCodec(1, (2, 1, 2))
+    write_dataset(str(tmp_path), n_batches=2, obs_codec=codec)
+
+    with pytest.raises(ValueError):
+        TransitionDataset(str(tmp_path), batch_size=2, n_threads=1)
+
+    dataset = TransitionDataset(str(tmp_path), batch_size=2, obs_codec=codec, n_threads=1)
+    try:
+        assert dataset.sample()[0].shape == (2, OBS_DIM)
+    finally:
+        dataset.close()
+
+
+def test_empty_dataset(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        TransitionDataset(str(tmp_path), batch_size=2)
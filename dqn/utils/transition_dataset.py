@@ -0,0 +1,163 @@
+import os
+import glob
+import queue
+import threading
+import numpy as np
+
+from .obs_codec import ObsCodec
+from .checkpoint import save_checkpoint, load_checkpoint
+
+
+SHARD_PATTERN = 'shard_{:06d}.ckpt'
+
+
+class TransitionShardWriter:
+    """
+    Appends collected transitions to a directory of fixed-size shards. Each shard is one checkpoint file with
+    the observations in the replay obs codec layout, so shards are memory-mapped by the loader without decoding
+    the whole file. Shards are numbered after the ones already in the directory, so several runs add to the
+    same dataset.
+    """
+
+    def __init__(self, dataset_dir, shard_size, obs_codec=None, output_dim=None):
+        self.dataset_dir = dataset_dir
+        self.shard_size = shard_size
+        self.obs_codec = obs_codec if obs_codec is not None else ObsCodec()
+        self.output_dim = output_dim
+
+        os.makedirs(self.dataset_dir, exist_ok=True)
+        self.shard_index = len(list_shards(self.dataset_dir))
+
+        self.obs_dim = None
+        self.obses = None
+        self.new_obses = None
+        self.actions = np.zeros(shard_size, dtype=np.int64)
+        self.rews = np.zeros(shard_size, dtype=np.float32)
+        self.dones = np.zeros(shard_size, dtype=np.float32)
+        self.n = 0
+
+    def add(self, obses, actions, rews, dones, new_obses):
+        obses = np.asarray(obses, dtype=np.float32)
+        new_obses = np.asarray(new_obses, dtype=np.float32)
+
+        if self.obses is None:
+            self.obs_dim = obses.shape[1]
+            self.obses = self.obs_codec.allocate(self.shard_size, obses.shape[1:])
+            self.new_obses = self.obs_codec.allocate(self.shard_size, obses.shape[1:])
+
+        i, n = 0, obses.shape[0]
+        while i < n:
+            k = min(n - i, self.shard_size - self.n)
+            rows = np.arange(self.n, self.n + k)
+
+            self.obs_codec.encode(self.obses, rows, obses[i:i + k])
+            self.obs_codec.encode(self.new_obses, rows, new_obses[i:i + k])
+            self.actions[rows] = np.asarray(actions[i:i + k], dtype=np.int64)
+            self.rews[rows] = np.asarray(rews[i:i + k], dtype=np.float32)
+            self.dones[rows] = np.asarray(dones[i:i + k], dtype=np.float32)
+
+            i += k
+            self.n += k
+            if self.n == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if self.n == 0:
+            return
+
+        n = self.n
+        save_checkpoint(os.path.join(self.dataset_dir, SHARD_PATTERN.format(self.shard_index)), {
+            'obses': {k: v[:n] for k, v in self.obses.items()},
+            'new_obses': {k: v[:n] for k, v in self.new_obses.items()},
+            'actions': self.actions[:n], 'rews': self.rews[:n], 'dones': self.dones[:n],
+            'meta': {'size': n, 'obs_dim': self.obs_dim, 'output_dim': self.output_dim}
+        })
+
+        self.shard_index += 1
+        self.n = 0
+
+    def close(self):
+        self.flush()
+
+
+def list_shards(dataset_dir):
+    return sorted(glob.glob(os.path.join(dataset_dir, 'shard_*.ckpt')))
+
+
+class TransitionDataset:
+    """
+    Uniform minibatch sampler over all shards of a dataset. Shards stay memory-mapped, and loader threads
+    sample, gather and decode batches ahead of the learner into a bounded queue (NumPy releases the GIL for the
+    copies), so the learner only pops ready batches.
+    """
+
+    def __init__(self, dataset_dir, batch_size, obs_codec=None, n_threads=4, prefetch=16):
+        self.dataset_dir = dataset_dir
+        self.batch_size = batch_size
+        self.obs_codec = obs_codec if obs_codec is not None else ObsCodec()
+
+        self.shards = [load_checkpoint(path) for path in list_shards(dataset_dir)]
+        if not self.shards:
+            raise FileNotFoundError("No transition shards in " + dataset_dir)
+
+        self.sizes = np.array([shard['meta']['size'] for shard in self.shards], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)])
+        self.obs_dim = self.shards[0]['meta']['obs_dim']
+        self.output_dim = self.shards[0]['meta']['output_dim']
+
+        try:
+            self.obs_codec.decode(self.shards[0]['obses'], np.zeros(1, dtype=np.int64))
+        except KeyError:
+            raise ValueError("Transition shards in " + dataset_dir + " were written with a different observation codec")
+
+        self.batches = queue.Queue(maxsize=prefetch)
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._loader, args=(seed,), daemon=True)
+            for seed in np.random.SeedSequence().spawn(n_threads)
+        ]
+        [thread.start() for thread in self.threads]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _gather(self, rng):
+        indices = np.sort(rng.integers(0, len(self), size=self.batch_size))
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+
+        obses = np.empty((self.batch_size, self.obs_dim), dtype=np.float32)
+        new_obses = np.empty((self.batch_size, self.obs_dim), dtype=np.float32)
+        actions = np.empty(self.batch_size, dtype=np.int64)
+        rews = np.empty(self.batch_size, dtype=np.float32)
+        dones = np.empty(self.batch_size, dtype=np.float32)
+
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            rows = indices[mask] - self.offsets[shard_id]
+            shard = self.shards[shard_id]
+
+            obses[mask] = self.obs_codec.decode(shard['obses'], rows)
+            new_obses[mask] = self.obs_codec.decode(shard['new_obses'], rows)
+            actions[mask] = shard['actions'][rows]
+            rews[mask] = shard['rews'][rows]
+            dones[mask] = shard['dones'][rows]
+
+        return obses, actions, rews, dones, new_obses
+
+    def _loader(self, seed):
+        rng = np.random.default_rng(seed)
+        while not self.stop_event.is_set():
+            batch = self._gather(rng)
+            while not self.stop_event.is_set():
+                try:
+                    self.batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def sample(self):
+        return self.batches.get()
+
+    def close(self):
+        self.stop_event.set()
+        [thread.join() for thread in self.threads]
@@ -1,47 +1,70 @@
 # env/custom_env/baselines.py
 
-from .sumo_env import SumoEnv
-import traci
+from .sumo_env import SumoEnv, TraCIException
 import numpy as np
+import math
 
 class BaselineMeta(SumoEnv):
+    """
+    Baselines run the ramp meter from a native SUMO program (or set it once per control cycle) and advance the
+    simulation one log interval ("baseline_log_interval_sec") per step, in as few TraCI calls as possible.
+    Metrics are collected once per step, at the end of the interval; the ramp queue is the interval mean of the
+    on-ramp vehicle number, integrated step by step like RLController's cycle mean (by the E2 detector in step_mode
+    "phase", as RLController does). The seconds the queue spent above "ramp_spillback_threshold_veh" are counted
+    per simulation step and logged as "ramp_spillback_sec", so the spillback time does not depend on the interval.
+    """
+
+    PROGRAM_ID = "external_control_program"
+    HOLD_PHASE_SEC = 86400 # Longer than any episode: the phase is held until the controller changes it
+
     def __init__(self, *args, **kwargs):
         super(BaselineMeta, self).__init__(*args, **kwargs)
         self.action_space_n = 1
         self.observation_space_n = 1
         self._last_step_info = {}
-        self.us_loops = ["up_stream_sens_0", "up_stream_sens_1", "up_stream_sens_2"]
-        self.ma_loops = ["bottle_neck_sens_0", "bottle_neck_sens_1", "bottle_neck_sens_2", "bottle_neck_sens_3"]
+        self.us_loops = self.get_role_induction_loops("upstream")
+        self.ma_loops = self.get_role_induction_loops("bottleneck")
         self.ds_loops = self.get_edge_induction_loops(self.DOWNSTREAM_EDGE)
+        self.log_interval_sec = self.args.get("baseline_log_interval_sec", 40.0)
+        self.ramp_queue_veh_sec = 0.0 # Ramp queue integral (vehicle-seconds) and its duration over the current step
+        self.ramp_queue_sec = 0.0
+        self.ramp_spillback_sec = 0.0 # Seconds of the current step with the ramp queue above the threshold
+        self.spillback_threshold_veh = self.args.get("ramp_spillback_threshold_veh", 20)
 
         self.ramp_meter_id = None
         self.green_phase_index = 0
         self.red_phase_index = 1
+        self.program_start_time = 0.0
         if self.tl_ids:
             self.ramp_meter_id = self.tl_ids[0]
             self._setup_tl_program()
 
+    def _tl_phases(self):
+        """(state, duration) of the program phases, green first. The default G/r program holds each phase."""
+        return [("G", self.HOLD_PHASE_SEC), ("r", self.HOLD_PHASE_SEC)]
+
     def _setup_tl_program(self):
-        """Creates and sets a simple G/r program. Must be called after every `traci.start()`."""
+        """Creates and sets the baseline program. Must be called after every `traci.start()`."""
         if not self.ramp_meter_id: return
         try:
-            program_id = "external_control_program"
             phases = [
-                traci.trafficlight.Phase(duration=3600, state="G", name="Green"),
-                traci.trafficlight.Phase(duration=3600, state="r", name="Red")
+                self.sumo_api.trafficlight.Phase(duration=duration, state=state, name="Green" if state == "G" else "Red")
+                for state, duration in self._tl_phases()
             ]
-            logic = traci.trafficlight.Logic(programID=program_id, type=0, currentPhaseIndex=0, phases=phases)
-            traci.trafficlight.setCompleteRedYellowGreenDefinition(self.ramp_meter_id, logic)
-            traci.trafficlight.setProgram(self.ramp_meter_id, program_id)
+            logic = self.sumo_api.trafficlight.Logic(programID=self.PROGRAM_ID, type=0, currentPhaseIndex=0, phases=phases)
+            self.conn.trafficlight.setCompleteRedYellowGreenDefinition(self.ramp_meter_id, logic)
+            self.conn.trafficlight.setProgram(self.ramp_meter_id, self.PROGRAM_ID)
             self.green_phase_index = 0
-            self.red_phase_index = 1
-        except traci.TraCIException as e:
+            self.red_phase_index = 1 if len(phases) > 1 else -1
+            self.program_start_time = self.get_current_time()
+        except TraCIException as e:
             print(f"[ERROR] Failed to set up TL program: {e}")
 
     def simulation_reset(self):
         """Overrides SumoEnv.simulation_reset to ensure TL program is set up after traci restarts."""
         super().simulation_reset()
         self._setup_tl_program()
+        self._start_interval()
 
     def reset(self):
         raise NotImplementedError("This method must be implemented by subclasses.")
@@ -50,6 +73,50 @@ class BaselineMeta(SumoEnv):
     def obs(self): return []
     def rew(self): return 0
     def done(self): return self.is_simulation_end() or self.get_current_time() >= self.args["steps"]
+
+    def _steps_for(self, duration_sec):
+        # Whole simulation steps, at least one, so every target time lies on the step grid
+        return max(1, int(round(duration_sec / self.sim_step_length)))
+
+    def _start_interval(self):
+        self.ramp_queue_veh_sec = 0.0
+        self.ramp_queue_sec = 0.0
+        self.ramp_spillback_sec = 0.0
+
+    def _step_target_time(self):
+        now = self.get_current_time()
+        return now + self._steps_for(min(self.log_interval_sec, self.args["steps"] - now)) * self.sim_step_length
+
+    def _advance(self, target_time):
+        """
+        Advances to target_time and adds the ramp queue vehicle-seconds and spillback seconds on the way. In step_mode
+        "phase" one call when the E2 detector integrates the queue within a single interval (live trip statistics need
+        every step's departures and arrivals); otherwise step by step with the exact on-ramp vehicle number.
+        """
+        num_steps = int(round((target_time - self.get_current_time()) / self.sim_step_length))
+        if num_steps <= 0:
+            return
+        end_time = self.get_current_time() + num_steps * self.sim_step_length
+
+        duration_sec = num_steps * self.sim_step_length
+
+        if (self.step_mode == "phase" and self.trip_stats is None and self.ramp_queue_detector is not None
+                and self.get_ramp_queue_interval_start(end_time) == self.get_ramp_queue_interval_start()):
+            queue_start = self.get_ramp_queue_vehicle_seconds()
+            self.simulation_step_until(end_time)
+            queue_veh_sec = self.get_ramp_queue_vehicle_seconds() - queue_start
+            self.ramp_queue_veh_sec += queue_veh_sec
+            # No per-step queue in this mode: spillback is judged on the mean over the call
+            if queue_veh_sec / duration_sec > self.spillback_threshold_veh:
+                self.ramp_spillback_sec += duration_sec
+        else:
+            for _ in range(num_steps):
+                self.simulation_step()
+                queue_veh = self.get_edge_ls_queue_length_vehicles(self.ON_RAMP_EDGE)
+                self.ramp_queue_veh_sec += queue_veh * self.sim_step_length
+                if queue_veh > self.spillback_threshold_veh:
+                    self.ramp_spillback_sec += self.sim_step_length
+        self.ramp_queue_sec += duration_sec
     
     def _collect_common_metrics(self):
         metrics = super().log_info()
@@ -63,12 +130,17 @@ class BaselineMeta(SumoEnv):
         metrics["mainline_flow_downstream_v/h"] = self.get_loops_flow_interval(self.ds_loops, detector_period)
         metrics["mainline_occ_downstream_percent"] = self.get_loops_occupancy_interval(self.ds_loops)
         metrics["mainline_speed_downstream_km/h"] = self.get_loops_flow_weigthed_mean_speed(self.ds_loops)
-        metrics["ramp_queue_veh"] = self.get_edge_ls_queue_length_vehicles(self.ON_RAMP_EDGE)
+        # Interval mean, as the per-second rows used to average to (a single end-of-interval sample is the end of red)
+        if self.ramp_queue_sec > 0:
+            metrics["ramp_queue_veh"] = self.ramp_queue_veh_sec / self.ramp_queue_sec
+        else:
+            metrics["ramp_queue_veh"] = self.get_edge_ls_queue_length_vehicles(self.ON_RAMP_EDGE)
+        metrics["ramp_spillback_sec"] = self.ramp_spillback_sec
         if self.ramp_meter_id:
             try:
                 metrics["current_tl_phase_index"] = self.get_phase(self.ramp_meter_id)
                 metrics["current_tl_ryg_state"] = self.get_ryg_state(self.ramp_meter_id)
-            except traci.TraCIException:
+            except TraCIException:
                 metrics["current_tl_phase_index"] = -1
                 metrics["current_tl_ryg_state"] = "unknown"
         return metrics
@@ -78,76 +150,110 @@ class BaselineMeta(SumoEnv):
 
 
 class AlwaysGreenBaseline(BaselineMeta):
+    def _tl_phases(self):
+        return [("G", self.HOLD_PHASE_SEC)]
+
     def reset(self):
         self.simulation_reset()
-        if self.ramp_meter_id is not None:
-            self.set_phase(self.ramp_meter_id, self.green_phase_index)
         self._update_log_info()
 
     def step(self, action):
-        self.simulation_step()
+        self._start_interval()
+        self._advance(self._step_target_time())
         self._update_log_info()
 
 
-# --- FixedCycleBaseline RESTORED AND CORRECTED ---
 class FixedCycleBaseline(BaselineMeta):
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        # The native program is installed by BaselineMeta.__init__, the timings must exist before
         self.tg_sec = 20.0
         self.tr_sec = 20.0
-        self.time_in_phase_sec = 0.0
-        self.is_green = True
+        super().__init__(*args, **kwargs)
+
+    def _tl_phases(self):
+        return [("G", self.tg_sec), ("r", self.tr_sec)]
 
     def reset(self):
         self.simulation_reset() # This now handles the TL setup
-        self.time_in_phase_sec = 0.0
-        self.is_green = True
-        if self.ramp_meter_id:
-            self.set_phase(self.ramp_meter_id, self.green_phase_index)
         self._update_log_info()
 
     def step(self, action):
-        if self.ramp_meter_id is None:
-            self.simulation_step(); self._update_log_info(); return
-        
-        if self.is_green and self.time_in_phase_sec >= self.tg_sec:
-            self.set_phase(self.ramp_meter_id, self.red_phase_index)
-            self.is_green = False
-            self.time_in_phase_sec = 0.0
-        elif not self.is_green and self.time_in_phase_sec >= self.tr_sec:
-            self.set_phase(self.ramp_meter_id, self.green_phase_index)
-            self.is_green = True
-            self.time_in_phase_sec = 0.0
-
-        self.simulation_step()
-        self.time_in_phase_sec += self.sim_step_length
+        # SUMO runs the G/r cycle itself
+        self._start_interval()
+        self._advance(self._step_target_time())
         self._update_log_info()
 
+    def _cycle_position(self):
+        """(is_green, time in phase) from the time since the program was installed, without querying SUMO."""
+        t = (self.get_current_time() - self.program_start_time) % (self.tg_sec + self.tr_sec)
+        return (True, t) if t < self.tg_sec else (False, t - self.tg_sec)
+
     def _update_log_info(self):
         super()._update_log_info()
+        is_green, time_in_phase_sec = self._cycle_position()
         self._last_step_info.update({
             "baseline_specific_action": "FixedCycle",
-            "fixed_cycle_is_green": self.is_green,
-            "fixed_cycle_time_in_phase": self.time_in_phase_sec
+            "fixed_cycle_is_green": is_green,
+            "fixed_cycle_time_in_phase": time_in_phase_sec
         })
 
 
-class AlineaDsBaseline(BaselineMeta):
+class CycleMeteringBaseline(BaselineMeta):
+    """
+    Cycle-level metering (ALINEA variants). At the start of every cycle the green time is computed once, the
+    green phase is set with that duration and SUMO switches to the held red phase by itself, so the simulation
+    advances from one cycle start to the next in a single call.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.CYCLE_LENGTH_SEC = self.args.get("alinea_detector_period_sec", 40.0)
+        self.cycle_end_time = 0.0
+
+    def reset(self):
+        self.simulation_reset()
+        self.cycle_end_time = self.get_current_time() # First cycle starts with the first step
+
+    def _calculate_new_cycle_times(self):
+        raise NotImplementedError
+
+    def _start_cycle(self):
+        self._calculate_new_cycle_times()
+        # Green on the simulation step grid, as long as the per-step controller held it
+        green_steps = math.ceil(self.active_green_time_sec / self.sim_step_length - 1e-9)
+        self.set_phase(self.ramp_meter_id, self.green_phase_index)
+        self.set_phase_duration(self.ramp_meter_id, green_steps * self.sim_step_length)
+        self.cycle_end_time = self.get_current_time() + self._steps_for(self.CYCLE_LENGTH_SEC) * self.sim_step_length
+
+    def step(self, action):
+        self._start_interval()
+        target_time = self._step_target_time()
+
+        if self.ramp_meter_id is None:
+            self._advance(target_time); self._update_log_info(); return
+
+        while self.get_current_time() < target_time - 1e-6 and not self.is_simulation_end():
+            if self.get_current_time() >= self.cycle_end_time - 1e-6:
+                self._start_cycle()
+            self._advance(min(target_time, self.cycle_end_time))
+
+        self._update_log_info()
+
+
+class AlineaDsBaseline(CycleMeteringBaseline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.CRITICAL_OCCUPANCY_PERCENT = 17; self.KR = 60
         self.MIN_METERING_RATE_VPH = 180; self.MAX_METERING_RATE_VPH = 1900
         self.MIN_GREEN_TIME_SEC = 3.0; self.RAMP_SATURATION_FLOW_VPS = 0.5
-        self.time_in_cycle_sec = 0.0; self.active_green_time_sec = 0.0
+        self.active_green_time_sec = 0.0
         self.downstream_detector_ids = []; self.current_metering_rate_vph = 0; self.measured_downstream_occ_for_log = 0.0
 
     def reset(self):
-        self.simulation_reset()
-        self.downstream_detector_ids = ["bottle_neck_sens_0", "bottle_neck_sens_1", "bottle_neck_sens_2", "bottle_neck_sens_3"]
+        super().reset()
+        self.downstream_detector_ids = self.ma_loops
        
         self.current_metering_rate_vph = (self.MAX_METERING_RATE_VPH + self.MIN_METERING_RATE_VPH) / 2
-        self.time_in_cycle_sec = self.CYCLE_LENGTH_SEC
         self.active_green_time_sec = self.MIN_GREEN_TIME_SEC
         self.measured_downstream_occ_for_log = 0.0
         self._update_log_info()
@@ -168,45 +274,25 @@ class AlineaDsBaseline(BaselineMeta):
         calculated_tg = vehs_per_cycle / self.RAMP_SATURATION_FLOW_VPS if self.RAMP_SATURATION_FLOW_VPS > 0 else self.MIN_GREEN_TIME_SEC
         self.active_green_time_sec = np.clip(calculated_tg, self.MIN_GREEN_TIME_SEC, self.CYCLE_LENGTH_SEC)
 
-    def step(self, action):
-        if self.ramp_meter_id is None:
-            self.simulation_step(); self._update_log_info(); return
-
-        if self.time_in_cycle_sec >= self.CYCLE_LENGTH_SEC:
-            self._calculate_new_cycle_times()
-            self.time_in_cycle_sec = 0.0
-
-        if self.time_in_cycle_sec < self.active_green_time_sec:
-            if self.get_phase(self.ramp_meter_id) != self.green_phase_index:
-                self.set_phase(self.ramp_meter_id, self.green_phase_index)
-        else:
-            if self.get_phase(self.ramp_meter_id) != self.red_phase_index:
-                self.set_phase(self.ramp_meter_id, self.red_phase_index)
-        
-        self.simulation_step()
-        self.time_in_cycle_sec += self.sim_step_length
-        self._update_log_info()
-
     def _update_log_info(self):
         super()._update_log_info(); active_red_time_sec = self.CYCLE_LENGTH_SEC - self.active_green_time_sec
         self._last_step_info.update({"baseline_specific_action": "Alinea", "alinea_measured_downstream_occ_percent": self.measured_downstream_occ_for_log, "alinea_current_metering_rate_vph": self.current_metering_rate_vph, "alinea_target_green_time_sec": self.active_green_time_sec, "alinea_target_red_time_sec": active_red_time_sec})
 
 
-class PiAlineaDsBaseline(BaselineMeta):
+class PiAlineaDsBaseline(CycleMeteringBaseline):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.CYCLE_LENGTH_SEC = self.args.get("alinea_detector_period_sec", 40.0)
         self.CRITICAL_OCCUPANCY_PERCENT = 17; self.KP = 60.0; self.KI = 10.0
         self.MIN_METERING_RATE_VPH = 180; self.MAX_METERING_RATE_VPH = 1800
         self.MIN_GREEN_TIME_SEC = 3.0; self.RAMP_SATURATION_FLOW_VPS = 0.5
-        self.time_in_cycle_sec = 0.0; self.active_green_time_sec = 0.0; self.integral_term = 0.0
+        self.active_green_time_sec = 0.0; self.integral_term = 0.0
         self.downstream_detector_ids = []; self.current_metering_rate_vph = 0; self.measured_downstream_occ_for_log = 0.0
 
     def reset(self):
-        self.simulation_reset()
-        self.downstream_detector_ids = ["bottle_neck_sens_0", "bottle_neck_sens_1", "bottle_neck_sens_2", "bottle_neck_sens_3"]
+        super().reset()
+        self.downstream_detector_ids = self.ma_loops
         self.current_metering_rate_vph = (self.MAX_METERING_RATE_VPH + self.MIN_METERING_RATE_VPH) / 2
-        self.integral_term = 0.0; self.time_in_cycle_sec = self.CYCLE_LENGTH_SEC
+        self.integral_term = 0.0
         self.active_green_time_sec = self.MIN_GREEN_TIME_SEC
         self.measured_downstream_occ_for_log = 0.0
         self._update_log_info()
@@ -229,25 +315,6 @@ class PiAlineaDsBaseline(BaselineMeta):
         calculated_tg = vehs_per_cycle / self.RAMP_SATURATION_FLOW_VPS if self.RAMP_SATURATION_FLOW_VPS > 0 else self.MIN_GREEN_TIME_SEC
         self.active_green_time_sec = np.clip(calculated_tg, self.MIN_GREEN_TIME_SEC, self.CYCLE_LENGTH_SEC)
 
-    def step(self, action):
-        if self.ramp_meter_id is None:
-            self.simulation_step(); self._update_log_info(); return
-
-        if self.time_in_cycle_sec >= self.CYCLE_LENGTH_SEC:
-            self._calculate_new_cycle_times()
-            self.time_in_cycle_sec = 0.0
-
-        if self.time_in_cycle_sec < self.active_green_time_sec:
-            if self.get_phase(self.ramp_meter_id) != self.green_phase_index:
-                self.set_phase(self.ramp_meter_id, self.green_phase_index)
-        else:
-            if self.get_phase(self.ramp_meter_id) != self.red_phase_index:
-                self.set_phase(self.ramp_meter_id, self.red_phase_index)
-        
-        self.simulation_step()
-        self.time_in_cycle_sec += self.sim_step_length
-        self._update_log_info()
-
     def _update_log_info(self):
         super()._update_log_info(); active_red_time_sec = self.CYCLE_LENGTH_SEC - self.active_green_time_sec
-        self._last_step_info.update({"baseline_specific_action": "PiAlinea", "pialinea_measured_downstream_occ_percent": self.measured_downstream_occ_for_log, "pialinea_current_metering_rate_vph": self.current_metering_rate_vph, "pialinea_target_green_time_sec": self.active_green_time_sec, "pialinea_target_red_time_sec": active_red_time_sec})
\ No newline at end of file
+        self._last_step_info.update({"baseline_specific_action": "PiAlinea", "pialinea_measured_downstream_occ_percent": self.measured_downstream_occ_for_log, "pialinea_current_metering_rate_vph": self.current_metering_rate_vph, "pialinea_target_green_time_sec": self.active_green_time_sec, "pialinea_target_red_time_sec": active_red_time_sec})
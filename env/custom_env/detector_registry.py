@@ -0,0 +1,94 @@
+# env/custom_env/detector_registry.py
+
+import re
+import xml.etree.ElementTree as ET
+
+
+class DetectorRegistry:
+    """
+    Static detector topology, parsed from the additional file.
+
+    Every induction loop and lane area detector is mapped to its lane, edge, lane index and position, and loops
+    are given a role from their ID (ROLES), so the controller and the baselines look their detectors up here
+    instead of hard-coding ID lists or asking TraCI for the topology. Built by NetGeometry.parse and pickled
+    with the rest of the geometry.
+    """
+
+    # Role -> ID pattern of the loops that play it
+    ROLES = {
+        "upstream": r"up_stream_sens_\d", # State loops, one per mainline lane
+        "upstream_secondary": r"up_stream_sens_\d\d",
+        "bottleneck": r"bottle_neck_sens_\d+",
+        "merge_start": r"merge_start_sens",
+        "outflow": r"outflow_sens_\d+",
+        "ramp_demand": r"demand_sens_\d+",
+        "ramp_queue": r"queue_sens",
+        "passage": r"passage_sens",
+        "passage_queue": r"passage_queue_sens",
+    }
+
+    def __init__(self, loops, lane_areas):
+        self.loops = loops
+        self.lane_areas = lane_areas
+
+    @classmethod
+    def parse(cls, add_path, lane_lengths, edge_lanes):
+        lane_edges = {lane_id: (edge_id, i) for edge_id, lanes in edge_lanes.items() for i, lane_id in enumerate(lanes)}
+        root = ET.parse(add_path).getroot()
+
+        loops = {}
+        for loop in root.iter('inductionLoop'):
+            loop_id, lane_id = loop.get('id'), loop.get('lane')
+            edge_id, lane_index = lane_edges.get(lane_id, (None, -1))
+            loops[loop_id] = {
+                "lane": lane_id, "edge": edge_id, "lane_index": lane_index,
+                "pos": cls._position(float(loop.get('pos', 0.0)), lane_lengths.get(lane_id, 0.0)),
+                "period": float(loop.get('period', loop.get('freq', 0.0))),
+                "role": cls.get_role(loop_id),
+            }
+
+        lane_areas = {}
+        for area in root.iter('laneAreaDetector'):
+            area_id, lane_id = area.get('id'), area.get('lane')
+            if lane_id is None: # Multi-lane detectors (lanes="...") are not used by the environment
+                continue
+            edge_id, lane_index = lane_edges.get(lane_id, (None, -1))
+            lane_length = lane_lengths.get(lane_id, 0.0)
+            pos = cls._position(float(area.get('pos', 0.0)), lane_length)
+            if area.get('length') is not None:
+                length = float(area.get('length'))
+            else:
+                length = cls._position(float(area.get('endPos', lane_length)), lane_length) - pos
+            lane_areas[area_id] = {
+                "lane": lane_id, "edge": edge_id, "lane_index": lane_index, "pos": pos, "length": length,
+                "period": float(area.get('period', area.get('freq', 0.0))),
+            }
+
+        return cls(loops, lane_areas)
+
+    @staticmethod
+    def _position(pos, lane_length):
+        # Negative positions count from the end of the lane
+        return lane_length + pos if pos < 0 else pos
+
+    @classmethod
+    def get_role(cls, loop_id):
+        for role, pattern in cls.ROLES.items():
+            if re.fullmatch(pattern, loop_id):
+                return role
+        return None
+
+    def loop_ids(self):
+        return sorted(self.loops)
+
+    def edge_loops(self, edge_id):
+        # Sorted like the TraCI ID lists
+        return sorted(loop_id for loop_id, loop in self.loops.items() if loop["edge"] == edge_id)
+
+    def role_loops(self, role):
+        """Loops of a role ordered by lane index, then position along the lane."""
+        loops = [(loop["lane_index"], loop["pos"], loop_id) for loop_id, loop in self.loops.items() if loop["role"] == role]
+        return [loop_id for _, _, loop_id in sorted(loops)]
+
+    def lane_index(self, detector_id):
+        return (self.loops.get(detector_id) or self.lane_areas[detector_id])["lane_index"]
@@ -0,0 +1,95 @@
+# env/custom_env/detectors.py
+
+from traci import constants as tc
+import numpy as np
+
+
+class DetectorSnapshot:
+    """
+    Per-step cache of induction loop values.
+
+    Every loop is subscribed once per simulation start to all the variables the flow, occupancy and speed
+    aggregations need. The subscription results come back with each simulation step, so reading them is a
+    single batched call instead of one TraCI round-trip per loop and per variable. The aggregations sum
+    in the same order as the per-loop polling helpers in SumoEnv, so the values are identical.
+    """
+
+    VARIABLES = (
+        tc.LAST_STEP_VEHICLE_NUMBER,
+        tc.LAST_STEP_MEAN_SPEED,
+        tc.VAR_LAST_INTERVAL_NUMBER,
+        tc.VAR_LAST_INTERVAL_OCCUPANCY,
+        tc.VAR_LAST_INTERVAL_SPEED,
+    )
+
+    def __init__(self):
+        self.conn = None
+        self.loop_ids = []
+        self.loop_index = {}
+        self.stale = True
+
+        self.ls_vehicle_number = np.zeros(0)
+        self.ls_mean_speed = np.zeros(0)
+        self.interval_vehicle_number = np.zeros(0)
+        self.interval_occupancy = np.zeros(0)
+        self.interval_mean_speed = np.zeros(0)
+
+    def subscribe(self, conn, loop_ids):
+        """Subscribes to all loops. Subscriptions do not survive a restart, call after every start."""
+        self.conn = conn
+        self.loop_ids = list(loop_ids)
+        self.loop_index = {loop_id: i for i, loop_id in enumerate(self.loop_ids)}
+
+        for loop_id in self.loop_ids:
+            self.conn.inductionloop.subscribe(loop_id, self.VARIABLES)
+
+        self.stale = True
+
+    def invalidate(self):
+        self.stale = True
+
+    def refresh(self):
+        if not self.stale:
+            return
+
+        results = self.conn.inductionloop.getAllSubscriptionResults()
+        values = np.array([[results[loop_id][v] for v in self.VARIABLES] for loop_id in self.loop_ids],
+                          dtype=np.float64).reshape(len(self.loop_ids), len(self.VARIABLES))
+
+        (self.ls_vehicle_number, self.ls_mean_speed, self.interval_vehicle_number,
+         self.interval_occupancy, self.interval_mean_speed) = values.T
+
+        self.stale = False
+
+    def indices(self, loop_ids):
+        """Row indices of loop_ids, or None if one of them is not subscribed."""
+        try:
+            return [self.loop_index[loop_id] for loop_id in loop_ids]
+        except KeyError:
+            return None
+
+    # --- Aggregations (same semantics as the SumoEnv.get_loops_* helpers) ---
+    def flow_interval(self, indices, interval_duration_sec):
+        self.refresh()
+        total_vehicles = sum(self.interval_vehicle_number[indices].tolist(), 0)
+        return (total_vehicles * 3600.0) / interval_duration_sec if indices else 0.0
+
+    def occupancy_interval(self, indices):
+        self.refresh()
+        total_occupancy = sum(self.interval_occupancy[indices].tolist(), 0.0)
+        return total_occupancy / len(indices) if indices else 0.0
+
+    def mean_speed_interval(self, indices):
+        self.refresh()
+        speeds = [speed for speed in self.interval_mean_speed[indices].tolist() if speed >= 0]
+        return sum(speeds, 0.0) / len(speeds) if speeds else 0.0
+
+    def flow_weighted_mean_speed(self, indices):
+        self.refresh()
+        total_speed = 0.0
+        total_flow = 0.0
+        for flow, speed in zip(self.ls_vehicle_number[indices].tolist(), self.ls_mean_speed[indices].tolist()):
+            if flow > 0 and speed >= 0:
+                total_speed += speed * flow
+                total_flow += flow
+        return (total_speed / total_flow) if total_flow > 0 else 0.0
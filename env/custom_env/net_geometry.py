@@ -0,0 +1,94 @@
+# env/custom_env/net_geometry.py
+
+import os
+import pickle
+import hashlib
+
+from .detector_registry import DetectorRegistry
+
+
+class NetGeometry:
+    """
+    Static network data SumoEnv needs, parsed once and cached on disk.
+
+    Reading the .net.xml with sumolib is the slowest part of building an environment. The parsed data (lane
+    lengths and shapes, edge lanes, internal-lane map, traffic lights and detector registry) is pickled to
+    <cache_dir>/<config>.geometry.<hash>.pkl, keyed by the content hash of the net and additional files, so
+    every later environment and every worker process only unpickles it.
+    """
+
+    VERSION = 2
+
+    def __init__(self, lane_lengths, lane_shapes, edge_lanes, internal_to_destination_map, tl_ids, detector_registry):
+        self.lane_lengths = lane_lengths
+        self.lane_shapes = lane_shapes
+        self.edge_lanes = edge_lanes
+        self.internal_to_destination_map = internal_to_destination_map
+        self.tl_ids = tl_ids
+        self.detector_registry = detector_registry
+
+    @classmethod
+    def load(cls, net_path, add_path, cache_dir, name):
+        cache_path = os.path.join(cache_dir, name + ".geometry." + cls.file_hash(net_path, add_path) + ".pkl")
+
+        try:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            pass
+
+        geometry = cls.parse(net_path, add_path)
+
+        # Write to a unique temp file and rename, several processes may build the cache at the same time
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(geometry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+        return geometry
+
+    @classmethod
+    def file_hash(cls, *paths):
+        h = hashlib.sha1(str(cls.VERSION).encode())
+        for path in paths:
+            if path is not None and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+        return h.hexdigest()[:16]
+
+    @classmethod
+    def parse(cls, net_path, add_path):
+        from sumolib import net
+
+        sumo_net = net.readNet(net_path)
+
+        lane_lengths, lane_shapes, edge_lanes = {}, {}, {}
+        for edge in sumo_net.getEdges():
+            edge_lanes[edge.getID()] = [lane.getID() for lane in edge.getLanes()]
+            for lane in edge.getLanes():
+                lane_lengths[lane.getID()] = lane.getLength()
+                lane_shapes[lane.getID()] = lane.getShape()
+
+        internal_to_destination_map = {}
+        for node in sumo_net.getNodes():
+            for conn in node.getConnections():
+                internal_lane_id = conn._via
+                to_lane_obj = conn._toLane
+                if internal_lane_id and to_lane_obj:
+                    internal_to_destination_map[internal_lane_id] = to_lane_obj.getID()
+
+        tl_ids = [tl.getID() for tl in sumo_net.getTrafficLights()]
+
+        if add_path is not None and os.path.exists(add_path):
+            detector_registry = DetectorRegistry.parse(add_path, lane_lengths, edge_lanes)
+        else:
+            detector_registry = DetectorRegistry({}, {})
+
+        return cls(lane_lengths, lane_shapes, edge_lanes, internal_to_destination_map, tl_ids, detector_registry)
+
+    def get_lane_length(self, lane_id):
+        return self.lane_lengths[lane_id]
+
+    def get_edge_detectors(self, edge_id):
+        return self.detector_registry.edge_loops(edge_id)
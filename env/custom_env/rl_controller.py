@@ -1,10 +1,21 @@
 # rl_env/custom_env/rl_controller.py
 
 from .sumo_env import SumoEnv
+from .utils import SUMO_PARAMS
 import numpy as np
 # import traci # Not strictly needed here if all traci calls are via self.xxx methods from SumoEnv
 
 class RLController(SumoEnv):
+    # Green times of the actions, and the size of the macro part of the observation
+    GREEN_TIME_ACTIONS_SEC = (5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0)
+    MACRO_STATE_SIZE = 14
+
+    @classmethod
+    def config_space_sizes(cls):
+        """(observation_space_n, action_space_n) from the config, without starting a simulation."""
+        grid_flat_size = SUMO_PARAMS["grid_rows"] * SUMO_PARAMS["grid_cols"] * SUMO_PARAMS["grid_channels"]
+        return cls.MACRO_STATE_SIZE + grid_flat_size, len(cls.GREEN_TIME_ACTIONS_SEC)
+
     def __init__(self, *args, **kwargs):
         super(RLController, self).__init__(*args, **kwargs) # Calls SumoEnv.__init__
 
@@ -14,7 +25,7 @@ class RLController(SumoEnv):
         # self.sim_step_length is inherited from SumoEnv, fetched after traci.start()
 
         # Action Space Definition
-        self.green_time_actions_sec = np.array([5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0])
+        self.green_time_actions_sec = np.array(self.GREEN_TIME_ACTIONS_SEC)
         self.action_space_n = len(self.green_time_actions_sec)
 
         # Ramp Meter Phase Indices (ensure these match your SUMO TL definition)
@@ -28,14 +39,13 @@ class RLController(SumoEnv):
         
 
         
-        self.upstream_detector_ids_state = ["up_stream_sens_0", "up_stream_sens_1", "up_stream_sens_2"]
-        self.bottleneck_detector_ids_state = ["bottle_neck_sens_0", "bottle_neck_sens_1", "bottle_neck_sens_2", "bottle_neck_sens_3"]
+        self.upstream_detector_ids_state = self.get_role_induction_loops("upstream")
+        self.bottleneck_detector_ids_state = self.get_role_induction_loops("bottleneck")
         self.outflow_detector_ids_reward = self.downstream_mainline_all_detector_ids
 
-        self.ramp_queue_detector_id = "queue_sens"
+        self.ramp_queue_detector_id = next(iter(self.get_role_induction_loops("ramp_queue")), None)
 
         # ---- Observation Space Definition ----
-        self.MACRO_STATE_SIZE = 14
         grid_flat_size = self.grid_rows * self.grid_cols * self.grid_channels
         self.observation_space_n = self.MACRO_STATE_SIZE + grid_flat_size #to be reviewed
 
@@ -63,8 +73,13 @@ class RLController(SumoEnv):
         
         self.sum_queue = 0.0
 
+        # Observation, reward and done of the current simulation step, see _cached()
+        self._step_cache = {}
+        self._step_cache_version = None
+
         self._last_detailed_info = {} # To store info from the last step
         self._initialize_last_detailed_info_placeholders() #  Initialize with placeholders
+        self._info_builder = None # Builds the info of the last reset/step on first request, see info()
 
 
     def _initialize_last_detailed_info_placeholders(self):
@@ -111,6 +126,19 @@ class RLController(SumoEnv):
         # The current set aims to match the provided baseline log closely.
 
 
+    def _cached(self, key, compute):
+        """
+        Value of compute() for the current simulation step. obs(), rew() and done() are asked for by every wrapper
+        layer after step() already computed them; the cache serves the repeats and is dropped as soon as the
+        simulation advances (sim_version) or the cycle data is refreshed.
+        """
+        if self._step_cache_version != self.sim_version:
+            self._step_cache = {}
+            self._step_cache_version = self.sim_version
+        if key not in self._step_cache:
+            self._step_cache[key] = compute()
+        return self._step_cache[key]
+
     def _reset_cycle_aggregators(self):
         """Resets accumulators for data collected over a control cycle."""
         self.sum_interval_upstream_veh_count = 0
@@ -128,6 +156,7 @@ class RLController(SumoEnv):
 
     def _collect_data_at_cycle_end(self):
         """Processes aggregated data at the end of a 40s cycle to form metrics."""
+        self._step_cache_version = None
         self.processed_flow_upstream_vph = self.get_loops_flow_interval(self.upstream_detector_ids_state, self.CYCLE_DURATION_SEC)
         self.processed_flow_merging_vph = self.get_loops_flow_interval(self.bottleneck_detector_ids_state, self.CYCLE_DURATION_SEC)
         self.processed_mainline_flow_downstream_vph = self.get_loops_flow_interval(self.outflow_detector_ids_reward, self.CYCLE_DURATION_SEC)
@@ -155,27 +184,36 @@ class RLController(SumoEnv):
         self.simulation_reset() # Calls super().simulation_reset()
         self._reset_cycle_aggregators()
         self.last_action_value_sec = self.green_time_actions_sec[0]
-        self._initialize_last_detailed_info_placeholders() # Re-initialize placeholders on reset
-        self._last_detailed_info.update(super(RLController, self).log_info()) # Get initial sim_time, episode
-        
-        if self.ramp_meter_id and self.red_phase_index != -1:
-            self.set_phase(self.ramp_meter_id, self.red_phase_index)
-            self.set_phase_duration(self.ramp_meter_id, self.CYCLE_DURATION_SEC)
 
-        num_init_steps = 0
-        if self.sim_step_length > 0: # pragma: no branch
-            num_init_steps = int(round(max(1.0, 5.0 / self.sim_step_length))) # Simulate for ~5 seconds, at least 1 step.
-        else: # pragma: no cover
-            num_init_steps = 5 # Fallback if sim_step_length is somehow 0
+        # A cached warmed-up state (reset_mode "state") already holds the red phase and the warm-up steps
+        if not self.warm_state_loaded:
+            if self.ramp_meter_id and self.red_phase_index != -1:
+                self.set_phase(self.ramp_meter_id, self.red_phase_index)
+                self.set_phase_duration(self.ramp_meter_id, self.CYCLE_DURATION_SEC)
 
-        for _ in range(num_init_steps):
-            if self.is_simulation_end(): break
-            self.simulation_step()
+            num_init_steps = 0
+            if self.sim_step_length > 0: # pragma: no branch
+                num_init_steps = int(round(max(1.0, self.warmup_sec / self.sim_step_length))) # Simulate the warm-up horizon, at least 1 step.
+            else: # pragma: no cover
+                num_init_steps = 5 # Fallback if sim_step_length is somehow 0
+
+            if self.step_mode == "phase" and self.trip_stats is None:
+                self.simulation_step_until(self.get_current_time() + num_init_steps * self.sim_step_length)
+            else:
+                for _ in range(num_init_steps):
+                    if self.is_simulation_end(): break
+                    self.simulation_step()
+
+            self.save_warm_state()
         
         self._collect_data_at_cycle_end() # Populate processed_ values
         
-        # Populate _last_detailed_info with collected data after initial steps for first observation
-        # This ensures the info() method can return something meaningful even before the first agent step.
+        # The info of the first observation is only built if someone asks for it (see info())
+        self._info_builder = self._build_reset_info
+
+        return self._get_current_observation()
+
+    def _build_reset_info(self):
         current_phase_index_init = -1
         current_ryg_state_init = "N/A"
         if self.ramp_meter_id:
@@ -183,8 +221,10 @@ class RLController(SumoEnv):
                 current_phase_index_init = self.get_phase(self.ramp_meter_id)
                 current_ryg_state_init = self.get_ryg_state(self.ramp_meter_id)
             except Exception: pass # pragma: no cover
-        
-        self._last_detailed_info.update({
+
+        self._initialize_last_detailed_info_placeholders()
+        info = self._last_detailed_info
+        info.update({
             "mainline_flow_upstream_v/h": self.processed_flow_upstream_vph,
             "mainline_occ_upstream_percent": self.processed_occ_upstream_percent,
             "mainline_speed_upstream_km/h": self.processed_speed_upstream_mps,
@@ -202,10 +242,9 @@ class RLController(SumoEnv):
             "current_tl_ryg_state": current_ryg_state_init,
             "chosen_green_time_sec": self.last_action_value_sec, # Initial assumed action
         })
-        self._last_detailed_info.update(super(RLController, self).log_info())
-
+        info.update(super(RLController, self).log_info())
 
-        return self._get_current_observation()
+        return info
 
 
     def step(self, action_index):
@@ -222,38 +261,26 @@ class RLController(SumoEnv):
         self._reset_cycle_aggregators()
 
         if self.ramp_meter_id and self.green_phase_index != -1 and chosen_green_time_sec > 0:
-            self.set_phase(self.ramp_meter_id, self.green_phase_index)
-            self.set_phase_duration(self.ramp_meter_id, chosen_green_time_sec)
-            num_steps_green = 0
-            if self.sim_step_length > 0: # pragma: no branch
-                num_steps_green = int(round(chosen_green_time_sec / self.sim_step_length))
-            # else: num_steps_green = int(chosen_green_time_sec) # Fallback, though sim_step_length should be >0
-
-            for _ in range(num_steps_green):
-                if self.is_simulation_end(): break
-                self.simulation_step()
-                self.sum_queue += self.get_edge_ls_queue_length_vehicles(self.ON_RAMP_EDGE)
+            self._run_phase(self.green_phase_index, chosen_green_time_sec)
 
         if self.ramp_meter_id and self.red_phase_index != -1 and red_time_sec > 0:
-            self.set_phase(self.ramp_meter_id, self.red_phase_index)
-            self.set_phase_duration(self.ramp_meter_id, red_time_sec)
-            num_steps_red = 0
-            if self.sim_step_length > 0: # pragma: no branch
-                num_steps_red = int(round(red_time_sec / self.sim_step_length))
-            # else: num_steps_red = int(red_time_sec)
-
-            for _ in range(num_steps_red):
-                if self.is_simulation_end(): break
-                self.simulation_step()
-                self.sum_queue += self.get_edge_ls_queue_length_vehicles(self.ON_RAMP_EDGE)
+            self._run_phase(self.red_phase_index, red_time_sec)
 
         self._collect_data_at_cycle_end()
 
         new_observation = self._get_current_observation()
        
         reward = self._calculate_reward()
-        is_done = self.is_simulation_end() or self.get_current_time() >= self.args["steps"]
-        
+        is_done = self.done()
+
+        # Training never looks at the info: it is only built (phase queries, log_info round-trips) when asked for
+        self._info_builder = lambda: self._build_step_info(chosen_green_time_sec)
+
+        return new_observation, reward, is_done, self.info() if self.log else {}
+
+    def _build_step_info(self, chosen_green_time_sec):
+        reward_components = self._reward_components()
+
         current_phase_index = -1
         current_ryg_state = "N/A"
         if self.ramp_meter_id:
@@ -280,21 +307,52 @@ class RLController(SumoEnv):
             "current_tl_phase_index": current_phase_index,
             "current_tl_ryg_state": current_ryg_state,
             "chosen_green_time_sec": chosen_green_time_sec,
-            "reward_outflow_speed_comp": self._reward_outflow_speed(),
-            "reward_throughput_comp": self._reward_throughput(),
-            "penalty_ramp_queue_comp": self._penalty_ramp_queue(),
-            "penalty_bottleneck_occ_comp": self._penalty_bottleneck_occ(),
-            "penalty_spillback_comp": self._penalty_spillback(),
+            "reward_outflow_speed_comp": reward_components["speed_down"],
+            "reward_throughput_comp": reward_components["throughput"],
+            "penalty_ramp_queue_comp": reward_components["queue"],
+            "penalty_bottleneck_occ_comp": reward_components["occ_bottle"],
+            "penalty_spillback_comp": reward_components["spillback"],
         }
        
         info_for_this_step.update(super(RLController, self).log_info()) # Adds sim_time, episode, total_...
 
-        self._last_detailed_info = info_for_this_step.copy()
+        return info_for_this_step
 
-        return new_observation, reward, is_done, info_for_this_step
 
+    def _run_phase(self, phase_index, duration_sec):
+        """Holds the ramp meter in phase_index for duration_sec and integrates the ramp queue (vehicle-steps) into sum_queue."""
+        self.set_phase(self.ramp_meter_id, phase_index)
+        self.set_phase_duration(self.ramp_meter_id, duration_sec)
+        num_steps = 0
+        if self.sim_step_length > 0: # pragma: no branch
+            num_steps = int(round(duration_sec / self.sim_step_length))
+
+        # Live trip statistics need every step's departures and arrivals. The E2 integral only holds within one
+        # detector interval, a phase crossing an interval boundary is stepped through.
+        if self.step_mode == "phase" and self.ramp_queue_detector is not None and self.trip_stats is None:
+            if num_steps == 0 or self.is_simulation_end():
+                return
+            end_time = self.get_current_time() + num_steps * self.sim_step_length
+            if self.get_ramp_queue_interval_start(end_time) != self.get_ramp_queue_interval_start():
+                self._run_steps(num_steps)
+                return
+            queue_start = self.get_ramp_queue_vehicle_seconds()
+            self.simulation_step_until(end_time)
+            self.sum_queue += (self.get_ramp_queue_vehicle_seconds() - queue_start) / self.sim_step_length
+            return
+
+        self._run_steps(num_steps)
+
+    def _run_steps(self, num_steps):
+        for _ in range(num_steps):
+            if self.is_simulation_end(): break
+            self.simulation_step()
+            self.sum_queue += self.get_edge_ls_queue_length_vehicles(self.ON_RAMP_EDGE)
 
     def _get_current_observation(self):
+        return self._cached("obs", self._compute_observation)
+
+    def _compute_observation(self):
         # ---- Part 1: Original Macro-State (Vector) ----
         norm_flow_upstream = np.clip(self.processed_flow_upstream_vph / self.MAX_FLOW_UPSTREAM_VPH, 0, 1)
         norm_flow_merging = np.clip(self.processed_flow_merging_vph / self.MAX_FLOW_MERGING_VPH, 0, 1)
@@ -352,7 +410,8 @@ class RLController(SumoEnv):
     
     
     def _reward_throughput(self):
-        max_possible_throughput = self.MAX_LANE_FLOW_VPH * self.get_edge_lane_n(self.DOWNSTREAM_EDGE) if self.get_edge_lane_n(self.DOWNSTREAM_EDGE) > 0 else self.MAX_LANE_FLOW_VPH
+        lane_n = self.get_edge_lane_n(self.DOWNSTREAM_EDGE)
+        max_possible_throughput = self.MAX_LANE_FLOW_VPH * lane_n if lane_n > 0 else self.MAX_LANE_FLOW_VPH
         norm_throughput = np.clip(self.processed_mainline_flow_downstream_vph / (max_possible_throughput if max_possible_throughput > 0 else 1.0), 0, 1)
         return norm_throughput
 
@@ -385,7 +444,24 @@ class RLController(SumoEnv):
             
         return 0.0
     
+    def _reward_components(self):
+        return self._cached("reward_components", lambda: {
+            # (+) REWARDS for good mainline conditions
+            "speed_merge": self._reward_merging_speed(),
+            "speed_up": self._reward_upstream_speed(),
+            "speed_down": self._reward_outflow_speed(),
+            "throughput": self._reward_throughput(), # Logged only
+            # (-) PENALTIES for bad conditions, already negative
+            "occ_bottle": self._penalty_bottleneck_occ(),
+            "occ_upstream": self._penalty_upstream_occ(),
+            "queue": self._penalty_ramp_queue(),
+            "spillback": self._penalty_spillback(),
+        })
+
     def _calculate_reward(self):
+        return self._cached("reward", self._compute_reward)
+
+    def _compute_reward(self):
     # --- Weights for each component ---
         # Give more weight to the critical merging and upstream areas
         w_speed_merge = 1.5   # Most important speed
@@ -399,19 +475,17 @@ class RLController(SumoEnv):
         w_spillback = 20.0    # A very large weight to make spillback catastrophic
 
         # --- Calculate each component ---
-        # (+) REWARDS for good mainline conditions
-        # Use the specific speed rewards you already wrote!
-        r_speed_merge = self._reward_merging_speed()
-        r_speed_up = self._reward_upstream_speed()
-        r_speed_down = self._reward_outflow_speed() # Renamed from r_speed for clarity
-
-        # (-) PENALTIES for bad conditions
-        p_occ_bottle = self._penalty_bottleneck_occ()
-        p_occ_upstream = self._penalty_upstream_occ()  # This is already negative, so we add it directly
-        p_queue = self._penalty_ramp_queue()
-        # The spillback function returns a negative value, so we add it directly.
-        # The weight w_spillback will make it highly punitive.
-        p_spillback = self._penalty_spillback() 
+        components = self._reward_components()
+        r_speed_merge = components["speed_merge"]
+        r_speed_up = components["speed_up"]
+        r_speed_down = components["speed_down"]
+
+        # The penalties are already negative, so we add them directly.
+        # The weight w_spillback will make spillback highly punitive.
+        p_occ_bottle = components["occ_bottle"]
+        p_occ_upstream = components["occ_upstream"]
+        p_queue = components["queue"]
+        p_spillback = components["spillback"]
 
         # --- Combine into the final reward ---
         reward = ( (w_speed_merge * r_speed_merge) +
@@ -440,13 +514,16 @@ class RLController(SumoEnv):
      
     def done(self):
         # This method is called by DqnEnv.done() -> CustomEnvWrapper._done()
-        return self.is_simulation_end() or self.get_current_time() >= self.args["steps"]   
+        return self._cached("done", lambda: self.is_simulation_end() or self.get_current_time() >= self.args["steps"])
 
     def info(self):
         """
         Returns the detailed information dictionary from the last completed step.
         This is called by DqnEnv.info() -> CustomEnvWrapper._info().
         """
-        # The _last_detailed_info should be populated by __init__/reset and then by step()
-        # It already includes sim_time, episode, etc. from super().log_info()
-        return self._last_detailed_info
\ No newline at end of file
+        # Built from the state of the last reset/step on the first request. It already includes sim_time, episode,
+        # etc. from super().log_info()
+        if self._info_builder is not None:
+            self._last_detailed_info = self._info_builder()
+            self._info_builder = None
+        return self._last_detailed_info
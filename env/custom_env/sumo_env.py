@@ -5,18 +5,23 @@ from __future__ import absolute_import, print_function
 
 # Import the SUMO_PARAMS dictionary
 from .utils import SUMO_PARAMS # Make sure SUMO_PARAMS includes 'v_max_speed'
+from .detectors import DetectorSnapshot
+from .trip_stats import TripStatsCollector
+from .net_geometry import NetGeometry
 
 # Import standard Python libraries.
 import sys
 import os
 import json
+import hashlib
 import random 
+import itertools
 from colorama import Fore
 
 
 # Import SUMO libraries.
 try:
-    from sumolib import net  # noqa
+    from sumolib import net, geomhelper  # noqa
     import traci  # noqa
     from traci import constants as tc 
 except ImportError:
@@ -39,12 +44,30 @@ try:
 except ImportError:
     sys.exit("Please declare the SUMO_HOME environment variable or ensure 'sumo/tools' is in sys.path.")
 
+# Optional in-process backend, selected with SUMO_PARAMS["backend"] = "libsumo"
+try:
+    import libsumo  # noqa
+except ImportError:
+    libsumo = None
+
+# Exceptions raised by either backend
+TraCIException = (traci.TraCIException, libsumo.TraCIException) if libsumo is not None else (traci.TraCIException,)
+
 
 # Define the main class representing the SUMO simulation environment.
 class SumoEnv:
     # Define a relative path for environment-specific configuration and data files.
     SUMO_ENV = "env/custom_env/" # Relative to project root where play.py/train.py are run
 
+    # Every instance owns a labeled TraCI connection, so several simulations can live in one process
+    _instance_ids = itertools.count()
+
+    # Edge whose vehicle context subscription feeds the micro grid
+    GRID_CONTEXT_EDGE = "acceleration_area"
+
+    # E2 detector over the whole on-ramp (see the config's .add.xml), integrates the ramp queue in step_mode "phase"
+    RAMP_QUEUE_DETECTOR = "ramp_queue_e2"
+
     # --- Static Methods (Pretty Print, ArgMax, ArgMin, Clip) ---
     @staticmethod
     def pretty_print(d):
@@ -62,25 +85,59 @@ class SumoEnv:
     def clip(min_clip, max_clip, x):
         return max(min_clip, min([max_clip, x])) if min_clip < max_clip else x
 
-    def __init__(self, gui=False, log=False, rnd=(False, False)):
+    def __init__(self, gui=False, log=False, rnd=(False, False), worker_id=None):
         self.args = SUMO_PARAMS
         # self.gui = False # Temp set for setup - Handled by actual gui flag later
         self.config = self.args["config"]
         self.data_dir = self.SUMO_ENV + "data/" + self.config + "/"
         self.net_file_name = self.config + ".net.xml" # Or "ramp.net.xml" if names differ
+
+        # TraCI connection label and per-worker output files.
+        # worker_id=None keeps the shared data_dir paths (single simulation, evaluate.py reads tripinfo.xml there).
+        self.worker_id = worker_id
+        self.backend = self._select_backend(gui)
+        self.label = f"{self.config}_{os.getpid()}_{next(SumoEnv._instance_ids)}"
+        self.conn = None
+        self.detectors = DetectorSnapshot()
+        # SUMO_EVAL_OUTPUT_DIR: scratch dir of a parallel evaluation worker (see evaluate.py).
+        eval_output_dir = os.environ.get("SUMO_EVAL_OUTPUT_DIR")
+        if self.worker_id is None and not eval_output_dir:
+            self.output_dir = self.data_dir
+            self.output_prefix = ""
+        elif self.worker_id is None:
+            self.output_dir = os.path.join(eval_output_dir, "")
+            self.output_prefix = os.path.basename(os.path.normpath(eval_output_dir)) + "_"
+            os.makedirs(self.output_dir, exist_ok=True)
+        else:
+            self.output_dir = self.data_dir + "workers/w" + str(self.worker_id) + "/"
+            self.output_prefix = "w" + str(self.worker_id) + "_"
+            os.makedirs(self.output_dir, exist_ok=True)
+        self.route_file_path = None # Scenario library file of the current episode (None: the route file of the sumocfg)
+        self.state_dir = self.output_dir + "states/"
+        # SUMO applies --output-prefix to the file name of every output, tripinfo included
+        self.tripinfo_file_path = self.output_dir + self.output_prefix + "tripinfo.xml"
+
+        # SUMO_EVAL_TRIP_STATS: "tripinfo" (default, evaluate.py parses tripinfo.xml), "live" (TripStatsCollector,
+        # no tripinfo output) or "validate" (both, to compare them).
+        self.trip_stats_mode = os.environ.get("SUMO_EVAL_TRIP_STATS", "tripinfo")
+        self.trip_stats = TripStatsCollector() if self.trip_stats_mode in ("live", "validate") else None
         
+        # Static network data, parsed once per net/additional file version and cached under data_dir/cache/
         try:
-            self.net = net.readNet(self.data_dir + self.net_file_name)
+            self.geometry = NetGeometry.load(self.data_dir + self.net_file_name, self.data_dir + self.config + ".add.xml",
+                                             self.data_dir + "cache/", self.config)
         except Exception as e:
             print(f"Error reading net file: {self.data_dir + self.net_file_name}")
             print(e)
             sys.exit(1)
+        # Detector topology (edges, lanes, roles) comes with the geometry, construction asks TraCI nothing about it
+        self.detector_registry = self.geometry.detector_registry
         
         # Initialize grid parameters based on the network.
         self._initialize_grid_params_from_net()
         
         # Initialize traffic light IDs and ramp meter ID
-        self.tl_ids = [tl.getID() for tl in self.net.getTrafficLights()]
+        self.tl_ids = list(self.geometry.tl_ids)
         if not self.tl_ids:
             print("Warning: No traffic lights (ramp meters) found in the network.")
             self.ramp_meter_id = None
@@ -122,10 +179,26 @@ class SumoEnv:
         
         
         # self.log_file_path = log_file
-        self.generate_rou = self.args.get("generate_route_file", False) # Whether to generate a new route file each time
-        # Generate the first route file before starting SUMO
-        if self.generate_rou == True: # If you want to generate a new route file each time
-            self._generate_route_file() 
+        self.generate_rou = self.args.get("generate_route_file", False) # Whether to sample a demand scenario each episode
+        self.reset_mode = self.args.get("reset_mode", "restart")
+        self.warm_state_loaded = False # Whether the current episode started from a cached warmed-up state
+        self.warmup_options = list(self.args.get("warmup_sec", [5.0]))
+        self.warmup_sec = self.warmup_options[0] # Warm-up horizon of the current episode
+        self.step_mode = self.args.get("step_mode", "step")
+        # E2 detector over the on-ramp, if the additional file defines it
+        ramp_queue_area = self.detector_registry.lane_areas.get(self.RAMP_QUEUE_DETECTOR)
+        self.ramp_queue_detector = self.RAMP_QUEUE_DETECTOR if ramp_queue_area is not None else None
+        self.ramp_queue_detector_length = ramp_queue_area["length"] if ramp_queue_area is not None else 0.0
+        if self.ramp_queue_detector is None and self.step_mode == "phase":
+            print(Fore.YELLOW, "Note: no " + self.RAMP_QUEUE_DETECTOR + " detector, step_mode \"phase\" falls back to per-step simulation.", Fore.RESET)
+        self.sim_start_time = 0.0
+        self.detector_begin_time = 0.0
+        self.ramp_queue_veh_length = 5.0
+        self.sim_version = 0 # Changes with every simulation step or (re)load, keys per-step caches
+        # Pick the first demand scenario before starting SUMO
+        if self.generate_rou == True: # If you want a new demand scenario each episode
+            self._build_scenario_library()
+            self._select_scenario()
         
         # Generate the final SUMO command-line parameters.
         self.params = self.set_params()
@@ -134,15 +207,75 @@ class SumoEnv:
 
         # Start TraCI connection
         try:
-            traci.start(self.params)
-            self.sim_step_length = traci.simulation.getDeltaT()
-        except traci.TraCIException as e:
+            self._start_connection()
+        except TraCIException as e:
             print(f"Error starting TraCI: {e}")
             print("Ensure SUMO_HOME is set correctly and SUMO binaries are in the PATH or SUMO_HOME/bin.")
             print(f"SUMO command: {' '.join(self.params)}")
             sys.exit(1)
 
 
+    def _select_backend(self, gui):
+        backend = self.args.get("backend", "traci")
+        if backend == "libsumo":
+            if libsumo is None:
+                print(Fore.YELLOW, "Note: libsumo is not installed, falling back to the traci backend.", Fore.RESET)
+                return "traci"
+            if gui:
+                # libsumo runs the simulation in-process and cannot drive sumo-gui
+                print(Fore.YELLOW, "Note: libsumo does not support the GUI, falling back to the traci backend.", Fore.RESET)
+                return "traci"
+        return backend
+
+    def _start_connection(self):
+        if self.backend == "libsumo":
+            # In-process simulation: the libsumo module exposes the same domains as a TraCI connection
+            libsumo.start(self.params)
+            self.conn = libsumo
+        else:
+            traci.start(self.params, label=self.label)
+            self.conn = traci.getConnection(self.label)
+        self._on_simulation_start()
+
+    def _reload_simulation(self):
+        # Reuses the running SUMO process: same options, plus the cached warmed-up state of this demand scenario if any
+        load_params = self.params[1:]
+        self.warm_state_loaded = False
+        if self.reset_mode == "state" and os.path.exists(self.warm_state_path()):
+            load_params = load_params + ["--load-state", self.warm_state_path()]
+            self.warm_state_loaded = True
+
+        self.conn.load(load_params)
+        self._on_simulation_start()
+
+    def _on_simulation_start(self):
+        self.sim_version += 1
+        # Subscriptions do not survive a (re)load of the simulation
+        self.sim_step_length = self.conn.simulation.getDeltaT()
+        self.detectors.subscribe(self.conn, self.detector_registry.loop_ids() or self.conn.inductionloop.getIDList())
+        self._subscribe_grid_context()
+        # Ramp queue of every step comes back with the step itself
+        self.conn.edge.subscribe(self.ON_RAMP_EDGE, [tc.LAST_STEP_VEHICLE_NUMBER])
+        self.sim_start_time = self.conn.simulation.getTime()
+        # Detector intervals are aligned on the "begin" option, which --load-state moves to the saved time
+        try:
+            self.detector_begin_time = float(self.conn.simulation.getOption("begin"))
+        except (TraCIException, AttributeError, ValueError): # getOption needs SUMO >= 1.17
+            self.detector_begin_time = self.sim_start_time
+        self.ramp_queue_veh_length = self.args.get("ramp_queue_veh_length")
+        if not self.ramp_queue_veh_length:
+            try:
+                self.ramp_queue_veh_length = self.conn.vehicletype.getLength(self.args.get("v_type_con", "con"))
+            except TraCIException:
+                self.ramp_queue_veh_length = 5.0 # SUMO's default passenger car length
+        if self.trip_stats is not None:
+            self.trip_stats.start(self.conn, self.sim_step_length)
+
+    @property
+    def sumo_api(self):
+        """Module providing the backend's helper classes (e.g. trafficlight.Phase / Logic)."""
+        return libsumo if self.backend == "libsumo" else traci
+
     def set_params(self):
         sumocfg_path = self.data_dir + self.config + ".sumocfg"
         emission_xml_path = os.path.join(os.path.dirname(self.data_dir), "emissions.xml")
@@ -153,15 +286,22 @@ class SumoEnv:
         params = [
             "sumo-gui" if self.gui else "sumo",
             "-c", sumocfg_path,
-            "--tripinfo-output", self.data_dir + "tripinfo.xml",
             
             "--device.emissions.probability", "1.0",
             "--time-to-teleport", str(self.args.get("time_to_teleport", 300)),
             "--waiting-time-memory", str(self.args.get("waiting_time_memory", 1000)),
             "--no-warnings", "true",
         ]
+        if self.trip_stats_mode != "live":
+            params += ["--tripinfo-output", self.output_dir + "tripinfo.xml"]
         # if self.log_file_path:
         #     params += ["--log-file", self.log_file_path]
+        if self.route_file_path is not None:
+            # Scenario library file, replaces the route file of the sumocfg
+            params += ["--route-files", self.route_file_path]
+        if self.output_dir != self.data_dir:
+            # Workers prefix detector outputs so they don't overwrite each other
+            params += ["--output-prefix", self.output_prefix]
         if sumo_seed:
             params += ["--seed", str(sumo_seed)]
         elif self.seed:
@@ -196,7 +336,7 @@ class SumoEnv:
         self.grid_channels = 2
         self.cell_length_m = self.args.get("cell_length", 8.0)
         self.accel_segment_len = 84.0
-        self.passage_segment_len = self.net.getLane("passage_area_0").getLength()
+        self.passage_segment_len = self.geometry.get_lane_length("passage_area_0")
         
         self.grid_total_length = 216.0 
         
@@ -207,36 +347,13 @@ class SumoEnv:
         
         
 
-        self.internal_to_destination_map = {}
-        try:
-            for node in self.net.getNodes():
-                for conn in node.getConnections():
-                    internal_lane_id = conn._via
-                    to_lane_obj = conn._toLane
-                    if internal_lane_id and to_lane_obj:
-                        self.internal_to_destination_map[internal_lane_id] = to_lane_obj.getID()
-        except AttributeError:
-            print("--- FATAL ERROR: Could not read connections from network file. ---")
-            sys.exit(1)
-        
-        print("--- Internal Lane Map ---")
-        for k, v in self.internal_to_destination_map.items():
-            print(f"  '{k}' -> '{v}'")
-        print("-------------------------\n")
+        self.internal_to_destination_map = self.geometry.internal_to_destination_map
 
+        self._initialize_grid_lane_table()
+        self._initialize_grid_context_range()
 
-    def _create_grid_observation(self):
-        #  Initialize the grid with 5 columns ---
-        grid = np.zeros((self.grid_rows, self.grid_cols, self.grid_channels), dtype=np.float32)
-        try:
-            all_veh_data = traci.vehicle.getSubscriptionResults(None)
-        except traci.TraCIException:
-            return grid
-
-        v_type_con = self.args.get("v_type_con", "con")
-        freeflow_speed = self.FREEFLOW_SPEED_MPS if self.FREEFLOW_SPEED_MPS > 0 else 35.0
-        
-        # This is a static map for our new column logic. It's clear and cannot be misinterpreted.
+    def _initialize_grid_lane_table(self):
+        # This is a static map for our column logic. It's clear and cannot be misinterpreted.
         column_map = {
             'main_road_2': 0, 'acceleration_area_3': 0,
             'main_road_1': 1, 'acceleration_area_2': 1,
@@ -246,83 +363,127 @@ class SumoEnv:
             'passage_area_0': 4
         }
 
-        for veh_id, data in all_veh_data.items():
-            if data.get(tc.VAR_TYPE) != v_type_con:
-                continue
-
-            original_lane_id = data.get(tc.VAR_LANE_ID)
-            lane_pos = data.get(tc.VAR_LANEPOSITION)
-            
-            lane_id = self.internal_to_destination_map.get(original_lane_id, original_lane_id)
-            if original_lane_id.startswith(':'):
-                lane_pos = 0.0
-
-            # --- Get column index from our new, clear map ---
-            col_idx = column_map.get(lane_id)
-            if col_idx is None:
-                continue
-                
-            # This is the original, correct positioning logic ---
-            # --- It correctly handles using only a slice of a SUMO lane ---
-            lane_len = self.net.getLane(lane_id).getLength()
-            dist_from_grid_start = -1
-
+        # Per lane: (column, min lane pos, max lane pos (exclusive), offset from lane pos to distance from grid start).
+        # Only the slice of a SUMO lane inside the grid window is valid.
+        segments = {}
+        for lane_id, col_idx in column_map.items():
+            lane_len = self.geometry.get_lane_length(lane_id)
             if "on_ramp" in lane_id:
                 start_of_segment = lane_len - self.on_ramp_segment_len
-                if lane_pos >= start_of_segment:
-                    dist_from_grid_start = lane_pos - start_of_segment
+                segments[lane_id] = (col_idx, start_of_segment, np.inf, -start_of_segment)
             elif "passage_area" in lane_id:
-                dist_from_grid_start = self.on_ramp_segment_len + lane_pos
+                segments[lane_id] = (col_idx, -np.inf, np.inf, self.on_ramp_segment_len)
             elif "main_road" in lane_id:
                 start_of_segment = lane_len - self.main_road_segment_len
-                if lane_pos >= start_of_segment:
-                    dist_from_grid_start = lane_pos - start_of_segment
+                segments[lane_id] = (col_idx, start_of_segment, np.inf, -start_of_segment)
             elif "acceleration_area" in lane_id:
-                if lane_pos < self.accel_segment_len:
-                    if lane_id == 'acceleration_area_0':
-                         preceding_path_len = self.on_ramp_segment_len + self.passage_segment_len
-                    else:
-                         preceding_path_len = self.main_road_segment_len
-                    dist_from_grid_start = preceding_path_len + lane_pos
-            # --- END OF RESTORED LOGIC ---
-
-            if dist_from_grid_start < 0:
+                if lane_id == 'acceleration_area_0':
+                    preceding_path_len = self.on_ramp_segment_len + self.passage_segment_len
+                else:
+                    preceding_path_len = self.main_road_segment_len
+                segments[lane_id] = (col_idx, -np.inf, self.accel_segment_len, preceding_path_len)
+
+        # Vehicles on internal (junction) lanes are placed at the start of their destination lane
+        lane_ids = list(segments)
+        zero_pos = [False] * len(lane_ids)
+        for internal_lane_id, to_lane_id in self.internal_to_destination_map.items():
+            if to_lane_id in segments:
+                lane_ids.append(internal_lane_id)
+                segments[internal_lane_id] = segments[to_lane_id]
+                zero_pos.append(True)
+
+        table = np.array([segments[lane_id] for lane_id in lane_ids], dtype=np.float64)
+        self.grid_lane_index = {lane_id: i for i, lane_id in enumerate(lane_ids)}
+        self.grid_lane_col = table[:, 0].astype(np.int64)
+        self.grid_lane_pos_min = table[:, 1]
+        self.grid_lane_pos_max = table[:, 2]
+        self.grid_lane_offset = table[:, 3]
+        self.grid_lane_zero_pos = np.array(zero_pos, dtype=bool)
+
+    def _initialize_grid_context_range(self):
+        # The grid is fed by one vehicle context subscription around the merging edge. Its range covers every
+        # point of every grid lane window (sampled each meter, plus one cell of margin for the sampling and the
+        # short junction lanes), so the context returns a superset of the vehicles the lane table selects.
+        context_shapes = [self.geometry.lane_shapes[lane_id] for lane_id in self.geometry.edge_lanes[self.GRID_CONTEXT_EDGE]]
+
+        max_dist = 0.0
+        for lane_id, i in self.grid_lane_index.items():
+            if self.grid_lane_zero_pos[i]: # Internal lanes, placed at the start of their destination lane
                 continue
+            shape, lane_len = self.geometry.lane_shapes[lane_id], self.geometry.get_lane_length(lane_id)
+            window_start = max(self.grid_lane_pos_min[i], 0.0)
+            window_end = min(self.grid_lane_pos_max[i], lane_len)
+            # Lane positions are scaled onto the drawn shape, whose length may differ from the lane length
+            scale = geomhelper.polyLength(shape) / lane_len
+            for pos in np.append(np.arange(window_start, window_end, 1.0), window_end):
+                point = geomhelper.positionAtShapeOffset(shape, pos * scale)
+                max_dist = max(max_dist, min(geomhelper.distancePointToPolygon(point, context_shape) for context_shape in context_shapes))
+
+        self.grid_context_range = max_dist + self.cell_length_m
+
+    def _subscribe_grid_context(self):
+        # Context subscriptions do not survive a restart, call after every start
+        self.conn.edge.subscribeContext(self.GRID_CONTEXT_EDGE, tc.CMD_GET_VEHICLE_VARIABLE, self.grid_context_range, [
+            tc.VAR_LANE_ID, tc.VAR_LANEPOSITION, tc.VAR_SPEED, tc.VAR_TYPE
+        ])
+
+    def _create_grid_observation(self):
+        #  Initialize the grid with 5 columns ---
+        grid = np.zeros((self.grid_rows, self.grid_cols, self.grid_channels), dtype=np.float32)
+        try:
+            all_veh_data = self.conn.edge.getContextSubscriptionResults(self.GRID_CONTEXT_EDGE)
+        except TraCIException:
+            return grid
+        if not all_veh_data:
+            return grid
 
-            dist_from_grid_end = self.grid_total_length - dist_from_grid_start
-            row_idx = int(dist_from_grid_end / self.cell_length_m)
-            row_idx = min(row_idx, self.grid_rows - 1)
+        v_type_con = self.args.get("v_type_con", "con")
+        freeflow_speed = self.FREEFLOW_SPEED_MPS if self.FREEFLOW_SPEED_MPS > 0 else 35.0
 
-            if 0 <= row_idx < self.grid_rows:
-                speed = data.get(tc.VAR_SPEED, 0)
-                norm_speed = self.clip(0.0, 1.0, speed / freeflow_speed)
-                if grid[row_idx, col_idx, 1] == 0:
-                    grid[row_idx, col_idx, 0] = norm_speed
-                    grid[row_idx, col_idx, 1] = 1.0
+        # Lane table row of every connected vehicle in range (-1: other type or lane outside the grid)
+        veh_data = list(all_veh_data.values())
+        lane_idx = np.array([self.grid_lane_index.get(data[tc.VAR_LANE_ID], -1) if data[tc.VAR_TYPE] == v_type_con else -1
+                             for data in veh_data], dtype=np.int64)
+        lane_pos = np.array([data[tc.VAR_LANEPOSITION] for data in veh_data], dtype=np.float64)
+        speed = np.array([data[tc.VAR_SPEED] for data in veh_data], dtype=np.float64)
+
+        on_grid_lane = lane_idx >= 0
+        lane_idx, lane_pos, speed = lane_idx[on_grid_lane], lane_pos[on_grid_lane], speed[on_grid_lane]
+        lane_pos = np.where(self.grid_lane_zero_pos[lane_idx], 0.0, lane_pos)
+
+        dist_from_grid_start = self.grid_lane_offset[lane_idx] + lane_pos
+        in_window = (lane_pos >= self.grid_lane_pos_min[lane_idx]) & (lane_pos < self.grid_lane_pos_max[lane_idx]) & \
+                    (dist_from_grid_start >= 0)
+
+        dist_from_grid_end = self.grid_total_length - dist_from_grid_start[in_window]
+        row_idx = np.minimum(np.trunc(dist_from_grid_end / self.cell_length_m).astype(np.int64), self.grid_rows - 1)
+        col_idx = self.grid_lane_col[lane_idx[in_window]]
+        speed = speed[in_window]
+
+        on_grid = row_idx >= 0
+        cells = row_idx[on_grid] * self.grid_cols + col_idx[on_grid]
+
+        # A cell holds the fastest vehicle in it, independent of the order SUMO returns the vehicles in
+        flat_grid = grid.reshape(-1, self.grid_channels)
+        np.maximum.at(flat_grid[:, 0], cells, np.clip(speed[on_grid] / freeflow_speed, 0.0, 1.0).astype(np.float32))
+        flat_grid[cells, 1] = 1.0
         return grid
-    
- 
-        
-    def _subscribe_to_vehicles(self):
-        for veh_id in traci.simulation.getDepartedIDList():
-            traci.vehicle.subscribe(veh_id, [
-                tc.VAR_LANE_ID, tc.VAR_LANEPOSITION, tc.VAR_SPEED, tc.VAR_TYPE
-            ])
-    
+
     # --- Simulation Control Wrappers ---
     def start(self):
         try:
-            traci.start(self.params)
-            self.sim_step_length = traci.simulation.getDeltaT()
-        except traci.TraCIException as e:
+            self._start_connection()
+        except TraCIException as e:
             print(f"Error starting TraCI during explicit start(): {e}")
             sys.exit(1)
 
     def stop(self):
         try:
-            traci.close()
-        except traci.TraCIException: # SUMO might have already closed
+            if self.conn is not None:
+                self.conn.close()
+        except TraCIException + (traci.FatalTraCIError,): # SUMO might have already closed
             pass
+        self.conn = None
         sys.stdout.flush()
         
     def close(self):
@@ -332,23 +493,52 @@ class SumoEnv:
     # In SumoEnv.simulation_reset()
 
     def simulation_reset(self):
-        self.stop()
+        if self.reset_mode == "restart" or self.conn is None:
+            self.stop()
         self.ep_count += 1 
         
         if self.generate_rou == True:
-            self._generate_route_file()
+            self._select_scenario()
+            self.params = self.set_params()
+
+        if len(self.warmup_options) > 1 and self.args.get("warmup_random", True):
+            self.warmup_sec = random.choice(self.warmup_options)
         
-        self.start()
+        if self.conn is None:
+            self.start()
+        else:
+            self._reload_simulation()
+
+    def warm_state_path(self):
+        # One warmed-up state per demand scenario (content-addressed route file of the library) and warm-up horizon
+        scenario = os.path.basename(self.route_file_path).split(".rou.xml")[0] if self.route_file_path is not None else "static"
+        return self.state_dir + "warm_" + scenario + "_" + str(int(round(self.warmup_sec))) + "s.xml"
+
+    def save_warm_state(self):
+        """Saves the current (warmed-up) state for the next episodes of this demand scenario and horizon, in reset_mode "state"."""
+        if self.reset_mode != "state" or self.warm_state_loaded:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.conn.simulation.saveState(self.warm_state_path())
         
-    # Subscriptions will now be handled in simulation_step()
-    # In SumoEnv.simulation_step()
-
     def simulation_step(self):
         try:
-            traci.simulationStep()
-            # After the step, check for new vehicles and subscribe to them
-            self._subscribe_to_vehicles()
-        except traci.TraCIException as e:
+            self.conn.simulationStep()
+            self.sim_version += 1
+            self.detectors.invalidate()
+            if self.trip_stats is not None:
+                self.trip_stats.step()
+        except TraCIException as e:
+            print(f"Error during simulation step: {e}. SUMO may have closed.")
+            raise e
+
+    def simulation_step_until(self, target_time):
+        """Advances the simulation to target_time (s) in a single TraCI call. Per-step trip statistics need simulation_step()."""
+        try:
+            self.conn.simulationStep(target_time)
+            self.sim_version += 1
+            self.detectors.invalidate()
+        except TraCIException as e:
             print(f"Error during simulation step: {e}. SUMO may have closed.")
             raise e
 
@@ -374,65 +564,60 @@ class SumoEnv:
     # --- General SUMO State Getters ---
     def is_simulation_end(self):
         try:
-            return traci.simulation.getMinExpectedNumber() <= 0
-        except traci.TraCIException: # If connection is lost
+            return self.conn.simulation.getMinExpectedNumber() <= 0
+        except TraCIException: # If connection is lost
             return True 
 
     def get_current_time(self): # Returns simulation time in seconds
         try:
-            return traci.simulation.getTime()
-        except traci.TraCIException:
+            return self.conn.simulation.getTime()
+        except TraCIException:
             return -1 # Indicate error or end
 
     # --- Traffic Light Getters/Setters ---
     def get_phase(self, tl_id):
-        return traci.trafficlight.getPhase(tl_id)
+        return self.conn.trafficlight.getPhase(tl_id)
 
     def get_ryg_state(self, tl_id):
-        return traci.trafficlight.getRedYellowGreenState(tl_id)
+        return self.conn.trafficlight.getRedYellowGreenState(tl_id)
 
     def set_phase(self, tl_id, phase_index):
-        traci.trafficlight.setPhase(tl_id, phase_index)
+        self.conn.trafficlight.setPhase(tl_id, phase_index)
 
     def set_phase_duration(self, tl_id, duration_sec):
-        traci.trafficlight.setPhaseDuration(tl_id, duration_sec)
+        self.conn.trafficlight.setPhaseDuration(tl_id, duration_sec)
 
     # --- Helper Methods for Detector Data (from your previous input) ---
     def get_lanes_of_edge(self, edge_id):
-        edge_lanes = []
-        try:
-            num_lanes = traci.edge.getLaneNumber(edge_id)
-            for i in range(num_lanes):
-                edge_lanes.append(f"{edge_id}_{i}")
-        except traci.TraCIException:
+        edge_lanes = list(self.geometry.edge_lanes.get(edge_id, []))
+        if not edge_lanes:
             print(f"Warning: SumoEnv - Could not get lanes for edge {edge_id}")
         return edge_lanes
     # === Edge Information Getters === 
 # ...
     def get_edge_lane_n(self, edge_id):
-        """Gets the number of lanes on the specified edge."""
-        return traci.edge.getLaneNumber(edge_id)
+        """Gets the number of lanes on the specified edge (static, from the cached geometry)."""
+        return len(self.geometry.edge_lanes.get(edge_id, []))
 
     def get_edge_induction_loops(self, edge_id):
-        lanes = self.get_lanes_of_edge(edge_id)
-        if not lanes: return []
-        all_loops = []
-        try:
-            all_loops = traci.inductionloop.getIDList()
-        except traci.TraCIException:
-            print(f"Warning: SumoEnv - Could not get induction loop ID list.")
-            return []
-        return [loop_id for loop_id in all_loops if traci.inductionloop.getLaneID(loop_id) in lanes]
+        return self.geometry.get_edge_detectors(edge_id)
+
+    def get_role_induction_loops(self, role):
+        """Loops of a DetectorRegistry role, ordered by lane index."""
+        return self.detector_registry.role_loops(role)
 
     def get_loops_flow_interval(self, loop_ids, interval_duration_sec):
         if not loop_ids or interval_duration_sec <= 0: return 0.0
+        indices = self.detectors.indices(loop_ids)
+        if indices is not None:
+            return self.detectors.flow_interval(indices, interval_duration_sec)
         total_vehicles = 0
         valid_loops = 0
         for loop_id in loop_ids:
             try:
-                total_vehicles += traci.inductionloop.getLastIntervalVehicleNumber(loop_id)
+                total_vehicles += self.conn.inductionloop.getLastIntervalVehicleNumber(loop_id)
                 valid_loops += 1
-            except traci.TraCIException:
+            except TraCIException:
                 print(f"Warning: SumoEnv - Could not get interval vehicle number for loop {loop_id}")
         return (total_vehicles * 3600.0) / interval_duration_sec if valid_loops > 0 else 0.0
 
@@ -443,13 +628,16 @@ class SumoEnv:
 
     def get_loops_occupancy_interval(self, loop_ids): # Returns average %
         if not loop_ids: return 0.0
+        indices = self.detectors.indices(loop_ids)
+        if indices is not None:
+            return self.detectors.occupancy_interval(indices)
         total_occupancy = 0.0
         valid_loops = 0
         for loop_id in loop_ids:
             try:
-                total_occupancy += traci.inductionloop.getLastIntervalOccupancy(loop_id)
+                total_occupancy += self.conn.inductionloop.getLastIntervalOccupancy(loop_id)
                 valid_loops +=1
-            except traci.TraCIException:
+            except TraCIException:
                 print(f"Warning: SumoEnv - Could not get interval occupancy for loop {loop_id}")
         return total_occupancy / valid_loops if valid_loops > 0 else 0.0
 
@@ -460,15 +648,18 @@ class SumoEnv:
     # --- mean speed over interval from loops ---
     def get_loops_mean_speed_interval(self, loop_ids): # Returns m/s
         if not loop_ids: return 0.0
+        indices = self.detectors.indices(loop_ids)
+        if indices is not None:
+            return self.detectors.mean_speed_interval(indices)
         total_speed = 0.0
         valid_loops = 0
         for loop_id in loop_ids:
             try:
-                speed = traci.inductionloop.getLastIntervalMeanSpeed(loop_id)
+                speed = self.conn.inductionloop.getLastIntervalMeanSpeed(loop_id)
                 if speed >= 0: # getLastIntervalMeanSpeed returns -1 if no vehicle passed
                     total_speed += speed
                     valid_loops += 1
-            except traci.TraCIException:
+            except TraCIException:
                 print(f"Warning: SumoEnv - Could not get interval mean speed for loop {loop_id}")
         return total_speed / valid_loops if valid_loops > 0 else 0.0 # Return 0 if no vehicles/data
 
@@ -477,7 +668,7 @@ class SumoEnv:
         return self.get_loops_mean_speed_interval(loops)
     
     def get_edge_ls_mean_speed(self, edge_id):
-        return traci.edge.getLastStepMeanSpeed(edge_id) # Returns m/s
+        return self.conn.edge.getLastStepMeanSpeed(edge_id) # Returns m/s
     
     def get_loops_flow_weigthed_mean_speed(self, loop_ids):
         
@@ -486,16 +677,19 @@ class SumoEnv:
         Returns the average speed weighted by the number of vehicles detected.
         """
         if not loop_ids: return 0.0
+        indices = self.detectors.indices(loop_ids)
+        if indices is not None:
+            return self.detectors.flow_weighted_mean_speed(indices)
         total_speed = 0.0
         total_flow = 0.0
         for loop_id in loop_ids:
             try:
-                flow = traci.inductionloop.getLastStepVehicleNumber(loop_id)
-                speed = traci.inductionloop.getLastStepMeanSpeed(loop_id)
+                flow = self.conn.inductionloop.getLastStepVehicleNumber(loop_id)
+                speed = self.conn.inductionloop.getLastStepMeanSpeed(loop_id)
                 if flow > 0 and speed >= 0: # Only consider valid data
                     total_speed += speed * flow
                     total_flow += flow
-            except traci.TraCIException:
+            except TraCIException:
                 print(f"Warning: SumoEnv - Could not get data for loop {loop_id}")
             #in Km/h
         return ((total_speed / total_flow)) if total_flow > 0 else 0.0 #return in m/s
@@ -503,26 +697,48 @@ class SumoEnv:
     # --- Other existing helpers if needed (getLastStep versions, vehicle specific, etc.) ---
     def get_edge_ls_queue_length_vehicles(self, edge_id):
         try:
-            return traci.edge.getLastStepVehicleNumber(edge_id)
-        except traci.TraCIException:
+            if edge_id == self.ON_RAMP_EDGE:
+                # Subscribed in _on_simulation_start
+                return self.conn.edge.getSubscriptionResults(edge_id)[tc.LAST_STEP_VEHICLE_NUMBER]
+            return self.conn.edge.getLastStepVehicleNumber(edge_id)
+        except (TraCIException, KeyError):
             print(f"Warning: SumoEnv - Could not get vehicle number for edge {edge_id}")
             return 0
+
+    def get_ramp_queue_interval_start(self, sim_time=None):
+        """Start (s) of the ramp queue E2 detector's aggregation interval at sim_time (default: now)."""
+        period = self.detector_registry.lane_areas[self.ramp_queue_detector]["period"]
+        elapsed = (self.get_current_time() if sim_time is None else sim_time) - self.detector_begin_time
+        return self.detector_begin_time + (elapsed // period) * period if period > 0 else self.detector_begin_time
+
+    def get_ramp_queue_vehicle_seconds(self):
+        """
+        Vehicle-seconds accumulated on the ramp queue E2 detector since the start of its current interval, from the
+        running interval occupancy. Differences between two calls in the same interval (see
+        get_ramp_queue_interval_start) give the queue integral in between. Vehicles are counted by the share of
+        their length on the detector, so a vehicle crossing the stop line counts partially, and the occupied length is
+        converted with a single vehicle length. This is an estimate of the per-step on-ramp vehicle number sum, equal
+        to it only for whole vehicles of that length on a detector spanning the whole on-ramp lane.
+        """
+        occupancy_percent = self.conn.lanearea.getIntervalOccupancy(self.ramp_queue_detector)
+        occupied_length = occupancy_percent / 100.0 * self.ramp_queue_detector_length
+        return occupied_length / self.ramp_queue_veh_length * (self.get_current_time() - self.get_ramp_queue_interval_start())
           
     def get_detector_vehicle_count_last_step(self, detector_id): # Renamed for clarity
         """Gets vehicle number from a specific detector from the last step."""
         try: # Try as E1 induction loop first
-            return traci.inductionloop.getLastStepVehicleNumber(detector_id)
-        except traci.TraCIException:
+            return self.conn.inductionloop.getLastStepVehicleNumber(detector_id)
+        except TraCIException:
             try: # Fallback for E2 lane area detector
-                return traci.laneareadetector.getLastStepVehicleNumber(detector_id)
-            except traci.TraCIException:
+                return self.conn.laneareadetector.getLastStepVehicleNumber(detector_id)
+            except TraCIException:
                 print(f"Warning: SumoEnv - Could not get vehicles for detector {detector_id}")
                 return 0
     
     def get_veh_speed(self, veh_id): # Example of keeping a vehicle-specific getter
         try:
-            return traci.vehicle.getSpeed(veh_id)
-        except traci.TraCIException:
+            return self.conn.vehicle.getSpeed(veh_id)
+        except TraCIException:
             return 0.0 # Or handle as error
 
 
@@ -533,9 +749,9 @@ class SumoEnv:
         """
         try:
             # This gets the total number of vehicles that started teleporting.
-            teleports = traci.simulation.getStartingTeleportNumber()
+            teleports = self.conn.simulation.getStartingTeleportNumber()
             return {"total_teleported_vehicles": teleports}
-        except traci.TraCIException:
+        except TraCIException:
             return {"total_teleported_vehicles": -1} # Indicate error
 
     # ADD this new method to retrieve demand parameters for an episode
@@ -556,55 +772,28 @@ class SumoEnv:
             "con_penetration_rate": self.pen_rate,
         }
         
-    def _generate_route_file(self):
-            """
-            Generates a new .rou.xml file for the simulation with randomized
-            traffic flows based on weighted choices and a random penetration
-            rate for connected vehicles.
-            """
-            # Select total flows for each route using weighted random choice
-            main_flow = random.choices(
-                self.args["veh_per_hour_main"],
-                weights=self.args["veh_per_hour_main_weights"]
-            )[0]
-            on_ramp_flow = random.choices(
-                self.args["veh_per_hour_on_ramp"],
-                weights=self.args["veh_per_hour_on_ramp_weights"]
-            )[0]
-            off_ramp_flow = random.choices(
-                self.args["veh_per_hour_off_ramp"],
-                weights=self.args["veh_per_hour_off_ramp_weights"]
-            )[0]
-
-            # Generate a random penetration rate for connected vehicles
-            min_pen, max_pen = self.args["con_penetration_rate_range"]
-            pen_rate = random.uniform(min_pen, max_pen)
-
-            self.main_flow_vph = main_flow
-            self.on_ramp_flow_vph = on_ramp_flow
-            self.off_ramp_flow_vph = off_ramp_flow
-            self.pen_rate = pen_rate
-            
-            # Calculate the number of vehicles for each type (connected vs. default)
-            main_con = int(main_flow -1 )
-            main_def = int(1)
-            on_ramp_con = int(on_ramp_flow -1)
-            on_ramp_def = int(1)
-            off_ramp_con = int(off_ramp_flow -1)
-            off_ramp_def = int(1)
-            
-            #for training comment out the above and uncomment below:
-            # main_con = int(main_flow * pen_rate)
-            # main_def = int(main_flow * (1 - pen_rate))
-            # on_ramp_con = int(on_ramp_flow * pen_rate)
-            # on_ramp_def = int(on_ramp_flow * (1 - pen_rate))
-            # off_ramp_con = int(off_ramp_flow * pen_rate)
-            # off_ramp_def = int(off_ramp_flow * (1 - pen_rate))
-
-            # NOTE: The <route> definitions below are hardcoded from 1 ramp.
-            # For other networks (e.g., 3ramp_...), we need to make these dynamic
-            # or create separate generation functions.
-            xml_content = f"""<!-- Generated on-the-fly for episode {self.ep_count + 1} -->
+    def _route_file_content(self, main_flow, on_ramp_flow, off_ramp_flow):
+        """Route file of one demand scenario. Deterministic, so a scenario always maps to the same file."""
+        # Calculate the number of vehicles for each type (connected vs. default)
+        main_con = int(main_flow -1 )
+        main_def = int(1)
+        on_ramp_con = int(on_ramp_flow -1)
+        on_ramp_def = int(1)
+        off_ramp_con = int(off_ramp_flow -1)
+        off_ramp_def = int(1)
+        
+        #for training comment out the above and uncomment below (the penetration rate then becomes part of the scenario):
+        # main_con = int(main_flow * pen_rate)
+        # main_def = int(main_flow * (1 - pen_rate))
+        # on_ramp_con = int(on_ramp_flow * pen_rate)
+        # on_ramp_def = int(on_ramp_flow * (1 - pen_rate))
+        # off_ramp_con = int(off_ramp_flow * pen_rate)
+        # off_ramp_def = int(off_ramp_flow * (1 - pen_rate))
+
+        # NOTE: The <route> definitions below are hardcoded from 1 ramp.
+        # For other networks (e.g., 3ramp_...), we need to make these dynamic
+        # or create separate generation functions.
+        return f"""<!-- Demand scenario: Main={main_flow}, Ramp={on_ramp_flow}, OffRamp={off_ramp_flow} -->
     <routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
 
         <!-- Vehicle Type Definitions -->
@@ -625,13 +814,65 @@ class SumoEnv:
         <flow id="off_ramp_def" type="def" vehsPerHour="{off_ramp_def}" route="entry_to_off_ramp" begin="0" end="{self.args['steps']}" departLane="best" departPos="random" departSpeed="max" />
 
     </routes>
-    """ 
-            # Write the content to the .rou.xml file, overwriting the previous one
-            route_file_path = self.data_dir + self.config + ".rou.xml"
-            with open(route_file_path, "w") as f:
-                f.write(xml_content)
-            
-            print(Fore.LIGHTMAGENTA_EX, f"Generated new route file for Ep {self.ep_count + 1}: Main={main_flow}, Ramp={on_ramp_flow}, PenRate={pen_rate:.2f}", Fore.RESET)
+    """
+
+    def _build_scenario_library(self):
+        """
+        One immutable route file per (main, on-ramp, off-ramp) flow combination, named by the hash of its
+        content and stored in data_dir/scenarios/. Existing files are reused, so the library is only written
+        once per demand grid and route definition.
+        """
+        scenario_dir = self.data_dir + "scenarios/"
+        os.makedirs(scenario_dir, exist_ok=True)
+
+        self.scenarios = {} # (main, on-ramp, off-ramp) flow -> route file
+        for main_flow in self.args["veh_per_hour_main"]:
+            for on_ramp_flow in self.args["veh_per_hour_on_ramp"]:
+                for off_ramp_flow in self.args["veh_per_hour_off_ramp"]:
+                    xml_content = self._route_file_content(main_flow, on_ramp_flow, off_ramp_flow)
+                    digest = hashlib.sha1(xml_content.encode()).hexdigest()[:16]
+                    route_file_path = scenario_dir + self.config + "_" + digest + ".rou.xml"
+
+                    if not os.path.exists(route_file_path):
+                        # Temp file and rename: other processes may build the library at the same time
+                        tmp_path = route_file_path + "." + str(os.getpid()) + ".tmp"
+                        with open(tmp_path, "w") as f:
+                            f.write(xml_content)
+                        os.replace(tmp_path, route_file_path)
+
+                    self.scenarios[(main_flow, on_ramp_flow, off_ramp_flow)] = route_file_path
+
+    def _select_scenario(self):
+        """
+        Picks the demand scenario of the next episode and a random penetration rate for connected vehicles.
+        The three flows are independent weighted choices, drawn in the same order as when the route file was
+        generated per episode, so a seeded run keeps its scenario sequence.
+        """
+        # Select total flows for each route using weighted random choice
+        main_flow = random.choices(
+            self.args["veh_per_hour_main"],
+            weights=self.args["veh_per_hour_main_weights"]
+        )[0]
+        on_ramp_flow = random.choices(
+            self.args["veh_per_hour_on_ramp"],
+            weights=self.args["veh_per_hour_on_ramp_weights"]
+        )[0]
+        off_ramp_flow = random.choices(
+            self.args["veh_per_hour_off_ramp"],
+            weights=self.args["veh_per_hour_off_ramp_weights"]
+        )[0]
+        self.route_file_path = self.scenarios[(main_flow, on_ramp_flow, off_ramp_flow)]
+
+        # Generate a random penetration rate for connected vehicles
+        min_pen, max_pen = self.args["con_penetration_rate_range"]
+        pen_rate = random.uniform(min_pen, max_pen)
+
+        self.main_flow_vph = main_flow
+        self.on_ramp_flow_vph = on_ramp_flow
+        self.off_ramp_flow_vph = off_ramp_flow
+        self.pen_rate = pen_rate
+
+        print(Fore.LIGHTMAGENTA_EX, f"Selected demand scenario for Ep {self.ep_count + 1}: Main={main_flow}, Ramp={on_ramp_flow}, PenRate={pen_rate:.2f}", Fore.RESET)
 
     # --- Logging Information ---
     def log_info(self):
@@ -654,10 +895,10 @@ class SumoEnv:
         # For example, overall network stats if desired.
         try:
             if self.args.get("log_overall_metrics", True): # Example: add a param to SUMO_PARAMS
-                log_data["total_running_vehicles"] = traci.simulation.getDepartedNumber() - traci.simulation.getArrivedNumber()
-                log_data["total_departed"] = traci.simulation.getDepartedNumber()
-                log_data["total_arrived"] = traci.simulation.getArrivedNumber()
-        except traci.TraCIException:
+                log_data["total_running_vehicles"] = self.conn.simulation.getDepartedNumber() - self.conn.simulation.getArrivedNumber()
+                log_data["total_departed"] = self.conn.simulation.getDepartedNumber()
+                log_data["total_arrived"] = self.conn.simulation.getArrivedNumber()
+        except TraCIException:
             pass # Could not get overall metrics
 
         return log_data
@@ -665,8 +906,8 @@ class SumoEnv:
     # --- Vehicle Specific Getters ---
     def get_veh_type(self, veh_id):
         try:
-            return traci.vehicle.getTypeID(veh_id)
-        except traci.TraCIException:
+            return self.conn.vehicle.getTypeID(veh_id)
+        except TraCIException:
             return ""
 
     def is_veh_con(self, veh_id):
@@ -0,0 +1,127 @@
+"""Scripted stand-in for a TraCI connection, enough to drive the ramp queue and stepping code without SUMO."""
+
+import numpy as np
+from traci import constants as tc
+
+
+class FakeSimulation:
+    def __init__(self, sumo):
+        self.sumo = sumo
+
+    def getTime(self):
+        return self.sumo.time
+
+    def getDeltaT(self):
+        return self.sumo.step_length
+
+    def getMinExpectedNumber(self):
+        return 1
+
+    def getOption(self, option):
+        assert option == "begin"
+        return str(self.sumo.begin)
+
+
+class FakeEdge:
+    def __init__(self, sumo):
+        self.sumo = sumo
+
+    def getSubscriptionResults(self, edge_id):
+        return {tc.LAST_STEP_VEHICLE_NUMBER: self.sumo.last_step[0]}
+
+    def getLastStepVehicleNumber(self, edge_id):
+        return self.sumo.last_step[0]
+
+
+class FakeLaneArea:
+    def __init__(self, sumo):
+        self.sumo = sumo
+
+    def getIntervalOccupancy(self, detector_id):
+        # Mean occupancy (%) over the steps of the running interval, as the E2 detector aggregates it
+        interval_start = self.sumo.interval_start(self.sumo.time)
+        lengths = [length for start, length in self.sumo.occupied if start >= interval_start - 1e-9]
+        return 100.0 * np.mean(lengths) / self.sumo.detector_length if lengths else 0.0
+
+
+class FakeTrafficLight:
+    def __init__(self, sumo):
+        self.sumo = sumo
+
+    def setPhase(self, tl_id, phase_index):
+        self.sumo.phases.append(phase_index)
+
+    def setPhaseDuration(self, tl_id, duration_sec):
+        pass
+
+    def getPhase(self, tl_id):
+        return self.sumo.phases[-1] if self.sumo.phases else 0
+
+    def getRedYellowGreenState(self, tl_id):
+        return "G"
+
+
+class FakeSumo:
+    """
+    Every simulation step runs the script: script(step_index) -> (vehicles on the on-ramp edge, length (m) occupied
+    on the ramp queue E2 detector). The detector aggregates per interval of period seconds from begin.
+    """
+
+    def __init__(self, script, step_length=1.0, begin=0.0, period=60.0, detector_length=100.0):
+        self.script = script
+        self.step_length = step_length
+        self.begin = begin
+        self.time = begin
+        self.period = period
+        self.detector_length = detector_length
+        self.n_steps = 0
+        self.last_step = (0, 0.0)
+        self.occupied = [] # (step start time, occupied length) of every step
+        self.step_calls = [] # Target time of every simulationStep call (0: one step)
+        self.phases = []
+        self.simulation, self.edge, self.lanearea, self.trafficlight = \
+            FakeSimulation(self), FakeEdge(self), FakeLaneArea(self), FakeTrafficLight(self)
+
+    def interval_start(self, sim_time):
+        return self.begin + ((sim_time - self.begin + 1e-9) // self.period) * self.period
+
+    def simulationStep(self, target_time=0.0):
+        self.step_calls.append(target_time)
+        while True:
+            self.last_step = self.script(self.n_steps)
+            self.occupied.append((self.time, self.last_step[1]))
+            self.n_steps += 1
+            self.time = round(self.time + self.step_length, 9)
+            if target_time <= self.time + 1e-9:
+                break
+
+    def vehicle_seconds(self, start_time, end_time):
+        """Exact integral of the on-ramp vehicle number over the steps executed in [start_time, end_time)."""
+        return sum(self.script(int(round((t - self.begin) / self.step_length)))[0] * self.step_length
+                   for t, _ in self.occupied if start_time - 1e-9 <= t < end_time - 1e-9)
+
+
+class NoDetectors:
+    def invalidate(self):
+        pass
+
+
+def attach(env, sumo, step_mode="step", detector=True, **args):
+    """Wires env (built with __new__, no SUMO started) to sumo with the attributes the stepping code reads."""
+    from env.custom_env.detector_registry import DetectorRegistry
+
+    env.args = {"ramp_queue_veh_length": 5.0, "steps": 3600, **args}
+    env.conn = sumo
+    env.ON_RAMP_EDGE = "on_ramp"
+    env.sim_step_length = sumo.step_length
+    env.sim_version = 0
+    env.detectors = NoDetectors()
+    env.trip_stats = None
+    env.step_mode = step_mode
+    env.detector_begin_time = sumo.begin
+    env.ramp_queue_veh_length = env.args["ramp_queue_veh_length"]
+    env.detector_registry = DetectorRegistry({}, {"ramp_queue_e2": {"lane": "on_ramp_0", "edge": "on_ramp", "lane_index": 0,
+                                                                   "pos": 0.0, "length": sumo.detector_length, "period": sumo.period}})
+    env.ramp_queue_detector = "ramp_queue_e2" if detector else None
+    env.ramp_queue_detector_length = sumo.detector_length
+    return env
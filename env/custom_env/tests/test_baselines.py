@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("traci")
+
+from env.custom_env.baselines import BaselineMeta
+from env.custom_env.tests.fake_sumo import FakeSumo, attach
+
+
+def queue_script(step):
+    # Short spillback peaks (25 vehicles for 3 s) inside an otherwise short queue
+    return (25 if step % 20 < 3 else 4), 0.0
+
+
+def make_baseline(sumo, **kwargs):
+    baseline = attach(BaselineMeta.__new__(BaselineMeta), sumo, **kwargs)
+    baseline.spillback_threshold_veh = 20
+    baseline._start_interval()
+    return baseline
+
+
+@pytest.mark.parametrize("detector", [True, False])
+def test_step_mode_counts_every_step(detector):
+    sumo = FakeSumo(queue_script)
+    baseline = make_baseline(sumo, detector=detector)
+
+    baseline._advance(40.0)
+
+    # Exact edge count per step, like RLController in step_mode "step", whether or not the E2 detector exists
+    assert sumo.step_calls == [0.0] * 40
+    assert baseline.ramp_queue_veh_sec == sumo.vehicle_seconds(0.0, 40.0)
+    assert baseline.ramp_queue_sec == 40.0
+    # The interval mean (8.2 vehicles) never spills back, the 3 s peaks do
+    assert baseline.ramp_queue_veh_sec / baseline.ramp_queue_sec < 20
+    assert baseline.ramp_spillback_sec == 6.0
+
+
+def test_phase_mode_uses_the_e2_detector():
+    sumo = FakeSumo(lambda step: (3, 15.0)) # Three whole 5 m vehicles on the detector
+    baseline = make_baseline(sumo, step_mode="phase")
+
+    baseline._advance(40.0)
+
+    assert sumo.step_calls == [40.0]
+    assert baseline.ramp_queue_veh_sec == pytest.approx(120.0)
+    assert baseline.ramp_spillback_sec == 0.0
+
+
+def test_phase_mode_steps_through_an_interval_boundary():
+    sumo = FakeSumo(queue_script, period=30.0)
+    baseline = make_baseline(sumo, step_mode="phase")
+
+    baseline._advance(40.0)
+
+    assert sumo.step_calls == [0.0] * 40
+    assert baseline.ramp_spillback_sec == 6.0
+
+
+def test_spillback_time_from_the_logged_counter(tmp_path):
+    pytest.importorskip("pandas")
+    from evaluation.parsers import parse_framework_log
+
+    path = tmp_path / "framework.csv"
+    path.write_text("sim_time,ramp_queue_veh,ramp_spillback_sec\n40,8.2,6\n80,21,38\n120,3,0\n")
+
+    stats = parse_framework_log(str(path), spillback_threshold=20)
+
+    assert stats["total_spillback_time_sec"] == 44
+    assert stats["avg_ramp_queue_veh"] == pytest.approx(32.2 / 3)
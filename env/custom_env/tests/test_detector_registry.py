@@ -0,0 +1,62 @@
+import pytest
+
+from env.custom_env.detector_registry import DetectorRegistry
+
+
+ADDITIONAL = """<additional>
+    <inductionLoop id="up_stream_sens_1" lane="main_road_1" pos="100" period="60" file="out.xml"/>
+    <inductionLoop id="up_stream_sens_0" lane="main_road_0" pos="100" freq="60" file="out.xml"/>
+    <inductionLoop id="up_stream_sens_01" lane="main_road_0" pos="50" period="60" file="out.xml"/>
+    <inductionLoop id="bottle_neck_sens_2" lane="acceleration_area_1" pos="-10" period="60" file="out.xml"/>
+    <inductionLoop id="bottle_neck_sens_1" lane="acceleration_area_1" pos="20" period="60" file="out.xml"/>
+    <inductionLoop id="queue_sens" lane="on_ramp_0" pos="5" period="60" file="out.xml"/>
+    <inductionLoop id="custom_loop" lane="unknown_0" pos="1" period="60" file="out.xml"/>
+    <laneAreaDetector id="e2_queue" lane="on_ramp_0" pos="50" endPos="-20" period="30" file="out.xml"/>
+    <laneAreaDetector id="e2_len" lane="main_road_1" pos="-100" length="40" freq="30" file="out.xml"/>
+    <laneAreaDetector id="e2_multi" lanes="main_road_0 main_road_1" pos="0" endPos="10" period="30" file="out.xml"/>
+</additional>
+"""
+LANE_LENGTHS = {"main_road_0": 400.0, "main_road_1": 400.0, "acceleration_area_0": 300.0, "acceleration_area_1": 300.0,
+                "on_ramp_0": 250.0}
+EDGE_LANES = {"main_road": ["main_road_0", "main_road_1"], "acceleration_area": ["acceleration_area_0", "acceleration_area_1"],
+              "on_ramp": ["on_ramp_0"]}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / "test.add.xml"
+    path.write_text(ADDITIONAL)
+    return DetectorRegistry.parse(str(path), LANE_LENGTHS, EDGE_LANES)
+
+
+def test_loops_are_mapped_to_their_lane(registry):
+    assert registry.loops["up_stream_sens_1"] == {"lane": "main_road_1", "edge": "main_road", "lane_index": 1, "pos": 100.0,
+                                                  "period": 60.0, "role": "upstream"}
+    assert registry.loops["up_stream_sens_0"]["period"] == 60.0 # Legacy freq attribute
+    assert registry.loops["bottle_neck_sens_2"]["pos"] == 290.0 # Negative positions count from the lane end
+    assert registry.loops["custom_loop"]["edge"] is None and registry.loops["custom_loop"]["lane_index"] == -1
+
+
+def test_roles(registry):
+    assert DetectorRegistry.get_role("up_stream_sens_01") == "upstream_secondary"
+    assert DetectorRegistry.get_role("custom_loop") is None
+    assert registry.role_loops("upstream") == ["up_stream_sens_0", "up_stream_sens_1"]
+    # Same lane: ordered by position
+    assert registry.role_loops("bottleneck") == ["bottle_neck_sens_1", "bottle_neck_sens_2"]
+    assert registry.role_loops("ramp_queue") == ["queue_sens"]
+    assert registry.role_loops("outflow") == []
+
+
+def test_edge_loops_are_sorted_like_traci(registry):
+    assert registry.edge_loops("main_road") == ["up_stream_sens_0", "up_stream_sens_01", "up_stream_sens_1"]
+    assert registry.edge_loops("off_ramp") == []
+    assert registry.loop_ids() == sorted(registry.loops)
+
+
+def test_lane_areas(registry):
+    assert registry.lane_areas["e2_queue"] == {"lane": "on_ramp_0", "edge": "on_ramp", "lane_index": 0, "pos": 50.0,
+                                               "length": 180.0, "period": 30.0}
+    assert registry.lane_areas["e2_len"]["pos"] == 300.0 and registry.lane_areas["e2_len"]["length"] == 40.0
+    assert "e2_multi" not in registry.lane_areas
+    assert registry.lane_index("e2_len") == 1
+    assert registry.lane_index("up_stream_sens_1") == 1
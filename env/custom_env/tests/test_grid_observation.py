@@ -0,0 +1,151 @@
+import numpy as np
+import pytest
+
+tc = pytest.importorskip("traci.constants")
+pytest.importorskip("sumolib")
+
+from env.custom_env.sumo_env import SumoEnv
+
+
+class FakeGeometry:
+    """Straight test network: 3 mainline lanes and the on-ramp (on_ramp, passage_area) merging into acceleration_area."""
+
+    def __init__(self):
+        self.lane_shapes = {}
+        self.lane_lengths = {}
+        self.edge_lanes = {}
+        for edge_id, lanes in {
+            "main_road": [((-400.0, y), (0.0, y)) for y in (0.0, 3.2, 6.4)],
+            "on_ramp": [((-400.0, -20.0), (-100.0, -20.0))],
+            "passage_area": [((-100.0, -20.0), (0.0, -3.2))],
+            "acceleration_area": [((0.0, y), (300.0, y)) for y in (-3.2, 0.0, 3.2, 6.4)],
+        }.items():
+            self.edge_lanes[edge_id] = []
+            for i, shape in enumerate(lanes):
+                lane_id = edge_id + "_" + str(i)
+                self.edge_lanes[edge_id].append(lane_id)
+                self.lane_shapes[lane_id] = list(shape)
+                self.lane_lengths[lane_id] = float(np.hypot(*np.subtract(shape[1], shape[0])))
+        self.internal_to_destination_map = {":merge_0_0": "acceleration_area_1", ":ramp_0_0": "passage_area_0"}
+
+    def get_lane_length(self, lane_id):
+        return self.lane_lengths[lane_id]
+
+
+# Connected and default vehicles on every grid lane: in and out of the windows, on junction lanes and sharing cells
+SNAPSHOT = {
+    "m0": ("main_road_0", 390.0, 25.0, "con"), "m1": ("main_road_0", 391.0, 20.0, "con"), # Same cell
+    "m2": ("main_road_1", 300.0, 22.0, "con"), "m3": ("main_road_2", 100.0, 30.0, "con"), # Before the window
+    "m4": ("main_road_2", 268.0, 26.0, "con"), "m5": ("main_road_1", 350.0, 10.0, "def"),
+    "r0": ("on_ramp_0", 290.0, 12.0, "con"), "r1": ("on_ramp_0", 200.0, 15.0, "con"), # Before the window
+    "p0": ("passage_area_0", 50.0, 14.0, "con"), "p1": ("passage_area_0", 52.0, 18.0, "con"), # Same cell
+    "a0": ("acceleration_area_0", 10.0, 16.0, "con"), "a1": ("acceleration_area_3", 83.0, 27.0, "con"),
+    "a2": ("acceleration_area_2", 90.0, 27.0, "con"), # After the window
+    "a3": ("acceleration_area_1", 2.0, 29.0, "con"), "j0": (":merge_0_0", 5.0, 33.0, "con"), # Same cell
+    "j1": (":ramp_0_0", 3.0, 11.0, "con"), "x0": ("off_ramp_0", 20.0, 20.0, "con"), # Not a grid lane
+}
+
+
+class FakeEdge:
+    def __init__(self, results):
+        self.results = results
+
+    def getContextSubscriptionResults(self, edge_id):
+        return self.results
+
+
+class FakeConnection:
+    def __init__(self, snapshot):
+        self.edge = FakeEdge({veh_id: {tc.VAR_LANE_ID: lane_id, tc.VAR_LANEPOSITION: pos, tc.VAR_SPEED: speed, tc.VAR_TYPE: v_type}
+                              for veh_id, (lane_id, pos, speed, v_type) in snapshot.items()})
+
+
+def make_env():
+    env = SumoEnv.__new__(SumoEnv)
+    env.args = {"cell_length": 8.0, "v_type_con": "con"}
+    env.FREEFLOW_SPEED_MPS = 30.0
+    env.geometry = FakeGeometry()
+    env._initialize_grid_params_from_net()
+    return env
+
+
+def reference_grid(env, snapshot):
+    """The former per-vehicle builder, with the fastest vehicle kept in a shared cell."""
+    grid = np.zeros((env.grid_rows, env.grid_cols, env.grid_channels), dtype=np.float32)
+    column_map = {
+        'main_road_2': 0, 'acceleration_area_3': 0,
+        'main_road_1': 1, 'acceleration_area_2': 1,
+        'main_road_0': 2, 'acceleration_area_1': 2,
+        'acceleration_area_0': 3,
+        'on_ramp_0': 4,
+        'passage_area_0': 4
+    }
+    for original_lane_id, lane_pos, speed, v_type in snapshot.values():
+        if v_type != "con":
+            continue
+        lane_id = env.internal_to_destination_map.get(original_lane_id, original_lane_id)
+        if original_lane_id.startswith(':'):
+            lane_pos = 0.0
+        col_idx = column_map.get(lane_id)
+        if col_idx is None:
+            continue
+
+        lane_len = env.geometry.get_lane_length(lane_id)
+        dist_from_grid_start = -1
+        if "on_ramp" in lane_id:
+            start_of_segment = lane_len - env.on_ramp_segment_len
+            if lane_pos >= start_of_segment:
+                dist_from_grid_start = lane_pos - start_of_segment
+        elif "passage_area" in lane_id:
+            dist_from_grid_start = env.on_ramp_segment_len + lane_pos
+        elif "main_road" in lane_id:
+            start_of_segment = lane_len - env.main_road_segment_len
+            if lane_pos >= start_of_segment:
+                dist_from_grid_start = lane_pos - start_of_segment
+        elif "acceleration_area" in lane_id:
+            if lane_pos < env.accel_segment_len:
+                if lane_id == 'acceleration_area_0':
+                    preceding_path_len = env.on_ramp_segment_len + env.passage_segment_len
+                else:
+                    preceding_path_len = env.main_road_segment_len
+                dist_from_grid_start = preceding_path_len + lane_pos
+        if dist_from_grid_start < 0:
+            continue
+
+        dist_from_grid_end = env.grid_total_length - dist_from_grid_start
+        row_idx = min(int(dist_from_grid_end / env.cell_length_m), env.grid_rows - 1)
+        if 0 <= row_idx < env.grid_rows:
+            norm_speed = min(max(speed / env.FREEFLOW_SPEED_MPS, 0.0), 1.0)
+            grid[row_idx, col_idx, 0] = max(grid[row_idx, col_idx, 0], norm_speed)
+            grid[row_idx, col_idx, 1] = 1.0
+    return grid
+
+
+def test_grid_matches_per_vehicle_builder():
+    env = make_env()
+    env.conn = FakeConnection(SNAPSHOT)
+
+    grid = env._create_grid_observation()
+
+    np.testing.assert_allclose(grid, reference_grid(env, SNAPSHOT), rtol=1e-6)
+    assert grid[..., 1].sum() == 9
+
+
+def test_grid_does_not_depend_on_vehicle_order():
+    env = make_env()
+    rng = np.random.default_rng(0)
+    grids = []
+    for _ in range(10):
+        env.conn = FakeConnection({veh_id: SNAPSHOT[veh_id] for veh_id in rng.permutation(list(SNAPSHOT))})
+        grids.append(env._create_grid_observation())
+
+    for grid in grids[1:]:
+        np.testing.assert_array_equal(grid, grids[0])
+
+
+def test_context_range_covers_grid_windows():
+    env = make_env()
+
+    # Farthest window point from acceleration_area: the start of the on-ramp window, 132 m upstream and 20 m aside
+    assert env.grid_context_range >= np.hypot(132.0, 20.0 - 3.2)
+    assert env.grid_context_range >= env.main_road_segment_len
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from env.custom_env.net_geometry import NetGeometry
+from env.custom_env.detector_registry import DetectorRegistry
+
+
+@pytest.fixture
+def files(tmp_path):
+    net_path, add_path = tmp_path / "test.net.xml", tmp_path / "test.add.xml"
+    net_path.write_text("<net/>")
+    add_path.write_text("<additional/>")
+    return str(net_path), str(add_path), str(tmp_path / "cache")
+
+
+@pytest.fixture
+def parse_calls(monkeypatch):
+    calls = []
+
+    def parse(net_path, add_path):
+        calls.append(net_path)
+        return NetGeometry({"l_0": 10.0}, {"l_0": [(0., 0.), (10., 0.)]}, {"l": ["l_0"]}, {}, ["tl"], DetectorRegistry({}, {}))
+
+    monkeypatch.setattr(NetGeometry, "parse", staticmethod(parse))
+    return calls
+
+
+def test_second_load_reads_the_cache(files, parse_calls):
+    first = NetGeometry.load(*files, "test")
+    second = NetGeometry.load(*files, "test")
+
+    assert len(parse_calls) == 1
+    assert second.lane_lengths == first.lane_lengths and second.tl_ids == ["tl"]
+    assert [name for name in os.listdir(files[2]) if name.endswith(".tmp")] == []
+
+
+@pytest.mark.parametrize("changed", [0, 1])
+def test_changed_input_file_invalidates_the_cache(files, parse_calls, changed):
+    NetGeometry.load(*files, "test")
+    with open(files[changed], "a") as f:
+        f.write("<!-- edited -->")
+
+    NetGeometry.load(*files, "test")
+
+    assert len(parse_calls) == 2
+    assert len(os.listdir(files[2])) == 2
+
+
+def test_version_is_part_of_the_key(files, parse_calls, monkeypatch):
+    key = NetGeometry.file_hash(files[0], files[1])
+    monkeypatch.setattr(NetGeometry, "VERSION", NetGeometry.VERSION + 1)
+
+    assert NetGeometry.file_hash(files[0], files[1]) != key
+
+
+def test_truncated_cache_is_rebuilt(files, parse_calls):
+    NetGeometry.load(*files, "test")
+    cache_path = os.path.join(files[2], os.listdir(files[2])[0])
+    open(cache_path, "wb").close()
+
+    geometry = NetGeometry.load(*files, "test")
+
+    assert len(parse_calls) == 2
+    assert geometry.get_lane_length("l_0") == 10.0
@@ -0,0 +1,100 @@
+import pytest
+
+pytest.importorskip("traci")
+
+from env.custom_env.rl_controller import RLController
+from env.custom_env.tests.fake_sumo import FakeSumo, attach
+
+
+def whole_vehicles(step):
+    # 0 to 6 queued 5 m vehicles, all of them on the detector
+    n = (step * 7 // 3) % 7
+    return n, n * 5.0
+
+
+def make_controller(sumo, step_mode="phase", warmup_sec=0.0, **kwargs):
+    controller = attach(RLController.__new__(RLController), sumo, step_mode=step_mode, **kwargs)
+    controller.ramp_meter_id = "ramp_meter"
+    controller.sum_queue = 0.0
+    if warmup_sec:
+        sumo.simulationStep(sumo.time + warmup_sec)
+        sumo.step_calls.clear()
+    return controller
+
+
+@pytest.mark.parametrize("step_length", [1.0, 0.5])
+def test_phase_matches_step_mode_for_whole_vehicles(step_length):
+    step_sumo, phase_sumo = FakeSumo(whole_vehicles, step_length), FakeSumo(whole_vehicles, step_length)
+    stepped, phased = make_controller(step_sumo, step_mode="step"), make_controller(phase_sumo)
+
+    for controller in (stepped, phased):
+        controller._run_phase(0, 15.0)
+        controller._run_phase(1, 25.0)
+
+    # sum_queue is in vehicle-steps in both modes
+    assert stepped.sum_queue == step_sumo.vehicle_seconds(0.0, 40.0) / step_length
+    assert phased.sum_queue == pytest.approx(stepped.sum_queue)
+    assert phase_sumo.step_calls == [15.0, 40.0]
+    assert step_sumo.step_calls == [0.0] * int(40 / step_length)
+
+
+def test_phase_mode_is_an_estimate_for_partial_vehicles():
+    # Three vehicles on the on-ramp edge, the last one half on the detector: the E2 estimate sees 2.5
+    step_sumo, phase_sumo = FakeSumo(lambda step: (3, 12.5)), FakeSumo(lambda step: (3, 12.5))
+    stepped, phased = make_controller(step_sumo, step_mode="step"), make_controller(phase_sumo)
+
+    stepped._run_phase(0, 20.0)
+    phased._run_phase(0, 20.0)
+
+    assert stepped.sum_queue == 60
+    assert phased.sum_queue == pytest.approx(50.0)
+
+
+def test_vehicle_length_scales_the_estimate():
+    sumo = FakeSumo(lambda step: (2, 15.0)) # Two 7.5 m vehicles
+    controller = make_controller(sumo, ramp_queue_veh_length=7.5)
+
+    controller._run_phase(0, 10.0)
+
+    assert controller.sum_queue == pytest.approx(20.0)
+
+
+def test_phase_crossing_an_interval_boundary_is_stepped():
+    sumo = FakeSumo(whole_vehicles, period=30.0)
+    controller = make_controller(sumo, warmup_sec=20.0)
+
+    controller._run_phase(1, 20.0) # 20 s to 40 s, the detector interval restarts at 30 s
+
+    assert sumo.step_calls == [0.0] * 20
+    assert controller.sum_queue == sumo.vehicle_seconds(20.0, 40.0)
+
+
+def test_phase_ending_on_an_interval_boundary_is_stepped():
+    sumo = FakeSumo(whole_vehicles, period=30.0)
+    controller = make_controller(sumo, warmup_sec=10.0)
+
+    controller._run_phase(1, 20.0) # The interval is closed, and its occupancy reset, at exactly 30 s
+
+    assert sumo.step_calls == [0.0] * 20
+    assert controller.sum_queue == sumo.vehicle_seconds(10.0, 30.0)
+
+
+def test_intervals_are_anchored_on_the_loaded_begin_time():
+    # After --load-state at 1000 s, intervals run 1000-1060, 1060-1120, ...: a phase from 1030 s to 1050 s is one call
+    sumo = FakeSumo(whole_vehicles, begin=1000.0)
+    controller = make_controller(sumo, warmup_sec=30.0)
+
+    controller._run_phase(0, 20.0)
+
+    assert sumo.step_calls == [1050.0]
+    assert controller.sum_queue == pytest.approx(sumo.vehicle_seconds(1030.0, 1050.0))
+
+
+def test_without_detector_phase_mode_steps():
+    sumo = FakeSumo(whole_vehicles)
+    controller = make_controller(sumo, detector=False)
+
+    controller._run_phase(0, 5.0)
+
+    assert sumo.step_calls == [0.0] * 5
+    assert controller.sum_queue == sumo.vehicle_seconds(0.0, 5.0)
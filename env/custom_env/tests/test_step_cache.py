@@ -0,0 +1,81 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+pytest.importorskip("traci")
+
+from env.custom_env.rl_controller import RLController
+from env.custom_env.tests.fake_sumo import FakeSumo, attach
+
+REWARD_COMPONENTS = (
+    "_reward_merging_speed", "_reward_upstream_speed", "_reward_outflow_speed", "_reward_throughput",
+    "_penalty_bottleneck_occ", "_penalty_upstream_occ", "_penalty_ramp_queue", "_penalty_spillback",
+)
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = attach(RLController.__new__(RLController), FakeSumo(lambda step: (2, 10.0)))
+    controller.log = False
+    controller.ramp_meter_id = "ramp_meter"
+    controller.green_phase_index, controller.red_phase_index = 0, 1
+    controller.CYCLE_DURATION_SEC = 40.0
+    controller.green_time_actions_sec = np.array(RLController.GREEN_TIME_ACTIONS_SEC)
+    controller.action_space_n = len(controller.green_time_actions_sec)
+    controller.upstream_detector_ids_state = ["up_0", "up_1"]
+    controller.bottleneck_detector_ids_state = ["bn_0"]
+    controller.outflow_detector_ids_reward = ["down_0"]
+    controller._step_cache_version = None
+    controller._info_builder = None
+
+    monkeypatch.setattr(controller, "get_loops_flow_interval", lambda loop_ids, duration_sec: 1200.0)
+    monkeypatch.setattr(controller, "get_loops_occupancy_interval", lambda loop_ids: 10.0)
+    monkeypatch.setattr(controller, "get_loops_flow_weigthed_mean_speed", lambda loop_ids: 20.0)
+
+    controller.calls = Counter()
+    def counted(name, compute):
+        def wrapper():
+            controller.calls[name] += 1
+            return compute()
+        monkeypatch.setattr(controller, name, wrapper)
+
+    counted("_compute_observation", lambda: np.zeros(RLController.MACRO_STATE_SIZE, dtype=np.float32))
+    counted("_compute_reward", controller._compute_reward)
+    for name in REWARD_COMPONENTS:
+        counted(name, lambda: 0.5)
+    return controller
+
+
+def test_each_cycle_computes_observation_and_reward_once(controller):
+    observation, reward, done, _ = controller.step(0)
+
+    assert controller.obs() is observation
+    assert controller.rew() == reward
+    assert controller.done() == done
+    assert controller._reward_components() is controller._reward_components()
+    assert controller.calls == Counter({name: 1 for name in ("_compute_observation", "_compute_reward") + REWARD_COMPONENTS})
+
+
+def test_next_cycle_recomputes(controller):
+    controller.step(0)
+    controller.obs(), controller.rew()
+
+    controller.step(3)
+    controller.obs(), controller.rew(), controller.done()
+
+    assert controller.calls == Counter({name: 2 for name in ("_compute_observation", "_compute_reward") + REWARD_COMPONENTS})
+
+
+def test_cycle_end_drops_the_cache_without_a_simulation_step(controller):
+    controller.step(0)
+    version = controller.sim_version
+
+    # No phase is run when the ramp meter is missing: the simulation does not advance, but the cycle data is new
+    controller.ramp_meter_id = None
+    controller.step(0)
+    controller.obs(), controller.rew()
+
+    assert controller.sim_version == version
+    assert controller.calls["_compute_observation"] == 2
+    assert controller.calls["_compute_reward"] == 2
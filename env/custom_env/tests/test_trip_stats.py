@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+tc = pytest.importorskip("traci.constants")
+pytest.importorskip("pandas")
+
+from env.custom_env.trip_stats import TripStatsCollector
+from evaluation.parsers import parse_tripinfo_for_episode_stats
+
+
+STEP = 1.0
+
+# veh_id: (depart step, route, moves). A move is (time loss, speed, CO2, fuel, NOx rates, route index after it).
+# Every trip ends with two equal moves: the arrival move is the one the collector cannot see.
+ROUTES = {"r_main": 3, "r_ramp": 2, "r_off": 2}
+TRIPS = {
+    "main_flow.0": (0, "r_main", [(0.2, 20., 900., 300., 4., 0), (0.1, 25., 800., 280., 3., 1), (0.1, 25., 800., 280., 3., 2),
+                                  (0.1, 25., 800., 280., 3., 2)]),
+    "main_flow.1": (2, "r_main", [(0.5, 10., 1200., 400., 6., 0), (1.0, 0.05, 500., 150., 1., 0), (1.0, 0.0, 500., 150., 1., 1),
+                                  (0.3, 15., 900., 300., 4., 2), (0.3, 15., 900., 300., 4., 2)]),
+    "on_ramp_flow.0": (1, "r_ramp", [(1.0, 0.0, 400., 120., 1., 0), (1.0, 0.08, 400., 120., 1., 0), (0.6, 8., 1500., 500., 7., 1),
+                                     (0.6, 8., 1500., 500., 7., 1)]),
+    "off_ramp_flow.0": (3, "r_off", [(0.0, 28., 700., 240., 2., 0), (0.0, 28., 700., 240., 2., 1), (0.0, 28., 700., 240., 2., 1)]),
+    # Removed on its first edge (e.g. a collision): vaporized
+    "main_flow.2": (4, "r_main", [(0.4, 12., 1000., 350., 5., 0), (0.4, 12., 1000., 350., 5., 0)]),
+}
+INSERTION = (0.0, 15., 99999., 99999., 99999., 0) # Sample before the first move, must not be integrated
+
+
+class FakeSimulation:
+    def __init__(self, sumo):
+        self.sumo = sumo
+
+    def getTime(self):
+        return self.sumo.time
+
+    def getDepartedIDList(self):
+        return list(self.sumo.departed)
+
+    def getArrivedIDList(self):
+        return list(self.sumo.arrived)
+
+
+class FakeVehicle:
+    def __init__(self, sumo):
+        self.sumo = sumo
+
+    def getIDList(self):
+        return list(self.sumo.running)
+
+    def subscribe(self, veh_id, variables):
+        self.sumo.subscribed.add(veh_id)
+
+    def getAllSubscriptionResults(self):
+        return {veh_id: self.sumo.values(veh_id) for veh_id in self.sumo.running if veh_id in self.sumo.subscribed}
+
+
+class FakeRoute:
+    def getEdges(self, route_id):
+        return ["e" + str(i) for i in range(ROUTES[route_id])]
+
+
+class FakeSumo:
+    """Moves every vehicle one step per simulationStep, arrives it with its last move, then inserts the departures."""
+
+    def __init__(self):
+        self.time = 0.0
+        self.running = {} # veh_id -> moves done
+        self.subscribed = set()
+        self.departed, self.arrived = [], []
+        self.simulation, self.vehicle, self.route = FakeSimulation(self), FakeVehicle(self), FakeRoute()
+
+    def simulationStep(self):
+        step = int(round(self.time / STEP))
+        self.arrived = []
+        for veh_id in list(self.running):
+            self.running[veh_id] += 1
+            if self.running[veh_id] == len(TRIPS[veh_id][2]):
+                del self.running[veh_id]
+                self.arrived.append(veh_id)
+        self.departed = [veh_id for veh_id, (depart, _, _) in TRIPS.items() if depart == step]
+        self.running.update({veh_id: 0 for veh_id in self.departed})
+        self.time += STEP
+
+    def values(self, veh_id):
+        depart, route_id, moves = TRIPS[veh_id]
+        n = self.running[veh_id]
+        time_loss, speed, co2, fuel, nox, route_index = moves[n - 1] if n > 0 else INSERTION
+        return {
+            tc.VAR_DEPARTURE: depart * STEP, tc.VAR_TIMELOSS: sum(move[0] for move in moves[:n]), tc.VAR_SPEED: speed,
+            tc.VAR_ROUTE_ID: route_id, tc.VAR_ROUTE_INDEX: route_index,
+            tc.VAR_CO2EMISSION: co2, tc.VAR_FUELCONSUMPTION: fuel, tc.VAR_NOXEMISSION: nox,
+        }
+
+
+def write_tripinfo(path):
+    """tripinfo.xml as SUMO writes it for TRIPS: every value summed over all moves, arrival move included."""
+    lines = ['<tripinfos>']
+    for veh_id, (depart, route_id, moves) in TRIPS.items():
+        moves = np.array([move[:5] for move in moves])
+        vaporized = "collision" if TRIPS[veh_id][2][-1][5] < ROUTES[route_id] - 1 else ""
+        lines.append(
+            f'    <tripinfo id="{veh_id}" depart="{depart * STEP:.2f}" arrival="{(depart + len(moves)) * STEP:.2f}" '
+            f'duration="{len(moves) * STEP:.2f}" waitingTime="{(moves[:, 1] <= 0.1).sum() * STEP:.2f}" '
+            f'timeLoss="{moves[:, 0].sum():.6f}" vaporized="{vaporized}">\n'
+            f'        <emissions CO2_abs="{moves[:, 2].sum() * STEP:.6f}" fuel_abs="{moves[:, 3].sum() * STEP:.6f}" '
+            f'NOx_abs="{moves[:, 4].sum() * STEP:.6f}"/>\n'
+            f'    </tripinfo>'
+        )
+    lines.append('</tripinfos>')
+    with open(path, 'w') as f:
+        f.write("\n".join(lines))
+
+
+def run_collector():
+    sumo = FakeSumo()
+    collector = TripStatsCollector()
+    collector.start(sumo, STEP)
+    while len(collector.trips) < len(TRIPS):
+        sumo.simulationStep()
+        collector.step()
+    return collector
+
+
+def test_live_stats_match_tripinfo_parser(tmp_path):
+    path = str(tmp_path / "tripinfo.xml")
+    write_tripinfo(path)
+
+    parsed = parse_tripinfo_for_episode_stats(path)
+    live = run_collector().aggregate()
+
+    assert live.keys() == parsed.keys()
+    for key, value in parsed.items():
+        assert live[key] == pytest.approx(value, rel=1e-6, nan_ok=True), key
+
+
+def test_vaporized_trips_are_counted():
+    live = run_collector().aggregate()
+
+    assert live['num_teleported_tripinfo'] == 1
+    assert live['total_throughput'] == len(TRIPS)
+
+
+def test_durations_count_moves():
+    durations = sorted(trip[1] for trip in run_collector().trips)
+
+    assert durations == sorted(len(moves) * STEP for _, _, moves in TRIPS.values())
@@ -0,0 +1,171 @@
+# env/custom_env/trip_stats.py
+
+from traci import constants as tc
+import numpy as np
+
+
+class TripStatsCollector:
+    """
+    Live replacement for parsing tripinfo.xml after an episode.
+
+    Departing vehicles are subscribed to their time loss, speed, route position and emission rates, and a trip
+    is closed when its vehicle arrives, so the per-episode aggregates are available as soon as the simulation
+    stops, without any tripinfo file I/O. aggregate() returns the same keys, with the same meaning, as
+    evaluation.parsers.parse_tripinfo_for_episode_stats.
+
+    Step timing: a vehicle inserted in the step starting at t has depart t and is first seen after that step,
+    before it has moved. It moves in every later step and arrives during the step starting at arrival, so
+    duration = arrival - depart counts its moves, and tripinfo sums time loss, waiting time and emissions over
+    those moves. The subscription results after a move give that move's values; the arrival move itself is
+    never seen (the vehicle is gone), so it is taken equal to the vehicle's previous move. That is the only
+    approximation left.
+
+    num_teleported_tripinfo counts vaporized trips (tripinfo's non-empty "vaporized" attribute): vehicles
+    removed before the last edge of their route.
+    """
+
+    VARIABLES = (
+        tc.VAR_DEPARTURE,
+        tc.VAR_TIMELOSS,
+        tc.VAR_SPEED,
+        tc.VAR_ROUTE_ID,
+        tc.VAR_ROUTE_INDEX,
+        tc.VAR_CO2EMISSION,
+        tc.VAR_FUELCONSUMPTION,
+        tc.VAR_NOXEMISSION,
+    )
+
+    # Speed (m/s) at or below which tripinfo counts waiting time
+    WAITING_SPEED = 0.1
+
+    ROUTE_TYPES = ['Mainline', 'On-Ramp', 'Off-Ramp']
+
+    # Trip fields: totals over the seen moves, then the values of the last seen move
+    DEPART, TIME_LOSS, WAITING, CO2, FUEL, NOX, MOVES, ROUTE_ID, ROUTE_INDEX, \
+        LAST_TIME_LOSS, LAST_WAITING, LAST_CO2, LAST_FUEL, LAST_NOX = range(14)
+
+    def __init__(self):
+        self.conn = None
+        self.step_length = 1.0
+        self.active = {}
+        self.route_lengths = {}
+        self.trips = []
+
+    @staticmethod
+    def get_route_type(veh_id):
+        # Same categorization as evaluation.parsers.get_route_type (route file id prefixes)
+        if 'main' in veh_id:
+            return 'Mainline'
+        elif 'on_ramp' in veh_id:
+            return 'On-Ramp'
+        elif 'off_ramp' in veh_id:
+            return 'Off-Ramp'
+        return 'Other'
+
+    def start(self, conn, step_length):
+        """Starts a new episode. Subscriptions do not survive a restart, call after every start."""
+        self.conn = conn
+        self.step_length = step_length
+        self.active = {}
+        self.route_lengths = {}
+        self.trips = []
+
+        # Vehicles already in the network (simulation started from a saved state)
+        for veh_id in self.conn.vehicle.getIDList():
+            self._add(veh_id, self.conn.simulation.getTime() - self.step_length)
+
+    def _add(self, veh_id, depart):
+        self.conn.vehicle.subscribe(veh_id, self.VARIABLES)
+        self.active[veh_id] = [depart, 0., 0., 0., 0., 0., 0, None, 0, 0., 0., 0., 0., 0.]
+
+    def _route_length(self, route_id):
+        if route_id not in self.route_lengths:
+            self.route_lengths[route_id] = len(self.conn.route.getEdges(route_id))
+        return self.route_lengths[route_id]
+
+    def step(self):
+        sim_time = self.conn.simulation.getTime()
+        step_start = sim_time - self.step_length
+
+        for veh_id in self.conn.simulation.getDepartedIDList():
+            self._add(veh_id, step_start)
+
+        for veh_id, data in self.conn.vehicle.getAllSubscriptionResults().items():
+            trip = self.active.get(veh_id)
+            if trip is None:
+                continue
+
+            trip[self.DEPART] = data[tc.VAR_DEPARTURE]
+            trip[self.ROUTE_ID] = data[tc.VAR_ROUTE_ID]
+            trip[self.ROUTE_INDEX] = data[tc.VAR_ROUTE_INDEX]
+            if step_start <= trip[self.DEPART]:
+                # Seen right after insertion: no move yet
+                trip[self.TIME_LOSS] = data[tc.VAR_TIMELOSS]
+                continue
+
+            move = (
+                data[tc.VAR_TIMELOSS] - trip[self.TIME_LOSS],
+                self.step_length if data[tc.VAR_SPEED] <= self.WAITING_SPEED else 0.,
+                data[tc.VAR_CO2EMISSION] * self.step_length,
+                data[tc.VAR_FUELCONSUMPTION] * self.step_length,
+                data[tc.VAR_NOXEMISSION] * self.step_length,
+            )
+            self._add_move(trip, move)
+
+        for veh_id in self.conn.simulation.getArrivedIDList():
+            trip = self.active.pop(veh_id, None)
+            if trip is None:
+                continue
+
+            # The arrival move is not seen, repeat the last one
+            if trip[self.MOVES] > 0:
+                self._add_move(trip, trip[self.LAST_TIME_LOSS:])
+
+            vaporized = trip[self.ROUTE_ID] is not None and trip[self.ROUTE_INDEX] < self._route_length(trip[self.ROUTE_ID]) - 1
+            self.trips.append((self.get_route_type(veh_id), step_start - trip[self.DEPART], trip[self.TIME_LOSS], trip[self.WAITING],
+                               trip[self.CO2], trip[self.FUEL], trip[self.NOX], vaporized))
+
+    def _add_move(self, trip, move):
+        time_loss, waiting, co2, fuel, nox = move
+        trip[self.TIME_LOSS] += time_loss
+        trip[self.WAITING] += waiting
+        trip[self.CO2] += co2
+        trip[self.FUEL] += fuel
+        trip[self.NOX] += nox
+        trip[self.MOVES] += 1
+        trip[self.LAST_TIME_LOSS:] = [time_loss, waiting, co2, fuel, nox]
+
+    def aggregate(self):
+        if not self.trips:
+            # Same zero values as the tripinfo parser if no trips were completed
+            return {
+                'total_throughput': 0, 'total_travel_time': 0, 'avg_travel_time': 0, 'median_travel_time': 0, 'std_dev_travel_time': 0,
+                'total_time_loss': 0, 'avg_time_loss': 0, 'median_time_loss': 0, 'std_dev_time_loss': 0,
+                'sum_of_squared_time_loss': 0, 'total_waiting_time': 0, 'avg_waiting_time': 0,
+                'num_teleported_tripinfo': 0, 'total_co2_mg': 0, 'total_fuel_ml': 0, 'total_nox_mg': 0
+            }
+
+        route_type = np.array([trip[0] for trip in self.trips])
+        duration, time_loss, waiting_time, co2, fuel, nox, vaporized = \
+            np.array([trip[1:] for trip in self.trips], dtype=np.float64).T
+
+        n = len(self.trips)
+        overall_stats = {
+            'total_throughput': n,
+            'total_travel_time': duration.sum(), 'avg_travel_time': duration.mean(),
+            'median_travel_time': np.median(duration), 'std_dev_travel_time': duration.std(ddof=1) if n > 1 else np.nan,
+            'total_time_loss': time_loss.sum(), 'avg_time_loss': time_loss.mean(),
+            'median_time_loss': np.median(time_loss), 'std_dev_time_loss': time_loss.std(ddof=1) if n > 1 else np.nan,
+            'sum_of_squared_time_loss': (time_loss ** 2).sum(),
+            'total_waiting_time': waiting_time.sum(), 'avg_waiting_time': waiting_time.mean(),
+            'num_teleported_tripinfo': int(vaporized.sum()),
+            'total_co2_mg': co2.sum(), 'total_fuel_ml': fuel.sum(), 'total_nox_mg': nox.sum()
+        }
+
+        masks = {route: route_type == route for route in self.ROUTE_TYPES}
+        route_stats = {}
+        route_stats.update({f"{route}_avg_time_loss": time_loss[mask].mean() if mask.any() else np.nan for route, mask in masks.items()})
+        route_stats.update({f"{route}_avg_travel_time": duration[mask].mean() if mask.any() else np.nan for route, mask in masks.items()})
+        route_stats.update({f"{route}_throughput": int(mask.sum()) for route, mask in masks.items()})
+
+        return {**overall_stats, **route_stats}
@@ -21,6 +21,12 @@ CONFIGS_MULTI = [
 
 SUMO_PARAMS = {
     "config": CONFIGS_SIMPLE[0], # The SUMO configuration to use.
+    "backend": "traci", # "traci" (socket to a sumo process) or "libsumo" (in-process, no GUI support).
+    "reset_mode": "restart", # "restart" (new sumo process per episode), "load" (reload in the running process) or "state" (reload from a cached warmed-up state per demand scenario).
+    "warmup_sec": [5.0], # Warm-up horizons simulated by RLController.reset before the first agent step (e.g. [300, 600, 900] to start in the congested regime).
+    "warmup_random": True, # Pick the warm-up horizon of each episode at random among "warmup_sec" (False: always the first one).
+    "step_mode": "step", # "step" (one simulation step per second, exact ramp queue) or "phase" (one simulationStep(target_time) per signal phase, ramp queue from the E2 detector "ramp_queue_e2"). "phase" changes the ramp queue, and with it the reward and observation: the E2 estimate counts vehicles partly on the detector by their share and converts occupied length with one vehicle length, so it only equals the on-ramp vehicle number for whole vehicles of that length on a detector covering the edge.
+    "ramp_queue_veh_length": None, # Vehicle length (m) converting the E2 occupancy to a number of queued vehicles in step_mode "phase" (None: length of the "v_type_con" vType, read at simulation start).
     "log_overall_metrics" : True, # Whether to log overall metrics for the simulation.
     "steps": 3600, # The number of simulation steps to run.
     "delay": 0,   # The delay (in milliseconds) between simulation steps when running with a GUI.
@@ -30,6 +36,8 @@ SUMO_PARAMS = {
     "seed":False, # Whether to use a fixed seed for the simulation (True for fixed, False for random).
     "seed_value": 42, # The seed value to use for the simulation if `seed` is True.
     "alinea_detector_period_sec": 40.0,
+    "baseline_log_interval_sec": 40.0, # Simulated seconds a baseline advances per env step; metrics are collected (one log row) once per interval.
+    "ramp_spillback_threshold_veh": 20, # Ramp queue (vehicles) above which a baseline simulation step counts as spillback ("ramp_spillback_sec" log column).
 
     
     # Base values for flows
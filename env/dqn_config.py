@@ -25,7 +25,7 @@ MAX_AGENT_STEPS_PER_EPISODE = int(MAX_SIMULATION_SECONDS_PER_EPISODE / AGENT_CON
 
 HYPER_PARAMS = {
     'gpu': '0',                                 # GPU #
-    'n_env': 1,                                 # Multi-processing environments (usually 1 for SUMO unless carefully managed)
+    'n_env': 1,                                 # Multi-processing environments (one SUMO instance per worker process, ~1 per core)
     'lr': 1e-4,                                 # Learning rate
     'gamma': 0.99,                              # Discount factor
     'eps_start': 1.0,                           # Epsilon start
@@ -37,6 +37,13 @@ HYPER_PARAMS = {
     'min_mem': 100000,                           # Replay memory buffer min size (e.g., 10k agent steps * 40s/step = 400k sim seconds worth)
                                                 # This means ~111 episodes of 3600s to fill if min_mem = 10k agent steps.
     'max_mem': 1000000,                          # Replay memory buffer max size (100k agent steps * 40s/step = 4M sim seconds)
+    'mem_dedup_obs': False,                     # Opt-in: store each observation once and rebuild next_obs at sample time (halves replay RAM)
+    'mem_compress_obs': False,                  # Opt-in, lossy: store macro vector in float16 (~2.4e-4 abs error), grid speed in uint8 (~2e-3) and occupancy as a bitmask
+    'mem_spill_freq': 0,                        # Opt-in: write new replay transitions to disk every n transitions (0 = never), reloaded when a model is resumed
+    'dataset_dir': None,                        # Record every collected transition to shards in this directory (None = off)
+    'dataset_shard_size': 50000,                # Transitions per dataset shard
+    'offline': False,                           # Train from dataset_dir only, without SUMO (hyperparameter sweeps)
+    'loader_threads': 4,                        # Offline dataset prefetching threads
     'target_update_freq': 30000,                  # Target network update frequency (in agent steps, e.g., every 500*40 = 20k sim seconds)
     'target_soft_update': True,                 # Target network soft update
     'target_soft_update_tau': 1e-3,             # Target network soft update tau rate
@@ -45,10 +52,14 @@ HYPER_PARAMS = {
     'save_dir': './save/' + CONFIG + "/",       # Save directory
     'log_dir': './logs/train/' + CONFIG + "/",  # Log directory
     'load': True,                               # Load model if exists
+    'save_replay': False,                       # Also checkpoint the replay memory (resume without refilling it)
     'repeat': 0,                                # Repeat action (not applicable here as 1 action = 40s cycle)
     'max_episode_steps': 1000, # Max agent steps (40s cycles) per episode
     'max_total_steps': 21e5,                       # Max total training agent steps if > 0, else inf training
                                                 # e.g., 50000 for 2M sim seconds of training (50000 * 40s)
+    'actors': 0,                                # Asynchronous actor processes (0 = synchronous train_loop)
+    'replay_ratio': 1.0,                        # Learner gradient steps per collected environment step (asynchronous training)
+    'actor_sync_freq': 500,                     # Actors refresh their copy of online_network every n gradient steps
     'algo': 'DuelingDoubleDQNAgent'             # DQNAgent
                                                 # DoubleDQNAgent
                                                 # DuelingDoubleDQNAgent (Good choice)
@@ -8,13 +8,13 @@ class DqnEnv:
     def min_max_scale(self, x, feature):
         return (x - self.min_max[feature][0]) / (self.min_max[feature][1] - self.min_max[feature][0])
 
-    def __init__(self, m, p=None):
+    def __init__(self, m, p=None, worker_id=None):
         self.mode = {"train": False, "observe": False, "play": False, m: True}
         self.player = p if self.mode["play"] else None
 
         # """CHANGE ENV CONSTRUCT HERE""" ##############################################################################
         if self.mode["train"]:
-            self.sumo_env = RLController(gui=False, log=False, rnd=(False, False))
+            self.sumo_env = RLController(gui=False, log=False, rnd=(False, False), worker_id=worker_id)
         elif self.mode["observe"]:
              self.sumo_env = RLController(gui=SUMO_PARAMS["gui"], log=True, rnd=SUMO_PARAMS["rnd"])
         elif self.mode["play"]:
@@ -34,6 +34,12 @@ class DqnEnv:
         self.observation_space_n = self.sumo_env.observation_space_n
         ################################################################################################################
 
+    @staticmethod
+    def train_space_sizes():
+        # """CHANGE ACTION AND OBSERVATION SPACE SIZES HERE""" too: (observation_space_n, action_space_n) of the
+        # training environment, without starting a simulation
+        return RLController.config_space_sizes()
+
     def obs(self):
         # """CHANGE OBSERVATION HERE""" ################################################################################
         obs = self.sumo_env.obs()
@@ -3,6 +3,8 @@ import os
 import sys
 import argparse
 import random
+import shutil
+import multiprocessing as mp
 import pandas as pd
 from tqdm import tqdm
 from colorama import Fore, Style
@@ -25,82 +27,157 @@ def run_single_episode(env_instance):
     obs, info = env_instance.env.reset()
     done = truncated = False
     while not (done or truncated):
-        action = env_instance.get_play_action() if isinstance(env_instance, Play) else env_instance.network.actions([obs.tolist()])[0]
+        action = env_instance.get_play_action() if isinstance(env_instance, Play) else env_instance.network.action(obs)
         obs, _, terminated, truncated, info = env_instance.env.step(action)
         done = terminated
         env_instance.env.log_info_writer(info, done or truncated, *env_instance.log)
 
+def evaluate_episode(strategy, episode, seed, args, scratch_dir=None):
+    """Runs one evaluation episode and returns its metric dict.
+
+    scratch_dir=None keeps tripinfo in the shared data dir and the temp logs in the output dir (single process).
+    Otherwise tripinfo, SUMO log and framework CSV all go to scratch_dir, so workers don't overwrite each other.
+    """
+    strategy_class = STRATEGIES[strategy]
+
+    if scratch_dir is None:
+        temp_sumo_log_path = os.path.join(args.output_dir, f"temp_sumo_log_{strategy}.log")
+        log_dir = args.output_dir
+    else:
+        os.environ['SUMO_EVAL_OUTPUT_DIR'] = scratch_dir
+        temp_sumo_log_path = os.path.join(scratch_dir, "sumo.log")
+        log_dir = os.path.join(scratch_dir, "")
+
+    os.environ['SUMO_EVAL_TRIP_STATS'] = args.trip_stats
+    os.environ['SUMO_EVAL_SEED'] = str(seed)
+    os.environ['SUMO_EVAL_LOG_FILE'] = temp_sumo_log_path
+    random.seed(seed)
+
+    mock_args_dict = {'max_s': 0, 'max_e': 1, 'log': True, 'log_s': 1, 'log_dir': log_dir}
+
+    if strategy_class == Play:
+        mock_args_dict['player'] = strategy
+        temp_framework_log_path = os.path.join(log_dir, strategy)
+    else:
+        mock_args_dict.update({'d': args.model_path, 'gpu': args.gpu})
+        model_pack_name = args.model_path.split('/')[-1].split('_model.')[0]
+        temp_framework_log_path = os.path.join(log_dir, model_pack_name)
+
+    mock_args = argparse.Namespace(**mock_args_dict)
+    env_instance = strategy_class(mock_args)
+
+    run_single_episode(env_instance)
+
+    scenario_info = env_instance.env.get_env().get_scenario_info()
+    sumo_env = env_instance.env.get_env().sumo_env
+    env_instance.close()
+
+    # --- Trip stats: collected live during the run, or parsed from tripinfo.xml ---
+    if args.trip_stats == "live":
+        trip_and_emission_stats = sumo_env.trip_stats.aggregate()
+    else:
+        trip_and_emission_stats = parse_tripinfo_for_episode_stats(sumo_env.tripinfo_file_path)
+        if args.trip_stats == "validate":
+            print_trip_stats_validation(strategy, episode, sumo_env.trip_stats.aggregate(), trip_and_emission_stats)
+
+    # --- Parsing is now simpler ---
+    sumo_stats = parse_sumo_log(temp_sumo_log_path)
+    framework_stats = parse_framework_log(temp_framework_log_path, spillback_threshold=SUMO_PARAMS["ramp_spillback_threshold_veh"])
+
+    combined_stats = {
+        "episode_id": episode, "seed": seed,
+        **scenario_info, **trip_and_emission_stats, **sumo_stats, **framework_stats
+    }
+
+    # --- Cleanup is simpler ---
+    if os.path.exists(temp_sumo_log_path): os.remove(temp_sumo_log_path)
+    if os.path.exists(temp_framework_log_path): os.remove(temp_framework_log_path)
+
+    return combined_stats
+
+def print_trip_stats_validation(strategy, episode, live_stats, parsed_stats):
+    """Prints the relative difference of every live trip stat to the tripinfo.xml one."""
+    print(f"\n{Fore.CYAN}--- Live trip stats vs tripinfo.xml: {strategy}, episode {episode} ---{Style.RESET_ALL}")
+    for key, parsed in parsed_stats.items():
+        live = live_stats.get(key)
+        rel_diff = abs(live - parsed) / abs(parsed) if live is not None and parsed else 0.
+        color = Fore.GREEN if rel_diff <= 0.01 else Fore.YELLOW
+        print(f"{color}{key}: live={live} tripinfo={parsed} rel_diff={rel_diff:.4%}{Style.RESET_ALL}")
+
+# --- Process pool mode: (strategy, seed) pairs are sharded across workers, each with its own scratch dir ---
+_worker_scratch_dir = None
+
+def _init_worker(scratch_root):
+    global _worker_scratch_dir
+    _worker_scratch_dir = os.path.join(scratch_root, f"w{os.getpid()}")
+    os.makedirs(_worker_scratch_dir, exist_ok=True)
+
+def _evaluate_episode_in_worker(task):
+    strategy, episode, seed, args = task
+    return strategy, evaluate_episode(strategy, episode, seed, args, _worker_scratch_dir)
+
+def evaluate_parallel(args, tasks):
+    all_episode_metrics = {strategy: [] for strategy in args.strategy}
+    scratch_root = os.path.join(args.output_dir, "scratch")
+
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(args.workers, initializer=_init_worker, initargs=(scratch_root,)) as pool:
+        for strategy, combined_stats in tqdm(pool.imap_unordered(_evaluate_episode_in_worker, tasks),
+                                             total=len(tasks), desc="Evaluating", unit="episode"):
+            all_episode_metrics[strategy].append(combined_stats)
+
+    shutil.rmtree(scratch_root, ignore_errors=True)
+
+    # Workers finish out of order, restore the episode order of the sequential runner
+    return {strategy: sorted(metrics, key=lambda m: m["episode_id"]) for strategy, metrics in all_episode_metrics.items()}
+
+def save_results(args, strategy, episode_metrics):
+    if episode_metrics:
+        results_df = pd.DataFrame(episode_metrics)
+        final_csv_path = os.path.join(args.output_dir, f"results_{strategy}.csv")
+        results_df.to_csv(final_csv_path, index=False, float_format='%.4f')
+        print(f"\n{Fore.GREEN}--- Evaluation Complete: {strategy} ---{Style.RESET_ALL}")
+        print(f"Results for {len(episode_metrics)} episodes saved to: {final_csv_path}")
+    else:
+        print(f"\n{Fore.YELLOW}Warning: No metrics were collected for {strategy}. Evaluation may have failed.{Style.RESET_ALL}")
+
 def main():
     parser = argparse.ArgumentParser(description="Run evaluation benchmark for ramp metering strategies.")
     # ... (all arguments are the same as before) ...
-    parser.add_argument('-s', '--strategy', type=str, required=True, choices=list(STRATEGIES.keys()), help='The control strategy to evaluate.')
+    parser.add_argument('-s', '--strategy', type=str, nargs='+', required=True, choices=list(STRATEGIES.keys()), help='The control strategies to evaluate.')
     parser.add_argument('-n', '--num-episodes', type=int, default=10, help='Number of episodes to run for the evaluation.')
     parser.add_argument('--master-seed', type=int, default=42, help='The master seed for reproducibility.')
-    parser.add_argument('-d', '--model-path', type=str, default=None, help='Path to the trained DRL agent model (.pack file), required for DQNAgent.')
+    parser.add_argument('-d', '--model-path', type=str, default=None, help='Path to the trained DRL agent model (_model.ckpt, or legacy _model.pack, file), required for DQNAgent.')
     parser.add_argument('-o', '--output-dir', type=str, default="./evaluation/results/", help='Directory to save the final results CSV.')
     parser.add_argument('-g', '--gpu', type=str, default='0', help='GPU to use for the agent.')
+    parser.add_argument('--trip-stats', type=str, default="tripinfo", choices=["tripinfo", "live", "validate"],
+                        help='Trip stats source: parse tripinfo.xml, collect them live in SUMO (no tripinfo file) or do both and compare.')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Worker processes, episodes of all strategies are sharded across them (1: sequential).')
     args = parser.parse_args()
 
     os.makedirs(args.output_dir, exist_ok=True)
-    strategy_class = STRATEGIES[args.strategy]
-    
-    # --- Paths are simpler now ---
-    base_data_path = f"./env/custom_env/data/{SUMO_PARAMS['config']}/"
-    tripinfo_xml_path = os.path.join(base_data_path, "tripinfo.xml")
-    temp_sumo_log_path = os.path.join(args.output_dir, f"temp_sumo_log_{args.strategy}.log")
-    
-    all_episode_metrics = []
-    print(f"{Fore.CYAN}--- Starting Evaluation for: {Style.BRIGHT}{args.strategy}{Style.RESET_ALL} ---")
-    
-    for episode in tqdm(range(args.num_episodes), desc=f"Evaluating {args.strategy}", unit="episode"):
-        current_seed = args.master_seed + episode
-        os.environ['SUMO_EVAL_SEED'] = str(current_seed)
-        os.environ['SUMO_EVAL_LOG_FILE'] = temp_sumo_log_path
-        random.seed(current_seed)
-        
-        mock_args_dict = {'max_s': 0, 'max_e': 1, 'log': True, 'log_s': 1, 'log_dir': args.output_dir}
-        
-        if strategy_class == Play:
-            mock_args_dict['player'] = args.strategy
-            temp_framework_log_path = os.path.join(args.output_dir, args.strategy)
-        else:
-            if not args.model_path:
-                print(f"{Fore.RED}\nError: --model-path is required for DQNAgent.{Style.RESET_ALL}"); return
-            mock_args_dict.update({'d': args.model_path, 'gpu': args.gpu})
-            model_pack_name = args.model_path.split('/')[-1].split('_model.pack')[0]
-            temp_framework_log_path = os.path.join(args.output_dir, model_pack_name)
-
-        mock_args = argparse.Namespace(**mock_args_dict)
-        env_instance = strategy_class(mock_args)
-        
-        run_single_episode(env_instance)
-        
-        scenario_info = env_instance.env.get_env().get_scenario_info()
-        env_instance.close()
-
-        # --- Parsing is now simpler ---
-        trip_and_emission_stats = parse_tripinfo_for_episode_stats(tripinfo_xml_path)
-        sumo_stats = parse_sumo_log(temp_sumo_log_path)
-        framework_stats = parse_framework_log(temp_framework_log_path, spillback_threshold=20)
-        
-        combined_stats = {
-            "episode_id": episode, "seed": current_seed,
-            **scenario_info, **trip_and_emission_stats, **sumo_stats, **framework_stats
-        }
-        all_episode_metrics.append(combined_stats)
-
-        # --- Cleanup is simpler ---
-        if os.path.exists(temp_sumo_log_path): os.remove(temp_sumo_log_path)
-        if os.path.exists(temp_framework_log_path): os.remove(temp_framework_log_path)
-
-    if all_episode_metrics:
-        results_df = pd.DataFrame(all_episode_metrics)
-        final_csv_path = os.path.join(args.output_dir, f"results_{args.strategy}.csv")
-        results_df.to_csv(final_csv_path, index=False, float_format='%.4f')
-        print(f"\n{Fore.GREEN}--- Evaluation Complete: {args.strategy} ---{Style.RESET_ALL}")
-        print(f"Results for {args.num_episodes} episodes saved to: {final_csv_path}")
-    else:
-        print(f"\n{Fore.YELLOW}Warning: No metrics were collected. Evaluation may have failed.{Style.RESET_ALL}")
+
+    if any(STRATEGIES[strategy] == Observe for strategy in args.strategy) and not args.model_path:
+        print(f"{Fore.RED}\nError: --model-path is required for DQNAgent.{Style.RESET_ALL}"); return
+
+    if args.workers > 1:
+        print(f"{Fore.CYAN}--- Starting Evaluation for: {Style.BRIGHT}{', '.join(args.strategy)}{Style.RESET_ALL} "
+              f"{Fore.CYAN}on {args.workers} workers ---{Style.RESET_ALL}")
+
+        tasks = [(strategy, episode, args.master_seed + episode, args)
+                 for strategy in args.strategy for episode in range(args.num_episodes)]
+        for strategy, episode_metrics in evaluate_parallel(args, tasks).items():
+            save_results(args, strategy, episode_metrics)
+        return
+
+    for strategy in args.strategy:
+        all_episode_metrics = []
+        print(f"{Fore.CYAN}--- Starting Evaluation for: {Style.BRIGHT}{strategy}{Style.RESET_ALL} ---")
+
+        for episode in tqdm(range(args.num_episodes), desc=f"Evaluating {strategy}", unit="episode"):
+            all_episode_metrics.append(evaluate_episode(strategy, episode, args.master_seed + episode, args))
+
+        save_results(args, strategy, all_episode_metrics)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
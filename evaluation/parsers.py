@@ -2,6 +2,7 @@
 
 import xml.etree.ElementTree as ET
 import re
+from array import array
 import pandas as pd
 import numpy as np
 
@@ -18,48 +19,112 @@ def get_route_type(trip_id):
         return 'Off-Ramp'
     return 'Other'
 
+class RunningStats:
+    """
+    Running count, sum and mean/variance (Welford) of a stream of values. With keep_values=True the values
+    are also kept in a compact float64 array for an exact median.
+    """
+    def __init__(self, keep_values=False):
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.values = array('d') if keep_values else None
+
+    def add(self, x):
+        self.n += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if self.values is not None:
+            self.values.append(x)
+
+    def avg(self):
+        return self.mean if self.n > 0 else np.nan
+
+    def std(self):
+        # Sample standard deviation (ddof=1), like pandas
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+
+    def median(self):
+        return float(np.median(np.frombuffer(self.values, dtype=np.float64))) if self.n > 0 else np.nan
+
+
+def _float_attr(element, key):
+    # Missing or non-numeric attributes count as 0, like the fillna(0) of the DataFrame version
+    try:
+        return float(element.get(key, 0))
+    except ValueError:
+        return 0.0
+
+
 def parse_tripinfo_for_episode_stats(tripinfo_path):
     """
     Parses a tripinfo.xml file from a single episode and calculates aggregate
     statistics for travel time, delay, and emissions.
 
+    The file is streamed with iterparse and every trip element is cleared once it is
+    aggregated, so memory stays bounded by the number of running sums (plus one float
+    per trip for the exact medians).
+
     Args:
         tripinfo_path (str): The path to the tripinfo.xml file.
 
     Returns:
         dict: A dictionary of aggregated metrics for the episode.
     """
+    expected_routes = ['Mainline', 'On-Ramp', 'Off-Ramp']
+
+    duration = RunningStats(keep_values=True)
+    time_loss = RunningStats(keep_values=True)
+    waiting_time = RunningStats()
+    sum_of_squared_time_loss = 0.0
+    num_teleported = 0
+    total_co2 = total_fuel = total_nox = 0.0
+    route_duration = {route: RunningStats() for route in expected_routes}
+    route_time_loss = {route: RunningStats() for route in expected_routes}
+
     try:
-        tree = ET.parse(tripinfo_path)
-        root = tree.getroot()
-    except (FileNotFoundError, ET.ParseError):
+        context = ET.iterparse(tripinfo_path, events=('start', 'end'))
+        _, root = next(context)
+
+        for event, trip in context:
+            if event != 'end' or trip.tag != 'tripinfo':
+                continue
+
+            # Only process trips that have a duration (i.e., they completed)
+            if trip.get('duration'):
+                trip_duration = _float_attr(trip, 'duration')
+                trip_time_loss = _float_attr(trip, 'timeLoss')
+
+                duration.add(trip_duration)
+                time_loss.add(trip_time_loss)
+                waiting_time.add(_float_attr(trip, 'waitingTime'))
+                sum_of_squared_time_loss += trip_time_loss ** 2
+                # SUMO writes vaporized="" on every trip, only removed vehicles carry a reason
+                num_teleported += 1 if trip.get('vaporized') else 0
+
+                # --- Emission data from the sub-element ---
+                emissions_element = trip.find('emissions')
+                if emissions_element is not None:
+                    total_co2 += _float_attr(emissions_element, 'CO2_abs')
+                    total_fuel += _float_attr(emissions_element, 'fuel_abs')
+                    total_nox += _float_attr(emissions_element, 'NOx_abs')
+
+                route_type = get_route_type(trip.get('id'))
+                if route_type in route_duration:
+                    route_duration[route_type].add(trip_duration)
+                    route_time_loss[route_type].add(trip_time_loss)
+
+            # Aggregated: drop the trip (and the emptied elements kept by the root)
+            trip.clear()
+            root.clear()
+    except (FileNotFoundError, ET.ParseError, StopIteration):
         print(f"\nWarning: Could not parse tripinfo file at {tripinfo_path}")
         return {}
 
-    trip_data = []
-    for trip in root.findall('tripinfo'):
-        # Only process trips that have a duration (i.e., they completed)
-        if trip.get('duration'):
-            trip_attrs = trip.attrib
-            trip_attrs['route_type'] = get_route_type(trip_attrs['id'])
-
-            # --- NEW: Extract emission data from the sub-element ---
-            emissions_element = trip.find('emissions')
-            if emissions_element is not None:
-                # Add emission attributes to the main trip dictionary
-                trip_attrs.update(emissions_element.attrib)
-            
-            # Convert all numeric attributes to float
-            for key, val in trip_attrs.items():
-                try:
-                    trip_attrs[key] = float(val)
-                except (ValueError, TypeError):
-                    continue # Keep as string if conversion fails
-            
-            trip_attrs['vaporized'] = 1 if 'vaporized' in trip.keys() else 0
-            trip_data.append(trip_attrs)
-
-    if not trip_data:
+    if duration.n == 0:
         # Return a dictionary with zero values if no trips were completed
         return {
             'total_throughput': 0, 'total_travel_time': 0, 'avg_travel_time': 0, 'median_travel_time': 0, 'std_dev_travel_time': 0,
@@ -68,36 +133,24 @@ def parse_tripinfo_for_episode_stats(tripinfo_path):
             'num_teleported_tripinfo': 0, 'total_co2_mg': 0, 'total_fuel_ml': 0, 'total_nox_mg': 0
         }
 
-    df = pd.DataFrame(trip_data)
-    # Fill NaN values with 0 for columns where data might be missing (e.g., emissions for some vehicles)
-    df.fillna(0, inplace=True)
-    df['timeLoss_sq'] = df['timeLoss']**2
-
     # --- Overall Aggregations (Now including emissions) ---
     overall_stats = {
-        'total_throughput': len(df),
-        'total_travel_time': df['duration'].sum(), 'avg_travel_time': df['duration'].mean(),
-        'median_travel_time': df['duration'].median(), 'std_dev_travel_time': df['duration'].std(),
-        'total_time_loss': df['timeLoss'].sum(), 'avg_time_loss': df['timeLoss'].mean(),
-        'median_time_loss': df['timeLoss'].median(), 'std_dev_time_loss': df['timeLoss'].std(),
-        'sum_of_squared_time_loss': df['timeLoss_sq'].sum(),
-        'total_waiting_time': df['waitingTime'].sum(), 'avg_waiting_time': df['waitingTime'].mean(),
-        'num_teleported_tripinfo': df['vaporized'].sum(),
-        'total_co2_mg': df['CO2_abs'].sum(), 'total_fuel_ml': df['fuel_abs'].sum(), 'total_nox_mg': df['NOx_abs'].sum()
+        'total_throughput': duration.n,
+        'total_travel_time': duration.total, 'avg_travel_time': duration.avg(),
+        'median_travel_time': duration.median(), 'std_dev_travel_time': duration.std(),
+        'total_time_loss': time_loss.total, 'avg_time_loss': time_loss.avg(),
+        'median_time_loss': time_loss.median(), 'std_dev_time_loss': time_loss.std(),
+        'sum_of_squared_time_loss': sum_of_squared_time_loss,
+        'total_waiting_time': waiting_time.total, 'avg_waiting_time': waiting_time.avg(),
+        'num_teleported_tripinfo': num_teleported,
+        'total_co2_mg': total_co2, 'total_fuel_ml': total_fuel, 'total_nox_mg': total_nox
     }
 
-    # --- Per-Route Aggregations (No changes needed here) ---
-    expected_routes = ['Mainline', 'On-Ramp', 'Off-Ramp']
-    df['route_type'] = pd.Categorical(df['route_type'], categories=expected_routes, ordered=True)
-    
-    route_stats = df.groupby('route_type', observed=False).agg(
-        avg_time_loss=('timeLoss', 'mean'),
-        avg_travel_time=('duration', 'mean'),
-        throughput=('id', 'count')
-    ).unstack()
-    
-    route_stats.index = [f"{col[1]}_{col[0]}" for col in route_stats.index]
-    route_stats_dict = route_stats.to_dict()
+    # --- Per-Route Aggregations (same keys and order as the former groupby/unstack) ---
+    route_stats_dict = {}
+    route_stats_dict.update({f"{route}_avg_time_loss": route_time_loss[route].avg() for route in expected_routes})
+    route_stats_dict.update({f"{route}_avg_travel_time": route_duration[route].avg() for route in expected_routes})
+    route_stats_dict.update({f"{route}_throughput": route_duration[route].n for route in expected_routes})
 
     return {**overall_stats, **route_stats_dict}
 
@@ -125,6 +178,13 @@ def parse_framework_log(log_path, spillback_threshold=20):
     Parses the framework's temporary log to calculate average detector
     metrics and total spillback time.
 
+    Logs with a "ramp_spillback_sec" column (baselines) carry the spillback
+    seconds counted per simulation step, and the total is their sum. Baseline
+    rows are interval means (one per "baseline_log_interval_sec"), so counting
+    rows above the threshold would only see windows whose mean queue spills
+    back and miss short peaks. Other logs (the DQN agent, one row per cycle)
+    keep the row-based estimate.
+
     Args:
         log_path (str): Path to the temporary framework CSV log.
         spillback_threshold (int): The queue length that defines a spillback event.
@@ -154,7 +214,9 @@ def parse_framework_log(log_path, spillback_threshold=20):
 
     # --- 2. Calculate Spillback Time ---
     total_spillback_time = 0
-    if 'ramp_queue_veh' in df.columns and 'sim_time' in df.columns:
+    if 'ramp_spillback_sec' in df.columns:
+        total_spillback_time = df['ramp_spillback_sec'].sum()
+    elif 'ramp_queue_veh' in df.columns and 'sim_time' in df.columns:
         # Filter rows where the queue exceeds the threshold
         spillback_df = df[df['ramp_queue_veh'] > spillback_threshold]
         
@@ -19,7 +19,7 @@ class Observe(View):
                                           max_episode_steps=args.max_s)
                                       )
 
-        model_pack = args.d.split('/')[-1].split('_model.pack')[0]
+        model_pack = args.d.split('/')[-1].split('_model.')[0]
 
         self.network = getattr(Networks, {
             "DQNAgent": "DeepQNetwork",
@@ -61,7 +61,7 @@ class Observe(View):
 
     def loop(self):
         if self.repeat % (HYPER_PARAMS['repeat'] or 1) == 0:
-            self.action = self.network.actions([self.obs.tolist()])[0]
+            self.action = self.network.action(self.obs)
 
         self.repeat += 1
 
@@ -1,25 +1,54 @@
-from env import HYPER_PARAMS, network_config, CustomEnv
-from dqn import CustomEnvWrapper, make_env, Agents
+from env import HYPER_PARAMS, SUMO_PARAMS, network_config, CustomEnv
+from dqn import CustomEnvWrapper, make_env, GridObsCodec, TransitionShardWriter, TransitionDataset, ReplayMemoryOffline, ActorPool, Agents
 
 import os
 import time
 import argparse
 import itertools
+import functools
+import numpy as np
+from gymnasium import spaces
 from datetime import timedelta
 from colorama import Fore
 
+from torch import device
+
 
 class Train:
     def __init__(self, args):
         os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
         os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
 
-        self.env = make_env(
-            env=CustomEnvWrapper(CustomEnv(type(self).__name__.lower())),
-            repeat=args.repeat,
-            max_episode_steps=args.max_episode_steps,
-            n_env=args.n_env
-        )
+        mode, n_env = type(self).__name__.lower(), args.n_env
+
+        self.offline = args.offline
+        obs_codec = GridObsCodec(
+            macro_len=SUMO_PARAMS["vector_len"],
+            grid_shape=(SUMO_PARAMS["grid_rows"], SUMO_PARAMS["grid_cols"], SUMO_PARAMS["grid_channels"])
+        ) if args.mem_compress_obs else None
+
+        if self.offline:
+            assert args.dataset_dir is not None, "Offline training needs -dataset_dir"
+            assert not args.algo.startswith("Per"), "Offline training samples uniformly, use a non-prioritized agent"
+
+            # Every transition comes from the recorded dataset, no simulation is started
+            self.env = None
+            self.dataset = TransitionDataset(args.dataset_dir, args.bs, obs_codec, n_threads=args.loader_threads)
+            observation_space = spaces.Box(low=0., high=1., shape=(self.dataset.obs_dim,), dtype=np.float32)
+            action_space_n = self.dataset.output_dim
+        elif args.actors > 0:
+            # Actors run their own simulations, the learner takes the spaces from the config and starts none
+            self.env = None
+            observation_space_n, action_space_n = CustomEnv.train_space_sizes()
+            observation_space = spaces.Box(low=0., high=1., shape=(observation_space_n,), dtype=np.float32)
+        else:
+            self.env = make_env(
+                env=(lambda worker_id: CustomEnvWrapper(CustomEnv(mode, worker_id=(worker_id if n_env > 1 else None)))),
+                repeat=args.repeat,
+                max_episode_steps=args.max_episode_steps,
+                n_env=args.n_env
+            )
+            observation_space, action_space_n = self.env.observation_space, self.env.action_space.n
 
         self.agent = getattr(Agents, args.algo)(
             n_env=args.n_env,
@@ -30,11 +59,14 @@ class Train:
             epsilon_decay=args.eps_dec,
             epsilon_exp_decay=args.eps_dec_exp,
             nn_conf_func=network_config,
-            input_dim=self.env.observation_space,
-            output_dim=self.env.action_space.n,
+            input_dim=observation_space,
+            output_dim=action_space_n,
             batch_size=args.bs,
             min_buffer_size=args.min_mem,
             buffer_size=args.max_mem,
+            # Actors push single interleaved transitions, which breaks the per-stream layout dedup_obs relies on
+            buffer_dedup_obs=args.mem_dedup_obs and not args.actors,
+            buffer_obs_codec=obs_codec,
             update_target_frequency=args.target_update_freq,
             target_soft_update=args.target_soft_update,
             target_soft_update_tau=args.target_soft_update_tau,
@@ -44,8 +76,14 @@ class Train:
             log_dir=args.log_dir,
             load=args.load,
             algo=args.algo,
-            gpu=args.gpu
+            gpu=args.gpu,
+            save_replay=args.save_replay and not self.offline,
+            buffer_spill_frequency=args.mem_spill_freq if not self.offline else 0,
+            dataset_writer=TransitionShardWriter(args.dataset_dir, args.dataset_shard_size, obs_codec, action_space_n)
+            if args.dataset_dir is not None and not self.offline else None
         )
+        if self.offline:
+            self.agent.replay_memory_buffer = ReplayMemoryOffline(self.dataset, args.bs)
         print(Fore.LIGHTYELLOW_EX, self.agent.device, Fore.RESET)
         self.agent.load_model()
 
@@ -59,13 +97,23 @@ class Train:
         [print(arg, "=", getattr(args, arg)) for arg in vars(args)]
 
         self.max_total_steps = args.max_total_steps
+        self.max_episode_steps = args.max_episode_steps
+
+        self.actors = args.actors
+        self.replay_ratio = args.replay_ratio
+        self.actor_sync_freq = args.actor_sync_freq
 
     def init_replay_memory_buffer(self):
         print()
         print("Initialize Replay Memory Buffer")
 
+        # Continues a fill that was spilled to disk before a restart
+        start = len(self.agent.replay_memory_buffer.replay_buffer) // self.agent.n_env
+        if start > 0:
+            print("Resume from " + str(start * self.agent.n_env) + " transitions")
+
         obses = self.env.reset()
-        for t in range(self.agent.min_buffer_size // self.agent.n_env):
+        for t in range(start, self.agent.min_buffer_size // self.agent.n_env):
             if t >= (self.agent.min_buffer_size // self.agent.n_env) - self.agent.resume_step:
                 actions = self.agent.choose_actions(obses)
             else:
@@ -80,6 +128,8 @@ class Train:
                 print(str((t+1) * self.agent.n_env) + ' / ' + str(self.agent.min_buffer_size))
                 print(Fore.LIGHTRED_EX, '---', str(timedelta(seconds=round((time.time() - self.agent.start_time), 0))), '---', Fore.RESET)
 
+        print("Replay Memory Bytes / Transition: ", self.agent.replay_memory_buffer.replay_buffer.bytes_per_transition())
+
     def train_loop(self):
         print()
         print("Start Training")
@@ -107,10 +157,126 @@ class Train:
             if bool(self.max_total_steps) and (step * self.agent.n_env) >= self.max_total_steps:
                 exit()
 
+    def async_train_loop(self):
+        print()
+        print("Start Asynchronous Training (" + str(self.actors) + " actors, replay ratio " + str(self.replay_ratio) + ")")
+
+        mode = type(self).__name__.lower()
+        env_fn = (lambda worker_id: CustomEnvWrapper(CustomEnv(mode, worker_id=worker_id)))
+        network_fn = functools.partial(type(self.agent.online_network), device("cpu"), self.agent.lr, network_config,
+                                       self.agent.input_dim, self.agent.output_dim)
+
+        actor_pool = ActorPool(self.actors, env_fn, network_fn, max_episode_steps=self.max_episode_steps)
+
+        resume_env_steps = self.agent.resume_step * self.agent.n_env
+        env_steps = 0
+        learn_start_env_steps = None
+        step = self.agent.resume_step
+
+        actor_pool.broadcast(self.agent.online_network, self.agent.epsilon(resume_env_steps))
+
+        throughput_time, throughput_env_steps, throughput_grad_steps = time.time(), 0, step
+
+        try:
+            while True:
+                learning = learn_start_env_steps is not None
+                learn_budget = (env_steps - learn_start_env_steps) * self.replay_ratio if learning else 0
+
+                # Only wait for actors when the learner has caught up with the replay ratio
+                transitions = actor_pool.drain(actor_pool.queue_size, block=(step - self.agent.resume_step) >= learn_budget)
+
+                for obs, action, rew, done, new_obs, info in transitions:
+                    self.agent.store_transitions([obs], [action], [rew], [done], [new_obs], [info] if done else None)
+                env_steps += len(transitions)
+
+                if not learning:
+                    if len(self.agent.replay_memory_buffer.replay_buffer) >= self.agent.min_buffer_size:
+                        learn_start_env_steps = env_steps
+                    continue
+
+                n_learn = min(int(learn_budget) - (step - self.agent.resume_step), self.actor_sync_freq)
+                for _ in range(n_learn):
+                    step += 1
+                    self.agent.step = step
+
+                    self.agent.learn()
+
+                    self.agent.update_target_network()
+
+                    if self.agent.step % self.agent.log_frequency == 0:
+                        now = time.time()
+                        env_steps_per_sec = (env_steps - throughput_env_steps) / (now - throughput_time)
+                        grad_steps_per_sec = (step - throughput_grad_steps) / (now - throughput_time)
+                        throughput_time, throughput_env_steps, throughput_grad_steps = now, env_steps, step
+
+                        print()
+                        print('Env Steps / s: ', round(env_steps_per_sec, 2), ', Grad Steps / s: ', round(grad_steps_per_sec, 2))
+                        self.agent.summary_writer.add_scalar('EnvStepsPerSec', env_steps_per_sec, global_step=(step * self.agent.n_env))
+                        self.agent.summary_writer.add_scalar('GradStepsPerSec', grad_steps_per_sec, global_step=(step * self.agent.n_env))
+
+                    self.agent.log()
+
+                    self.agent.save_model()
+
+                    if step % self.actor_sync_freq == 0:
+                        actor_pool.broadcast(self.agent.online_network, self.agent.epsilon(resume_env_steps + env_steps))
+
+                if bool(self.max_total_steps) and (resume_env_steps + env_steps) >= self.max_total_steps:
+                    break
+        finally:
+            actor_pool.close()
+
+    def offline_train_loop(self):
+        print()
+        print("Start Offline Training (" + str(len(self.dataset)) + " transitions)")
+
+        throughput_time, throughput_grad_steps = time.time(), self.agent.resume_step
+
+        try:
+            for step in itertools.count(start=self.agent.resume_step):
+                self.agent.step = step
+
+                self.agent.learn()
+
+                self.agent.update_target_network()
+
+                if step % self.agent.log_frequency == 0 and step > self.agent.resume_step:
+                    now = time.time()
+                    grad_steps_per_sec = (step - throughput_grad_steps) / (now - throughput_time)
+                    throughput_time, throughput_grad_steps = now, step
+
+                    print()
+                    print('Grad Steps / s: ', round(grad_steps_per_sec, 2))
+                    self.agent.summary_writer.add_scalar('GradStepsPerSec', grad_steps_per_sec, global_step=(step * self.agent.n_env))
+
+                self.agent.log()
+
+                self.agent.save_model()
+
+                if bool(self.max_total_steps) and (step * self.agent.n_env) >= self.max_total_steps:
+                    break
+        finally:
+            self.dataset.close()
+
     def run(self):
-        self.init_replay_memory_buffer()
+        try:
+            if self.offline:
+                self.offline_train_loop()
+                return
+
+            if self.actors > 0:
+                self.async_train_loop()
+                return
+
+            # Skipped when the replay memory was restored from the checkpoint
+            if len(self.agent.replay_memory_buffer.replay_buffer) < self.agent.min_buffer_size:
+                self.init_replay_memory_buffer()
 
-        self.train_loop()
+            self.train_loop()
+        finally:
+            # Writes the last, partially filled shard
+            if self.agent.dataset_writer is not None:
+                self.agent.dataset_writer.close()
 
 
 if __name__ == "__main__":
@@ -127,6 +293,13 @@ if __name__ == "__main__":
     parser.add_argument('-bs', type=int, default=HYPER_PARAMS["bs"], help='Batch size')
     parser.add_argument('-min_mem', type=int, default=HYPER_PARAMS["min_mem"], help='Replay memory buffer min size')
     parser.add_argument('-max_mem', type=int, default=HYPER_PARAMS["max_mem"], help='Replay memory buffer max size')
+    parser.add_argument('-mem_dedup_obs', type=str2bool, default=HYPER_PARAMS["mem_dedup_obs"], help='Replay memory stores each observation once (opt-in)')
+    parser.add_argument('-mem_compress_obs', type=str2bool, default=HYPER_PARAMS["mem_compress_obs"], help='Replay memory stores quantized observations (opt-in, lossy)')
+    parser.add_argument('-mem_spill_freq', type=int, default=HYPER_PARAMS["mem_spill_freq"], help='Replay memory disk spill frequency in transitions')
+    parser.add_argument('-dataset_dir', type=str, default=HYPER_PARAMS["dataset_dir"], help='Transition dataset directory (recorded during collection, read with -offline)')
+    parser.add_argument('-dataset_shard_size', type=int, default=HYPER_PARAMS["dataset_shard_size"], help='Transitions per dataset shard')
+    parser.add_argument('-offline', type=str2bool, default=HYPER_PARAMS["offline"], help='Train only from the transition dataset, without SUMO')
+    parser.add_argument('-loader_threads', type=int, default=HYPER_PARAMS["loader_threads"], help='Offline dataset prefetching threads')
     parser.add_argument('-target_update_freq', type=int, default=HYPER_PARAMS["target_update_freq"], help='Target network update frequency')
     parser.add_argument('-target_soft_update', type=str2bool, default=HYPER_PARAMS["target_soft_update"], help='Target network soft update')
     parser.add_argument('-target_soft_update_tau', type=float, default=HYPER_PARAMS["target_soft_update_tau"], help='Target network soft update tau rate')
@@ -135,9 +308,13 @@ if __name__ == "__main__":
     parser.add_argument('-save_dir', type=str, default=HYPER_PARAMS["save_dir"], help='Save directory')
     parser.add_argument('-log_dir', type=str, default=HYPER_PARAMS["log_dir"], help='Log directory')
     parser.add_argument('-load', type=str2bool, default=HYPER_PARAMS["load"], help='Load model')
+    parser.add_argument('-save_replay', type=str2bool, default=HYPER_PARAMS["save_replay"], help='Checkpoint the replay memory')
     parser.add_argument('-repeat', type=int, default=HYPER_PARAMS["repeat"], help='Steps repeat action')
     parser.add_argument('-max_episode_steps', type=int, default=HYPER_PARAMS["max_episode_steps"], help='Episode step limit')
     parser.add_argument('-max_total_steps', type=int, default=HYPER_PARAMS["max_total_steps"], help='Max total training steps')
+    parser.add_argument('-actors', type=int, default=HYPER_PARAMS["actors"], help='Asynchronous actor processes if > 0, else synchronous training')
+    parser.add_argument('-replay_ratio', type=float, default=HYPER_PARAMS["replay_ratio"], help='Gradient steps per environment step (asynchronous training)')
+    parser.add_argument('-actor_sync_freq', type=int, default=HYPER_PARAMS["actor_sync_freq"], help='Actor network refresh frequency in gradient steps (asynchronous training)')
     parser.add_argument('-algo', type=str, default=HYPER_PARAMS["algo"],
                         help='DQNAgent ' +
                              'DoubleDQNAgent ' +